@@ -1,4 +1,33 @@
-from .flownetwork import FlowNetwork
-from .kuramotonetwork import KuramotoNetwork
-from .linearflownetwork import LinearFlowNetwork
-__all__ = ['FlowNetwork', 'KuramotoNetwork', 'LinearFlowNetwork']
+"""
+A package for flow network simulations.
+
+The network classes are imported on first access, so that ``import
+flownetpy`` stays cheap: networkx is only imported with the classes, and
+scipy only when a solver needs it. KuramotoNetwork imports the parts of
+scipy it integrates with up front, as every one of its solves needs them.
+"""
+
+import importlib
+
+_LAZY = {
+    'FlowNetwork': '.flownetwork',
+    'KuramotoNetwork': '.kuramotonetwork',
+    'LinearFlowNetwork': '.linearflownetwork',
+    'NonlinearFlowNetwork': '.nonlinearflownetwork',
+}
+
+__all__ = ['FlowNetwork', 'KuramotoNetwork', 'LinearFlowNetwork', 'NonlinearFlowNetwork']
+
+
+def __getattr__(name):
+    try:
+        module = _LAZY[name]
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,347 @@
+"""
+Batched steady state solves: many inputs on one network at once.
+
+The linear model solves all inputs with one multi right hand side solve
+of the factorized Laplacian, the Kuramoto model integrates the stacked
+copies of the network as one system, starting from the linear response.
+
+In single precision the Laplacian factors, the right hand side
+evaluations and the stored trajectories are float32, which halves their
+memory and bandwidth, and the results are refined in double precision
+afterwards, so that they meet the same tolerance.
+
+Many small networks, say the members of a random graph ensemble, are
+solved together by :func:`solve_stacked`: a :class:`Stack` puts them
+side by side as the blocks of one block diagonal compiled network, so
+that the linear model takes a single factorization and solve, and the
+Kuramoto model single Newton steps, each with one factorization of the
+whole stack and a line search per block, and a single integration of
+the blocks Newton's method leaves over. Convergence is tracked per
+block, and the results are split back per network.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+from .compiled import CompiledNetwork
+from .integrators import Integrator, get_integrator
+
+#: dtypes of the precisions of :func:`solve_batch`
+PRECISIONS = {'double': np.float64, 'single': np.float32}
+
+#: tolerances of the integration in single precision; a float32 right hand
+#: side cannot be integrated to the default ones
+SINGLE_RTOL = 1e-4
+SINGLE_ATOL = 1e-5
+
+
+def solve_batch(compiled, model, inputs, integrator=None, precision='double', tol=1e-10):
+    """
+    Solves the steady flows of `compiled` for a batch of inputs.
+
+    In single precision, the Laplacian factors, the right hand side
+    evaluations of the batched Kuramoto integration and its stored
+    trajectory are float32, and an integrator given by name runs with
+    the looser tolerances SINGLE_RTOL and SINGLE_ATOL. The results are
+    then refined in double
+    precision: by iterative refinement of the linear solve, and by Newton
+    steps from the integrated phases for the Kuramoto model, until the
+    steady state equations hold to `tol`.
+
+    Args:
+        compiled: a :class:`flownetpy.compiled.CompiledNetwork`
+        model: 'linear' or 'kuramoto'
+        inputs: matrix of shape (k, n_nodes)
+        integrator: integrator backend of the Kuramoto model
+        precision: 'double' or 'single'
+        tol: tolerance of the refinement in single precision: relative
+            for the linear model, absolute on the Kuramoto right hand side
+
+    Returns:
+        (flows, converged): a (k, n_edges) matrix of flows, in the order of
+        ``compiled.edges()``, and a boolean array telling which rows have
+        a steady state; the other rows are nan
+    """
+    try:
+        dtype = PRECISIONS[precision]
+    except KeyError:
+        raise ValueError("Unknown precision %r, choose one of %s" %
+                         (precision, ', '.join(sorted(PRECISIONS))))
+    inputs = np.asarray(inputs, dtype=float)
+    k = inputs.shape[0]
+    x = compiled.laplacian_solver(dtype).solve(inputs.T, tol=tol)
+    if model == 'linear':
+        diff = x[compiled.head] - x[compiled.tail]
+        return (compiled.weights[:, np.newaxis] * diff).T, np.ones(k, dtype=bool)
+
+    from .kuramotonetwork import (KuramotoNetwork, KuramotoRHS, KuramotoJacobian,
+                                  NTRY, TMAX, odeint)
+
+    # the k copies are integrated as one system, from the linear response
+    if dtype != np.float64 and not isinstance(integrator, Integrator):
+        batch_integrator = get_integrator(integrator, rtol=SINGLE_RTOL, atol=SINGLE_ATOL)
+    else:
+        batch_integrator = get_integrator(integrator)
+    integrator = get_integrator(integrator)
+    n = compiled.n_nodes
+    # integrated in the locality ordering of the network
+    ordering = compiled.ordering()
+    local = compiled.local()
+    x0, local_inputs = x, inputs.T
+    if ordering is not None:
+        x0, local_inputs = ordering.to_local(x), ordering.to_local(local_inputs)
+    rhs = KuramotoRHS(local, inputs=local_inputs, dtype=dtype)
+    jac = None
+    if batch_integrator.jacobian is not None:
+        jac = KuramotoJacobian(local, dense=batch_integrator.jacobian == 'dense')
+    tarr = np.arange(0, TMAX, TMAX / 1000)
+    sol = odeint(lambda t, th: rhs(t, th.reshape(n, k)).ravel(), x0.ravel(), t=tarr,
+                 jac=jac, integrator=batch_integrator, dtype=dtype)
+    sol = sol.reshape(tarr.size, n, k)
+    window = sol[-(tarr.size // 10):]
+    converged = np.all(np.isclose(np.var(window, axis=0, dtype=float), 0), axis=0)
+    thetas = sol[-1].astype(float)
+    if ordering is not None:
+        thetas = ordering.from_local(thetas)
+    del sol, window
+
+    if dtype != np.float64:
+        from .multilevel import newton
+
+        for i in np.flatnonzero(converged):
+            thetas[:, i], converged[i] = newton(compiled.with_inputs(inputs[i]),
+                                                thetas[:, i], tol=tol)
+
+    # copies that did not settle are retried one by one
+    for i in np.flatnonzero(~converged):
+        shifted = compiled.with_inputs(inputs[i])
+        fixed_point = KuramotoNetwork._from_compiled(shifted)._try_find_fps(
+            NTRY, integrator=integrator, warmstart=x[:, i], compiled=shifted)[0]
+        if fixed_point is not None:
+            thetas[:, i] = fixed_point
+            converged[i] = True
+
+    flows = compiled.weights[:, np.newaxis] * np.sin(thetas[compiled.head] - thetas[compiled.tail])
+    flows[:, ~converged] = np.nan
+    return flows.T, converged
+
+
+class Stack(object):
+    """
+    Networks stacked as the blocks of one block diagonal compiled network.
+
+    The nodes and edges of the i-th network are those of
+    ``networks[i].compile()``, shifted by ``node_offsets[i]`` and
+    ``edge_offsets[i]``; the stacked nodes are numbered from 0.
+
+    Args:
+        networks: a list of FlowNetworks or CompiledNetworks. Building
+            them with :meth:`flownetpy.FlowNetwork.from_arrays` or as
+            CompiledNetworks skips the networkx graphs altogether.
+
+    Attributes:
+        networks: the list of compiled networks
+        compiled: the stacked :class:`flownetpy.compiled.CompiledNetwork`
+        node_offsets, edge_offsets: int arrays of size n_blocks + 1
+        node_blocks, edge_blocks: the block of every stacked node and edge
+    """
+
+    def __init__(self, networks):
+        from .resistance import _compiled
+
+        self.networks = [_compiled(network) for network in networks]
+        n_nodes = [compiled.n_nodes for compiled in self.networks]
+        n_edges = [compiled.n_edges for compiled in self.networks]
+        self.node_offsets = np.concatenate([[0], np.cumsum(n_nodes)]).astype(np.intp)
+        self.edge_offsets = np.concatenate([[0], np.cumsum(n_edges)]).astype(np.intp)
+        self.node_blocks = np.repeat(np.arange(self.n_blocks), n_nodes)
+        self.edge_blocks = np.repeat(np.arange(self.n_blocks), n_edges)
+
+        def stacked(name):
+            arrays = [getattr(compiled, name) for compiled in self.networks]
+            return np.concatenate(arrays) if arrays else np.zeros(0)
+
+        shift = self.node_offsets[self.edge_blocks]
+        self.compiled = CompiledNetwork(range(self.node_offsets[-1]),
+                                        stacked('head').astype(np.intp) + shift,
+                                        stacked('tail').astype(np.intp) + shift,
+                                        stacked('weights'), stacked('inputs'))
+
+    @property
+    def n_blocks(self):
+        return len(self.networks)
+
+    def block_max(self, values, edges=False):
+        """
+        Returns the maximum of per node values, or per edge values if
+        `edges` is True, over every block; 0 for empty blocks.
+        """
+        out = np.zeros(self.n_blocks)
+        np.maximum.at(out, self.edge_blocks if edges else self.node_blocks, values)
+        return out
+
+    def split_nodes(self, values):
+        """
+        Splits per node values of the stack, along the first axis, into a
+        list of arrays, one per network.
+        """
+        return np.split(np.asarray(values), self.node_offsets[1:-1])
+
+    def split_edges(self, values):
+        """
+        Splits per edge values of the stack, along the first axis, into a
+        list of arrays, one per network.
+        """
+        return np.split(np.asarray(values), self.edge_offsets[1:-1])
+
+    def sub_stack(self, blocks):
+        """
+        Returns the :class:`Stack` of the networks of the given blocks.
+        """
+        return Stack([self.networks[i] for i in blocks])
+
+
+def solve_stacked(networks, model, integrator=None, tol=1e-10, max_iter=20, max_halvings=8,
+                  as_dicts=False):
+    """
+    Solves the steady flows of many networks at once, on their
+    :class:`Stack`.
+
+    The linear model is solved with one factorization of the stacked
+    Laplacian. The Kuramoto model starts from the linear response with
+    Newton steps on the whole stack: every step factorizes the stacked
+    Jacobian once, and every block has its own line search and drops out
+    when its right hand side is below `tol`, or when one of its edges
+    leaves the stable region. The blocks Newton's method fails on are
+    integrated from their linear response, and then from up to NTRY
+    random initial conditions, as
+    :meth:`flownetpy.KuramotoNetwork.steady_flows` does; every round
+    integrates the blocks that have not settled yet as one system.
+
+    Args:
+        networks: a list of FlowNetworks or CompiledNetworks, or a Stack
+        model: 'linear' or 'kuramoto'
+        integrator: integrator backend of the Kuramoto model
+        tol: the largest right hand side of the Kuramoto model accepted
+            from Newton's method
+        max_iter: maximal number of Newton steps
+        max_halvings: maximal number of times the line search of a block
+            halves its step
+        as_dicts: if True, the flows are returned as
+            :class:`flownetpy.tools.FlowDict`s rather than arrays
+
+    Returns:
+        (flows, converged): the list of the flows of every network, in the
+        order of ``compile().edges()``, or None if no steady state is
+        found, and a boolean array telling which networks have one
+    """
+    if model not in ('linear', 'kuramoto'):
+        raise ValueError("Unknown model %r, choose 'linear' or 'kuramoto'" % (model,))
+    stack = networks if isinstance(networks, Stack) else Stack(networks)
+    compiled = stack.compiled
+    x = compiled.laplacian_solver().solve(compiled.inputs)
+    converged = np.ones(stack.n_blocks, dtype=bool)
+    if model == 'kuramoto':
+        x, converged = _stacked_newton(stack, x, tol, max_iter, max_halvings)
+        if not np.all(converged):
+            _stacked_integration(stack, x, converged, integrator)
+        flows = compiled.weights * np.sin(x[compiled.head] - x[compiled.tail])
+    else:
+        flows = compiled.weights * (x[compiled.head] - x[compiled.tail])
+
+    results = []
+    for network, block_flows, ok in zip(stack.networks, stack.split_edges(flows), converged):
+        if not ok:
+            results.append(None)
+        else:
+            results.append(network.flow_dict(block_flows) if as_dicts else block_flows)
+    return results, converged
+
+
+def _stacked_newton(stack, x, tol, max_iter, max_halvings):
+    """
+    Newton steps on the Kuramoto model of a stack, with a line search and
+    convergence per block. Returns (x, converged).
+    """
+    from .kuramotonetwork import KuramotoRHS
+    from .laplacian import LaplacianSolver
+
+    compiled = stack.compiled
+    head, tail, weights = compiled.head, compiled.tail, compiled.weights
+    node_blocks, edge_blocks = stack.node_blocks, stack.edge_blocks
+    rhs = KuramotoRHS(compiled)
+    ordering = compiled.ordering()
+    order = None if ordering is None else ordering.nodes
+    x = np.array(x, dtype=float)
+    F = rhs(0, x).copy()
+    residuals = stack.block_max(np.abs(F))
+    failed = np.zeros(stack.n_blocks, dtype=bool)
+    for _ in range(max_iter):
+        gains = weights * np.cos(x[head] - x[tail])
+        failed |= stack.block_max((gains <= 0) & (weights > 0), edges=True) > 0
+        active = (residuals >= tol) & ~failed
+        if not np.any(active):
+            break
+        # the other blocks keep their weights, which keeps them nonsingular;
+        # their right hand side is zero, and so is their step
+        gains = np.where(active[edge_blocks], gains, weights)
+        step = LaplacianSolver(compiled.laplacian(weights=gains), order=order).solve(
+            np.where(active[node_blocks], F, 0))
+        t = np.ones(stack.n_blocks)
+        pending = active
+        for _ in range(max_halvings + 1):
+            trial = x + t[node_blocks] * step
+            trial_F = rhs(0, trial)
+            trial_residuals = stack.block_max(np.abs(trial_F))
+            accepted = pending & (trial_residuals < residuals)
+            nodes = accepted[node_blocks]
+            x[nodes], F[nodes] = trial[nodes], trial_F[nodes]
+            residuals[accepted] = trial_residuals[accepted]
+            pending = pending & ~accepted
+            if not np.any(pending):
+                break
+            t[pending] /= 2
+        failed |= pending
+
+    gains = np.cos(x[head] - x[tail])
+    unstable = stack.block_max((gains <= 0) & (weights > 0), edges=True) > 0
+    return x, (residuals < tol) & ~unstable
+
+
+def _stacked_integration(stack, x, converged, integrator):
+    """
+    Integrates the blocks of a stack that are not converged as one system,
+    first from their linear response and then from up to NTRY random
+    initial conditions, each round integrating the blocks that have not
+    settled yet. Updates x and converged in place.
+    """
+    from .flowmodel.kuramoto import random_stable_initguess
+    from .kuramotonetwork import KuramotoRHS, KuramotoJacobian, NTRY, TMAX, odeint
+
+    integrator = get_integrator(integrator)
+    tarr = np.arange(0, TMAX, TMAX / 1000)
+    blocks = np.flatnonzero(~converged)
+    for attempt in range(NTRY + 1):
+        if blocks.size == 0:
+            break
+        sub = stack.sub_stack(blocks)
+        compiled = sub.compiled
+        if attempt == 0:
+            x0 = compiled.laplacian_solver().solve(compiled.inputs)
+        else:
+            x0 = np.concatenate([random_stable_initguess(network.n_nodes)
+                                 for network in sub.networks])
+        jac = None
+        if integrator.jacobian is not None:
+            jac = KuramotoJacobian(compiled, dense=integrator.jacobian == 'dense')
+        sol = odeint(KuramotoRHS(compiled), x0, t=tarr, jac=jac, integrator=integrator)
+        # settled blocks have a constant trajectory over the last tenth
+        window = sol[-(tarr.size // 10):]
+        settled = ~(sub.block_max(~np.isclose(np.var(window, axis=0), 0)) > 0)
+        for block, thetas, ok in zip(blocks, sub.split_nodes(sol[-1]), settled):
+            if ok:
+                x[stack.node_offsets[block]:stack.node_offsets[block + 1]] = thetas
+        converged[blocks[settled]] = True
+        blocks = blocks[~settled]
+        del sol, window
@@ -0,0 +1,240 @@
+"""
+Scaling benchmarks of the flownetpy solvers.
+
+Run as ``python -m flownetpy.bench``; see ``python -m flownetpy.bench -h``.
+Every measurement is one JSON record on its own line:
+
+    {"benchmark": "linear.steady_flows", "family": "ring", "n_nodes": 1000,
+     "n_edges": 1000, "wall_time": 0.0021, "peak_memory": 123456,
+     "rhs_evals": null, "jac_evals": null, ...}
+
+``wall_time`` is the best of the repeats in seconds and ``peak_memory`` the
+peak of the memory allocated during one more run, as traced by
+tracemalloc. ``python -m flownetpy.bench compare old.jsonl new.jsonl``
+lists the measurements that got slower between two such files.
+"""
+
+from __future__ import division, print_function
+
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from ..integrators import Integrator, get_integrator
+from .generators import FAMILIES, MAX_NODES as FAMILY_MAX_NODES, balanced_inputs
+
+BENCHMARKS = ('linear.steady_flows', 'kuramoto.steady_flows',
+              'kuramoto._evolve', 'kuramoto._omega')
+
+#: largest size of the default runs, and of the runs with ``--large``
+MAX_NODES = 10**4
+LARGE_MAX_NODES = 10**6
+
+
+class _CountingIntegrator(Integrator):
+    """
+    Wraps an integrator and adds up the evaluations counted by the
+    right hand side and jacobian objects it is called with.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.thread_safe = inner.thread_safe
+        self.jacobian = inner.jacobian
+        self.copies_output = inner.copies_output
+        self.nfev = self.njev = 0
+
+    def integrate(self, func, x0, t, args=(), jac=None, final_only=False, dtype=np.float64):
+        nfev, njev = getattr(func, 'nfev', 0), getattr(jac, 'njev', 0)
+        try:
+            return self.inner.integrate(func, x0, t, args=args, jac=jac,
+                                        final_only=final_only, dtype=dtype)
+        finally:
+            self.nfev += getattr(func, 'nfev', 0) - nfev
+            self.njev += getattr(jac, 'njev', 0) - njev
+
+    def reset(self):
+        self.inner.reset()
+
+
+class Case(object):
+    """
+    A generated network of one family and size, with balanced inputs and,
+    for the Kuramoto model, a uniform coupling twice as large as the
+    largest linear flow, so that a stable fixed point exists.
+    """
+
+    def __init__(self, family, n_nodes, seed=0):
+        from .. import LinearFlowNetwork
+
+        rng = np.random.RandomState(seed)
+        self.family = family
+        self.edges, self.n_nodes = FAMILIES[family](n_nodes, rng)
+        self.inputs = balanced_inputs(self.n_nodes, rng)
+
+        compiled = LinearFlowNetwork.from_arrays(self.edges, 1., self.inputs).compile()
+        pressures = compiled.laplacian_solver().solve(compiled.inputs)
+        max_flow = np.abs(pressures[compiled.head] - pressures[compiled.tail]).max()
+        self.coupling = 2 * max_flow
+        # the linear response of the phases, close to the stable fixed point
+        self.initguess = pressures / self.coupling
+
+    @property
+    def n_edges(self):
+        return self.edges.shape[0]
+
+    def linear(self):
+        from .. import LinearFlowNetwork
+        return LinearFlowNetwork.from_arrays(self.edges, 1., self.inputs)
+
+    def kuramoto(self):
+        from .. import KuramotoNetwork
+        return KuramotoNetwork.from_arrays(self.edges, self.coupling, self.inputs)
+
+
+def _task(name, case, integrator):
+    """
+    Returns a function running the benchmark `name` once on `case`
+    """
+    if name == 'linear.steady_flows':
+        return lambda: case.linear().steady_flows()
+    if name == 'kuramoto.steady_flows':
+        return lambda: case.kuramoto().steady_flows(initguess=case.initguess,
+                                                     integrator=integrator)
+    if name == 'kuramoto._evolve':
+        tarr = np.linspace(0, 10, 100)
+        return lambda: case.kuramoto()._evolve(tarr, initguess=case.initguess,
+                                               integrator=integrator, final_only=True)
+    if name == 'kuramoto._omega':
+        from ..kuramotonetwork import _winding_numbers
+        net = case.kuramoto()
+
+        def omega():
+            # the cycle basis is part of the cost, as in steady_flows
+            compiled = net.compile()
+            compiled._cycle_basis = None
+            return _winding_numbers(compiled.cycle_basis(), case.initguess)
+        return omega
+    raise ValueError("Unknown benchmark %r, choose one of %s" % (name, ', '.join(BENCHMARKS)))
+
+
+def run_benchmark(name, case, repeats=3, memory=True, integrator=None):
+    """
+    Runs one benchmark on a :class:`Case` and returns its record.
+    """
+    counter = _CountingIntegrator(get_integrator(integrator))
+    task = _task(name, case, counter)
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        task()
+        times.append(time.perf_counter() - start)
+    runs = max(repeats, 1)
+    counted = name.startswith('kuramoto.') and name != 'kuramoto._omega'
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            task()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'benchmark': name,
+        'family': case.family,
+        'n_nodes': case.n_nodes,
+        'n_edges': case.n_edges,
+        'repeats': repeats,
+        'wall_time': min(times) if times else None,
+        'peak_memory': peak,
+        'rhs_evals': counter.nfev // runs if counted else None,
+        'jac_evals': counter.njev // runs if counted else None,
+        'integrator': repr(counter.inner) if counted else None,
+    }
+
+
+def environment():
+    """
+    Returns a record describing the versions the benchmarks ran with
+    """
+    import scipy
+    import networkx
+    try:
+        from importlib.metadata import version
+        flownetpy_version = version('flownetpy')
+    except Exception:
+        flownetpy_version = 'unknown'
+    return {
+        'flownetpy': flownetpy_version,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'networkx': networkx.__version__,
+        'machine': platform.machine(),
+    }
+
+
+def run_suite(families=None, sizes=None, benchmarks=BENCHMARKS, repeats=3,
+              memory=True, integrator=None, max_kuramoto_nodes=MAX_NODES, seed=0):
+    """
+    Runs every benchmark on every family and size and yields the records.
+
+    Args:
+        families: names in :data:`flownetpy.bench.generators.FAMILIES`,
+            defaults to all of them
+        sizes: target node counts, defaults to 10, 100, ..., MAX_NODES.
+            A family is skipped above its entry in
+            :data:`flownetpy.bench.generators.MAX_NODES`.
+        max_kuramoto_nodes: the Kuramoto benchmarks are skipped above
+            this size
+    """
+    families = families or sorted(FAMILIES)
+    sizes = sizes or [10**k for k in range(1, int(np.log10(MAX_NODES)) + 1)]
+    env = environment()
+    for family in families:
+        for size in sizes:
+            if size > FAMILY_MAX_NODES.get(family, size):
+                continue
+            case = Case(family, size, seed=seed)
+            for name in benchmarks:
+                if name.startswith('kuramoto.') and case.n_nodes > max_kuramoto_nodes:
+                    continue
+                record = run_benchmark(name, case, repeats=repeats, memory=memory,
+                                       integrator=integrator)
+                record.update(env)
+                yield record
+
+
+def read_records(path):
+    """
+    Reads a file of JSON records written by the benchmark runner
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(old, new, threshold=1.2):
+    """
+    Matches the records of two runs and returns a list of
+    (benchmark, family, n_nodes, old_time, new_time, ratio, regressed) tuples.
+    A measurement regressed if its time grew by more than `threshold`.
+    """
+    def key(record):
+        return record['benchmark'], record['family'], record['n_nodes']
+
+    old = {key(record): record for record in old}
+    rows = []
+    for record in new:
+        before = old.get(key(record))
+        if before is None or not before['wall_time'] or record['wall_time'] is None:
+            continue
+        ratio = record['wall_time'] / before['wall_time']
+        rows.append(key(record) + (before['wall_time'], record['wall_time'], ratio,
+                                   ratio > threshold))
+    return rows
@@ -0,0 +1,87 @@
+"""
+Command line entry point of the benchmarks: ``python -m flownetpy.bench``
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+from . import BENCHMARKS, MAX_NODES, LARGE_MAX_NODES, run_suite, read_records, compare
+from .generators import FAMILIES
+
+
+def _sizes(args):
+    if args.sizes:
+        return args.sizes
+    max_nodes = args.max_nodes
+    if max_nodes is None:
+        max_nodes = LARGE_MAX_NODES if args.large else MAX_NODES
+    sizes, size = [], args.min_nodes
+    while size <= max_nodes:
+        sizes.append(size)
+        size *= 10
+    return sizes
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in ('run', 'compare', '-h', '--help'):
+        argv.insert(0, 'run')
+
+    parser = argparse.ArgumentParser(prog='python -m flownetpy.bench',
+                                     description=__doc__)
+    commands = parser.add_subparsers(dest='command')
+
+    run = commands.add_parser('run', help='run the benchmarks (default)')
+    run.add_argument('--families', nargs='+', choices=sorted(FAMILIES))
+    run.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    run.add_argument('--sizes', nargs='+', type=int,
+                     help='node counts; overrides --min-nodes/--max-nodes')
+    run.add_argument('--min-nodes', type=int, default=10)
+    run.add_argument('--max-nodes', type=int, default=None,
+                     help='defaults to %d, or %d with --large' % (MAX_NODES, LARGE_MAX_NODES))
+    run.add_argument('--large', action='store_true',
+                     help='run the linear benchmarks up to %d nodes; the Kuramoto ones '
+                          'stay below --max-kuramoto-nodes' % LARGE_MAX_NODES)
+    run.add_argument('--max-kuramoto-nodes', type=int, default=MAX_NODES)
+    run.add_argument('--repeats', type=int, default=3)
+    run.add_argument('--integrator', default=None,
+                     help='integrator backend of the Kuramoto benchmarks')
+    run.add_argument('--no-memory', action='store_true',
+                     help='skip the peak memory measurement')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('-o', '--output', help='append the records to this file')
+
+    cmp = commands.add_parser('compare', help='compare two result files')
+    cmp.add_argument('old')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=1.2)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        rows = compare(read_records(args.old), read_records(args.new), args.threshold)
+        for name, family, n, before, after, ratio, regressed in rows:
+            print('%-24s %-12s %9d %10.4g %10.4g %6.2fx%s' % (
+                name, family, n, before, after, ratio, '  REGRESSION' if regressed else ''))
+        return 1 if any(row[-1] for row in rows) else 0
+
+    out = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for record in run_suite(families=args.families, sizes=_sizes(args),
+                                benchmarks=args.benchmarks, repeats=args.repeats,
+                                memory=not args.no_memory, integrator=args.integrator,
+                                max_kuramoto_nodes=args.max_kuramoto_nodes,
+                                seed=args.seed):
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Generators of network families for scaling benchmarks.
+
+Every generator takes a target number of nodes and a numpy RandomState and
+returns ``(edges, n_nodes)``, with ``edges`` an int array of shape
+(n_edges, 2) of node indices. All of them build connected graphs in
+O(n log n) time without going through networkx, so that they scale to
+millions of nodes.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+
+def ring(n, rng=None):
+    """
+    A cycle of n nodes
+    """
+    nodes = np.arange(n)
+    return np.column_stack([nodes, (nodes + 1) % n]), n
+
+
+def lattice(n, rng=None):
+    """
+    A square 2D lattice with about n nodes (open boundaries)
+    """
+    side = max(int(round(np.sqrt(n))), 2)
+    idx = np.arange(side * side).reshape(side, side)
+    horizontal = np.column_stack([idx[:, :-1].ravel(), idx[:, 1:].ravel()])
+    vertical = np.column_stack([idx[:-1, :].ravel(), idx[1:, :].ravel()])
+    return np.concatenate([horizontal, vertical]), side * side
+
+
+def tree(n, rng=None):
+    """
+    A complete binary tree with n nodes
+    """
+    children = np.arange(1, n)
+    return np.column_stack([(children - 1) // 2, children]), n
+
+
+def small_world(n, rng=None, k=4, p=0.1):
+    """
+    A Watts-Strogatz graph: a ring where every node is joined to its k
+    nearest neighbours, and the far end of every edge beyond the ring
+    itself is rewired to a random node with probability p.
+    """
+    rng = rng or np.random.RandomState(0)
+    nodes = np.arange(n)
+    edges = [np.column_stack([nodes, (nodes + 1) % n])]
+    for j in range(2, k // 2 + 1):
+        far = (nodes + j) % n
+        rewire = rng.uniform(size=n) < p
+        far[rewire] = rng.randint(0, n, size=rewire.sum())
+        edges.append(np.column_stack([nodes, far]))
+    return _simple(np.concatenate(edges)), n
+
+
+def power_grid(n, rng=None, k=2):
+    """
+    A synthetic meshed power-grid-like graph: n random points in the unit
+    square, joined by a short serpentine spanning path and to their k
+    nearest neighbours. The mean degree is about 3, as in transmission
+    grids.
+    """
+    from scipy.spatial import cKDTree
+
+    rng = rng or np.random.RandomState(0)
+    points = rng.uniform(size=(n, 2))
+
+    # a spanning path through vertical strips, alternately up and down
+    n_strips = max(int(np.sqrt(n / 2)), 1)
+    strip = np.minimum((points[:, 0] * n_strips).astype(int), n_strips - 1)
+    y = np.where(strip % 2 == 0, points[:, 1], -points[:, 1])
+    order = np.lexsort((y, strip))
+    edges = [np.column_stack([order[:-1], order[1:]])]
+
+    if n > k:
+        neighbours = cKDTree(points).query(points, k=k + 1)[1][:, 1:]
+        edges.append(np.column_stack([np.repeat(np.arange(n), k), neighbours.ravel()]))
+    return _simple(np.concatenate(edges)), n
+
+
+def _simple(edges):
+    """
+    Removes self loops and duplicate edges
+    """
+    edges = np.sort(edges, axis=1)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    return np.unique(edges, axis=0)
+
+
+FAMILIES = {
+    'ring': ring,
+    'lattice': lattice,
+    'tree': tree,
+    'small_world': small_world,
+    'power_grid': power_grid,
+}
+
+#: Largest size benchmarked per family, where it is below the largest
+#: size asked for. The sparse LU factorization of the random long range
+#: edges of a small world graph fills in: at 10**5 nodes a solve takes
+#: 45 s, and at 10**6 it does not fit in a few GB of memory.
+MAX_NODES = {
+    'small_world': 10**5,
+}
+
+
+def balanced_inputs(n, rng):
+    """
+    Random inputs that sum to zero
+    """
+    inputs = rng.normal(size=n)
+    return inputs - inputs.mean()
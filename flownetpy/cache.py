@@ -0,0 +1,270 @@
+"""
+Memoization of steady state solutions.
+
+A :class:`SolutionCache` maps (network, inputs) to a solved steady state.
+The network part of the key is a content hash of the compiled network
+(topology, weights) and of the model, so equal networks share entries no
+matter how they were built. Entries live in an in-memory LRU tier and,
+optionally, in a directory on disk that is trimmed to a maximum size by
+evicting the least recently used files.
+
+Several processes may share a directory: every writer saves to a temporary
+file of its own and renames it into place, and files that another process
+removed in the meantime are skipped. A writer trims the directory when the
+bytes it has seen there, plus the bytes it wrote since, exceed
+`max_bytes`, and at the latest after writing `max_bytes / 16` bytes, so the
+directory exceeds its limit by at most that much per writer.
+
+Pass a cache to ``steady_flows(cache=...)`` to use it. Exact hits are
+returned without solving; for a Kuramoto network, the cached solution
+whose inputs are closest to the requested ones is used as a warm start.
+"""
+
+from __future__ import division
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+#: The arrays an entry may hold; winding is the vector of winding numbers
+#: of a Kuramoto solution along the cycle basis
+ENTRY_FIELDS = ('inputs', 'flows', 'thetas', 'winding', 'initguess')
+
+#: suffix of the files being written
+TMP_SUFFIX = '.tmp'
+
+#: seconds after which a temporary file is taken for the leftover of a
+#: crashed writer and evicted
+STALE_TMP = 3600.
+
+
+def _digest(*parts):
+    """
+    Returns a hex digest of a sequence of arrays, strings and None
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if part is None:
+            h.update(b'None;')
+        elif isinstance(part, str):
+            h.update(part.encode('utf8') + b';')
+        else:
+            arr = np.ascontiguousarray(part)
+            h.update(('%s%r;' % (arr.dtype.str, arr.shape)).encode('utf8'))
+            h.update(arr.view(np.uint8).ravel())
+    return h.hexdigest()
+
+
+class SolutionCache(object):
+    """
+    A two tier cache of steady state solutions.
+
+    Args:
+        maxsize: maximal number of entries kept in memory
+        directory: directory of the on-disk tier; None disables it
+        max_bytes: size limit of the on-disk tier
+    """
+
+    def __init__(self, maxsize=128, directory=None, max_bytes=2**30):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+        # bytes of the on-disk tier at the last scan, and written since
+        self._disk_bytes = None
+        self._written = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, compiled, model, *extra):
+        """
+        Returns the network part of the key of `compiled` solved by `model`.
+
+        Args:
+            compiled: a :class:`flownetpy.compiled.CompiledNetwork`
+            model: a string naming the flow model
+            extra: further arrays (or None) that change the solution,
+                e.g. an initial guess
+        """
+        return _digest(model, np.array([compiled.n_nodes]), compiled.head,
+                       compiled.tail, compiled.weights, *extra)
+
+    def _path(self, key, inputs_key=None):
+        path = os.path.join(self.directory, key)
+        if inputs_key is not None:
+            path = os.path.join(path, inputs_key + '.npz')
+        return path
+
+    def get(self, key, inputs):
+        """
+        Returns the entry stored for `inputs` under `key`, or None.
+
+        An entry is a dictionary with some of the arrays in
+        :data:`ENTRY_FIELDS`.
+        """
+        inputs_key = _digest(np.asarray(inputs, dtype=float))
+        with self._lock:
+            entry = self._memory.get((key, inputs_key))
+            if entry is not None:
+                self._memory.move_to_end((key, inputs_key))
+                self.hits += 1
+                return entry
+
+            if self.directory is not None:
+                path = self._path(key, inputs_key)
+                try:
+                    entry = self._read(path)
+                except (IOError, OSError, ValueError, EOFError):
+                    entry = None
+                if entry is not None:
+                    try:
+                        os.utime(path, None)
+                    except OSError:
+                        pass
+                    self._remember(key, inputs_key, entry)
+                    self.hits += 1
+                    return entry
+
+            self.misses += 1
+            return None
+
+    def nearest(self, key, inputs):
+        """
+        Returns the entry stored under `key` whose inputs are closest to
+        `inputs` in euclidean norm, or None if there is none.
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        best, best_dist = None, np.inf
+        with self._lock:
+            candidates = [entry for (k, _), entry in self._memory.items() if k == key]
+        for entry in candidates:
+            dist = np.linalg.norm(entry['inputs'] - inputs)
+            if dist < best_dist:
+                best, best_dist = entry, dist
+
+        if self.directory is not None and os.path.isdir(self._path(key)):
+            try:
+                names = os.listdir(self._path(key))
+            except OSError:
+                names = []
+            for name in names:
+                if name.endswith(TMP_SUFFIX):
+                    continue
+                try:
+                    with np.load(os.path.join(self._path(key), name)) as data:
+                        dist = np.linalg.norm(data['inputs'] - inputs)
+                        if dist < best_dist:
+                            best, best_dist = {f: data[f] for f in data.files}, dist
+                except (IOError, OSError, ValueError, EOFError, KeyError):
+                    continue
+        return best
+
+    def put(self, key, inputs, **arrays):
+        """
+        Stores a solution for `inputs` under `key`.
+
+        Args:
+            arrays: the arrays of the entry, among :data:`ENTRY_FIELDS`;
+                None values are left out.
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        entry = {'inputs': inputs.copy()}
+        for field, value in arrays.items():
+            if field not in ENTRY_FIELDS:
+                raise ValueError("Unknown cache field %r" % field)
+            if value is not None:
+                entry[field] = np.array(value, dtype=float)
+
+        inputs_key = _digest(inputs)
+        with self._lock:
+            self._remember(key, inputs_key, entry)
+            if self.directory is not None:
+                self._write(key, inputs_key, entry)
+
+    def _remember(self, key, inputs_key, entry):
+        self._memory[(key, inputs_key)] = entry
+        self._memory.move_to_end((key, inputs_key))
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _read(path):
+        with np.load(path) as data:
+            return {field: data[field] for field in data.files}
+
+    def _write(self, key, inputs_key, entry):
+        os.makedirs(self._path(key), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=TMP_SUFFIX, dir=self._path(key))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **entry)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, self._path(key, inputs_key))
+        except BaseException:
+            _remove(tmp)
+            raise
+        self._written += size
+
+        if self._disk_bytes is None:
+            self._evict()
+        elif (self._disk_bytes + self._written > self.max_bytes
+                or self._written > self.max_bytes // 16):
+            self._evict()
+
+    def _evict(self):
+        """
+        Deletes the least recently used files until the on-disk tier
+        fits into max_bytes. The files being written by other processes
+        are left alone.
+        """
+        files = []
+        now = time.time()
+        for dirpath, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(TMP_SUFFIX) and now - stat.st_mtime < STALE_TMP:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+        self._disk_bytes = total
+        self._written = 0
+
+    def clear(self):
+        """
+        Empties both tiers.
+        """
+        with self._lock:
+            self._memory.clear()
+            if self.directory is not None:
+                for dirpath, _, names in os.walk(self.directory):
+                    for name in names:
+                        _remove(os.path.join(dirpath, name))
+                self._disk_bytes = None
+                self._written = 0
+
+
+def _remove(path):
+    """
+    Removes a file, which another process may have removed already
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
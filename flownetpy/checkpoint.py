@@ -0,0 +1,145 @@
+"""
+Append-only checkpoint files for long runs.
+
+A checkpoint is a sequence of records, each written with a single append
+and flushed to disk:
+
+    b'FNCK' | payload length (uint64) | crc32 of the payload (uint32) | payload
+
+The first record is a JSON header describing the run; the next ones are
+states, each an npz archive of arrays. A record cut short by a crash
+fails its length or checksum test, and it and everything after it are
+dropped when the file is reopened, so a resumed run continues from the
+last complete state. Only the last state is needed to resume: after
+`max_states` states the file is atomically rewritten with the header and
+the last state alone, which bounds its size. Runs whose states are
+independent parts of the result, such as the shards of a sweep, keep
+every state with ``max_states=None`` and read them back with
+:meth:`Checkpoint.states`.
+"""
+
+from __future__ import division
+
+import io
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'FNCK'
+_HEAD = struct.Struct('<4sQI')
+
+
+def _read_records(path):
+    """
+    Returns ([payloads], end offset of the last complete record)
+    """
+    records, end = [], 0
+    with open(path, 'rb') as f:
+        while True:
+            head = f.read(_HEAD.size)
+            if len(head) < _HEAD.size:
+                break
+            magic, length, crc = _HEAD.unpack(head)
+            payload = f.read(length)
+            if magic != MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(payload)
+            end = f.tell()
+    return records, end
+
+
+def read_header(path):
+    """
+    Returns the header of the checkpoint file `path`, or None if there is
+    no readable checkpoint.
+    """
+    if not os.path.exists(path):
+        return None
+    records, _ = _read_records(path)
+    return json.loads(records[0].decode('utf8')) if records else None
+
+
+class Checkpoint(object):
+    """
+    An append-only checkpoint file of a run described by `header`.
+
+    Opening an existing file checks that it was written for the same
+    header and drops a torn last record.
+
+    Args:
+        path: file name
+        header: JSON serializable dictionary identifying the run
+        max_states: number of states kept before compacting the file, None
+            to keep them all
+
+    Raises:
+        ValueError: if the file belongs to another run
+    """
+
+    def __init__(self, path, header, max_states=8):
+        self.path = path
+        self.header = json.loads(json.dumps(header))
+        self.max_states = max_states
+        self._last = None
+
+        records, end = ([], 0)
+        if os.path.exists(path):
+            records, end = _read_records(path)
+        if records:
+            found = json.loads(records[0].decode('utf8'))
+            if found != self.header:
+                raise ValueError("The checkpoint %r was written for another run: %r" %
+                                 (path, found))
+            if len(records) > 1:
+                with np.load(io.BytesIO(records[-1]), allow_pickle=False) as data:
+                    self._last = {name: data[name] for name in data.files}
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+            self._n_states = len(records) - 1
+        else:
+            self._write([], path)
+            self._n_states = 0
+
+    def last(self):
+        """
+        Returns the last state written, a dictionary of arrays, or None.
+        """
+        return self._last
+
+    def states(self):
+        """
+        Returns the list of the states in the file, oldest first.
+        """
+        states = []
+        for payload in _read_records(self.path)[0][1:]:
+            with np.load(io.BytesIO(payload), allow_pickle=False) as data:
+                states.append({name: data[name] for name in data.files})
+        return states
+
+    def append(self, state):
+        """
+        Writes a state, a dictionary of arrays.
+        """
+        buf = io.BytesIO()
+        np.savez(buf, **state)
+        if self.max_states is not None and self._n_states >= self.max_states:
+            tmp = self.path + '.tmp'
+            self._write([buf.getvalue()], tmp)
+            os.replace(tmp, self.path)
+            self._n_states = 1
+        else:
+            self._write([buf.getvalue()], self.path, mode='ab')
+            self._n_states += 1
+        self._last = state
+
+    def _write(self, payloads, path, mode='wb'):
+        if mode == 'wb':
+            payloads = [json.dumps(self.header).encode('utf8')] + payloads
+        with open(path, mode) as f:
+            for payload in payloads:
+                f.write(_HEAD.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,327 @@
+"""
+The ``flownetpy`` command line: streams scenarios of inputs through batch
+steady state solves.
+
+::
+
+    flownetpy solve NETWORK SCENARIOS OUTPUT --chunk-size 1024 --workers 4
+
+NETWORK is a directory written by :func:`flownetpy.storage.save_network`;
+it is loaded once, and the model follows the class it was saved from
+unless ``--model`` is given. SCENARIOS holds one scenario per row and one
+column per node, and OUTPUT receives one row of flows per scenario, in
+the same order, with one column per edge in the order of
+``network.compile().edges()``; scenarios without a steady state are rows
+of nan. The format of both files follows their extension:
+
+- ``.npy``: a 2d float array, read through a memory map
+- ``.csv``: comma separated values. If the first line is a header, it
+  names the node of every column; otherwise the columns are in the order
+  of ``network.compile().nodes``. A numeric first line is a header if it
+  holds exactly the node labels. The output gets a header of edges.
+- ``.parquet``: one column per node, named like the nodes; needs pyarrow
+
+The scenarios are read in chunks of ``--chunk-size`` rows, every chunk is
+solved with :func:`flownetpy.batch.solve_batch`, on a pool of
+``--workers`` processes, and the results are written as they come in.
+At most two chunks per worker are held in memory at any time. Progress
+and throughput are reported to stderr.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+from .batch import PRECISIONS, solve_batch
+
+_WORKER = {}
+
+
+def _format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ('.npy', '.csv', '.parquet'):
+        raise ValueError("Unknown file format %r, use .npy, .csv or .parquet" % extension)
+    return extension[1:]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet files need pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def _column_order(names, nodes):
+    """
+    Returns the column index of every node, for columns named by `names`
+    """
+    index = {name: idx for idx, name in enumerate(names)}
+    try:
+        return np.array([index[str(node)] for node in nodes], dtype=np.intp)
+    except KeyError as e:
+        raise ValueError("No column for node %s" % e.args[0])
+
+
+def read_scenarios(path, nodes, chunk_size=1024):
+    """
+    Yields the scenarios of the file `path` as float arrays of shape
+    (k, n_nodes), k <= chunk_size, with the columns in the order of `nodes`.
+    """
+    kind = _format(path)
+    n_nodes = len(nodes)
+    if kind == 'npy':
+        scenarios = np.load(path, mmap_mode='r')
+        if scenarios.ndim != 2 or scenarios.shape[1] != n_nodes:
+            raise ValueError("Expected scenarios of shape (n, %d), got %r" %
+                             (n_nodes, scenarios.shape))
+        for start in range(0, scenarios.shape[0], chunk_size):
+            yield np.array(scenarios[start:start + chunk_size], dtype=float)
+
+    elif kind == 'csv':
+        with open(path) as f:
+            first = f.readline()
+            header = [name.strip() for name in next(csv.reader([first]))]
+            try:
+                np.array(header, dtype=float)
+                numeric = True
+            except ValueError:
+                numeric = False
+            if numeric and set(header) != set(str(node) for node in nodes):
+                header = None
+                lines = itertools.chain([first], f)
+            else:
+                order = _column_order(header, nodes)
+                lines = f
+            while True:
+                chunk = list(itertools.islice(lines, chunk_size))
+                if not chunk:
+                    break
+                values = np.loadtxt(chunk, delimiter=',', ndmin=2)
+                if header is not None:
+                    values = values[:, order]
+                if values.shape[1] != n_nodes:
+                    raise ValueError("Expected %d columns, got %d" % (n_nodes, values.shape[1]))
+                yield values
+
+    else:
+        pyarrow = _import_pyarrow()
+        source = pyarrow.parquet.ParquetFile(path)
+        columns = [str(node) for node in nodes]
+        _column_order(source.schema_arrow.names, nodes)
+        for batch in source.iter_batches(batch_size=chunk_size, columns=columns):
+            yield np.column_stack([batch.column(name).to_numpy(zero_copy_only=False)
+                                   for name in columns]).astype(float)
+
+
+class _NpyWriter(object):
+    """
+    Appends rows to a .npy file whose header is rewritten on close.
+    """
+    # room for the header of any row count
+    _HEADER = 128
+
+    def __init__(self, path, n_columns):
+        self.n_columns = n_columns
+        self.rows = 0
+        self._file = open(path, 'wb')
+        self._file.write(self._header())
+
+    def _header(self):
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (
+            self.rows, self.n_columns)
+        header = header.ljust(self._HEADER - 10 - 1) + '\n'
+        return b'\x93NUMPY\x01\x00' + np.array(len(header), '<u2').tobytes() + \
+            header.encode('latin1')
+
+    def write(self, rows):
+        self._file.write(np.ascontiguousarray(rows, dtype='<f8').tobytes())
+        self.rows += rows.shape[0]
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.close()
+
+
+class _CsvWriter(object):
+    def __init__(self, path, names):
+        self._file = open(path, 'w', newline='')
+        csv.writer(self._file, lineterminator='\n').writerow(names)
+
+    def write(self, rows):
+        np.savetxt(self._file, rows, delimiter=',', fmt='%.17g')
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter(object):
+    def __init__(self, path, names):
+        pyarrow = self._pyarrow = _import_pyarrow()
+        self.names = names
+        schema = pyarrow.schema([(name, pyarrow.float64()) for name in names])
+        self._writer = pyarrow.parquet.ParquetWriter(path, schema)
+
+    def write(self, rows):
+        table = self._pyarrow.Table.from_arrays(list(rows.T), names=self.names)
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+
+
+def open_writer(path, compiled):
+    """
+    Returns a writer of flows of `compiled` to `path`, with methods
+    ``write(rows)`` for a (k, n_edges) array and ``close()``.
+    """
+    kind = _format(path)
+    if kind == 'npy':
+        return _NpyWriter(path, compiled.n_edges)
+    names = ['%s-%s' % edge for edge in compiled.edges()]
+    if kind == 'csv':
+        return _CsvWriter(path, names)
+    return _ParquetWriter(path, names)
+
+
+def _init_worker(compiled, model, integrator, precision):
+    _WORKER.update(compiled=compiled, model=model, integrator=integrator,
+                   precision=precision)
+
+
+def _solve_chunk(inputs):
+    w = _WORKER
+    return solve_batch(w['compiled'], w['model'], inputs, w['integrator'], w['precision'])
+
+
+def stream(compiled, model, chunks, writer, workers=1, integrator=None, precision='double',
+           progress=None):
+    """
+    Solves every chunk of inputs and writes the flows in order.
+
+    Args:
+        chunks: an iterable of (k, n_nodes) input arrays
+        writer: see :func:`open_writer`
+        workers: number of processes; at most 2 * workers chunks are in
+            flight
+        progress: a function ``progress(done, failed, elapsed)`` called
+            after every chunk
+
+    Returns:
+        (done, failed): the numbers of scenarios solved and without a
+        steady state
+    """
+    done = failed = 0
+    start = time.perf_counter()
+
+    def write(result):
+        flows, converged = result
+        writer.write(flows)
+        return flows.shape[0], int(flows.shape[0] - converged.sum())
+
+    if workers <= 1:
+        results = (solve_batch(compiled, model, chunk, integrator, precision)
+                   for chunk in chunks)
+        for result in results:
+            n, bad = write(result)
+            done, failed = done + n, failed + bad
+            if progress is not None:
+                progress(done, failed, time.perf_counter() - start)
+        return done, failed
+
+    pool = multiprocessing.get_context('spawn').Pool(
+        workers, initializer=_init_worker, initargs=(compiled, model, integrator, precision))
+    try:
+        pending = deque()
+        chunks = iter(chunks)
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(pool.apply_async(_solve_chunk, (chunk,)))
+            if not pending:
+                break
+            n, bad = write(pending.popleft().get())
+            done, failed = done + n, failed + bad
+            if progress is not None:
+                progress(done, failed, time.perf_counter() - start)
+    finally:
+        pool.terminate()
+        pool.join()
+    return done, failed
+
+
+class _Progress(object):
+    def __init__(self, interval, out=sys.stderr):
+        self.interval = interval
+        self.out = out
+        self._last = -np.inf
+
+    def __call__(self, done, failed, elapsed, final=False):
+        if final or elapsed - self._last >= self.interval:
+            self._last = elapsed
+            print('%d scenarios solved, %d without steady state, %.1f s, %.1f scenarios/s'
+                  % (done, failed, elapsed, done / max(elapsed, 1e-9)), file=self.out)
+
+
+def solve(args):
+    from .kuramotonetwork import KuramotoNetwork
+    from .storage import load_network
+
+    network = load_network(args.network)
+    model = args.model or ('kuramoto' if isinstance(network, KuramotoNetwork) else 'linear')
+    compiled = network.compile()
+    chunks = read_scenarios(args.scenarios, compiled.nodes, args.chunk_size)
+    writer = open_writer(args.output, compiled)
+    progress = None if args.quiet else _Progress(args.progress)
+    start = time.perf_counter()
+    try:
+        done, failed = stream(compiled, model, chunks, writer, workers=args.workers,
+                              integrator=args.integrator, precision=args.precision,
+                              progress=progress)
+    finally:
+        writer.close()
+    if progress is not None:
+        progress(done, failed, time.perf_counter() - start, final=True)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='flownetpy',
+                                     description='Batch steady state solves of flow networks')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    parser_solve = commands.add_parser(
+        'solve', help='solves a file of input scenarios',
+        description='Solves the steady flows of a network for every row of a scenario file')
+    parser_solve.add_argument('network', help='directory of a network saved with save_network')
+    parser_solve.add_argument('scenarios', help='.npy, .csv or .parquet file of inputs')
+    parser_solve.add_argument('output', help='.npy, .csv or .parquet file for the flows')
+    parser_solve.add_argument('--model', choices=['linear', 'kuramoto'],
+                              help='defaults to the class the network was saved from')
+    parser_solve.add_argument('--chunk-size', type=int, default=1024)
+    parser_solve.add_argument('--workers', type=int, default=1)
+    parser_solve.add_argument('--precision', choices=sorted(PRECISIONS), default='double')
+    parser_solve.add_argument('--integrator', help='integrator of the Kuramoto model')
+    parser_solve.add_argument('--progress', type=float, default=5.,
+                              help='seconds between progress reports')
+    parser_solve.add_argument('--quiet', action='store_true')
+    parser_solve.set_defaults(func=solve)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
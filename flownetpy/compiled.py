@@ -0,0 +1,261 @@
+"""
+Flat array form of a flow network, used by the numerical solvers.
+"""
+
+from __future__ import division
+
+import numpy as np
+import networkx as nx
+
+from .flowmodel.incidence import incidence_matrix, cycle_basis as fundamental_cycles
+from .tools import FlowDict
+
+
+class CompiledNetwork(object):
+    """
+    A flow network stored as flat arrays.
+
+    Node ``i`` is ``nodes[i]``; edge ``e`` joins ``nodes[head[e]]`` and
+    ``nodes[tail[e]]``, in the orientation in which ``graph.edges()``
+    reports it, and has weight ``weights[e]``.
+
+    Attributes:
+        nodes: list of node labels
+        head: int array of size n_edges
+        tail: int array of size n_edges
+        weights: float array of size n_edges
+        inputs: float array of size n_nodes
+    """
+
+    def __init__(self, nodes, head, tail, weights, inputs):
+        self.nodes = list(nodes)
+        self.head = np.ascontiguousarray(head, dtype=np.intp)
+        self.tail = np.ascontiguousarray(tail, dtype=np.intp)
+        self.weights = np.ascontiguousarray(weights, dtype=float)
+        self.inputs = np.ascontiguousarray(inputs, dtype=float)
+        self._node_index = None
+        self._incidence = {}
+        self._laplacian_solvers = {}
+        self._cycle_basis = None
+        self._lattice = False
+        self._ordering = False
+        self._local = None
+
+        if not (self.head.shape == self.tail.shape == self.weights.shape):
+            raise ValueError("head, tail and weights must have the same shape")
+        if self.inputs.shape != (len(self.nodes),):
+            raise ValueError("Expected %d inputs, got %r" %
+                             (len(self.nodes), self.inputs.shape))
+
+    def __getstate__(self):
+        # factorizations cannot be pickled; they are rebuilt on demand
+        state = dict(self.__dict__)
+        state['_laplacian_solvers'] = {}
+        state['_local'] = None
+        return state
+
+    @classmethod
+    def from_graph(cls, graph, weight_attr='weight'):
+        """
+        Compiles a networkx graph whose nodes carry an ``'input'`` attribute.
+
+        Edges without the attribute `weight_attr` get weight 1.
+        """
+        nodes = list(graph.nodes())
+        node_index = {node: idx for idx, node in enumerate(nodes)}
+        inputs = nx.get_node_attributes(graph, 'input')
+
+        n_edges = graph.number_of_edges()
+        head = np.empty(n_edges, dtype=np.intp)
+        tail = np.empty(n_edges, dtype=np.intp)
+        weights = np.empty(n_edges)
+        for idx, (u, v, dat) in enumerate(graph.edges(data=True)):
+            head[idx] = node_index[u]
+            tail[idx] = node_index[v]
+            weights[idx] = dat.get(weight_attr, 1)
+
+        compiled = cls(nodes, head, tail, weights,
+                       [inputs[node] for node in nodes])
+        compiled._node_index = node_index
+        return compiled
+
+    def with_inputs(self, inputs):
+        """
+        Returns a compiled network with the same nodes and edges and other
+        inputs. It shares the arrays, the incidence matrices, the cycle
+        basis, the node ordering and the Laplacian factorization of this one.
+        """
+        compiled = CompiledNetwork(self.nodes, self.head, self.tail, self.weights, inputs)
+        compiled._node_index = self._node_index
+        compiled._incidence = self._incidence
+        compiled._cycle_basis = self._cycle_basis
+        compiled._lattice = self._lattice
+        compiled._ordering = self._ordering
+        compiled._laplacian_solvers = self._laplacian_solvers
+        return compiled
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    @property
+    def n_edges(self):
+        return self.head.size
+
+    @property
+    def node_index(self):
+        """
+        A dictionary mapping node labels to node indices.
+        """
+        if self._node_index is None:
+            self._node_index = {node: idx for idx, node in enumerate(self.nodes)}
+        return self._node_index
+
+    def edges(self):
+        """
+        Returns the list of edges as (u, v) tuples of node labels.
+        """
+        nodes = self.nodes
+        return [(nodes[u], nodes[v]) for u, v in zip(self.head.tolist(), self.tail.tolist())]
+
+    def incidence(self, weighted=False):
+        """
+        Returns the oriented (n_nodes x n_edges) incidence matrix in CSR form,
+        with -1 at the head and +1 at the tail of each edge, as in
+        ``nx.incidence_matrix(graph, oriented=True)``.
+
+        If `weighted` is True, column e is multiplied by weights[e].
+        """
+        if weighted not in self._incidence:
+            self._incidence[weighted] = incidence_matrix(
+                self.head, self.tail, self.n_nodes, self.weights if weighted else None)
+        return self._incidence[weighted]
+
+    def laplacian(self, weights=None):
+        """
+        Returns the weighted (n_nodes x n_nodes) Laplacian in CSR form.
+
+        If `weights` is given, it is used instead of the edge weights.
+        """
+        from .flowmodel.linear import laplacian
+
+        return laplacian(self.incidence(), self.weights if weights is None else weights)
+
+    def laplacian_solver(self, dtype=np.float64):
+        """
+        Returns a :class:`flownetpy.laplacian.LaplacianSolver` for the
+        weighted Laplacian, with factors of the given dtype. It is
+        factorized on the first call and cached.
+
+        In double precision, rings, paths and lattices with uniform
+        weights along every dimension get a
+        :class:`flownetpy.periodic.LatticeSolver` instead, which solves
+        with fast transforms and needs no factorization, unless they have
+        fewer than ``periodic.MIN_NODES`` nodes.
+
+        The factorization works in the :meth:`ordering` of the nodes, if
+        any; the solver takes and returns arrays in the order of `nodes`.
+        """
+        key = np.dtype(dtype).str
+        if key not in self._laplacian_solvers:
+            from . import periodic
+
+            lattice = None
+            if np.dtype(dtype) == np.float64 and self.n_nodes >= periodic.MIN_NODES:
+                lattice = self.lattice()
+            if lattice is not None and lattice.weights is not None:
+                self._laplacian_solvers[key] = periodic.LatticeSolver(lattice)
+            else:
+                from .laplacian import LaplacianSolver
+
+                ordering = self.ordering()
+                self._laplacian_solvers[key] = LaplacianSolver(
+                    self.laplacian(), dtype=dtype,
+                    order=None if ordering is None else ordering.nodes)
+        return self._laplacian_solvers[key]
+
+    def lattice(self):
+        """
+        Returns the :class:`flownetpy.periodic.Lattice` structure of the
+        network if it is a ring, a path or a lattice labelled by
+        coordinates, and None otherwise. It is detected on the first call
+        and cached.
+        """
+        if self._lattice is False:
+            from .periodic import detect
+
+            self._lattice = detect(self)
+        return self._lattice
+
+    def ordering(self):
+        """
+        Returns the :class:`flownetpy.ordering.Ordering` of the nodes and
+        edges that keeps neighbours close in memory, or None if the order
+        of the network is good enough, see
+        :func:`flownetpy.ordering.locality_order`. It is computed on the
+        first call and cached.
+        """
+        if self._ordering is False:
+            from .ordering import locality_order
+
+            self._ordering = locality_order(self)
+        return self._ordering
+
+    def local(self):
+        """
+        Returns the network in its :meth:`ordering`, or the network itself
+        if it has none. Solvers work on it and map their results back with
+        ``ordering().from_local``.
+        """
+        ordering = self.ordering()
+        if ordering is None:
+            return self
+        if self._local is None:
+            nodes, edges = ordering.nodes, ordering.edges
+            local = CompiledNetwork([self.nodes[i] for i in nodes.tolist()],
+                                    ordering.rank[self.head[edges]],
+                                    ordering.rank[self.tail[edges]],
+                                    self.weights[edges], self.inputs[nodes])
+            local._ordering = None
+            self._local = local
+        return self._local
+
+    def cycle_basis(self):
+        """
+        Returns a basis of the cycle space as a list of int arrays; each
+        array lists the node indices of a cycle in traversal order.
+
+        The basis holds the fundamental cycles of a breadth first spanning
+        forest. It is computed on the first call and cached.
+        """
+        if self._cycle_basis is None:
+            self._cycle_basis = fundamental_cycles(head=self.head, tail=self.tail,
+                                                   n_nodes=self.n_nodes)
+        return self._cycle_basis
+
+    def edge_values(self, values, name='value'):
+        """
+        Returns per edge values given as a number, an array in edge order
+        or a dictionary {(u, v): value}, in either orientation, as an
+        array in edge order.
+        """
+        if isinstance(values, dict):
+            try:
+                return np.array([values[(u, v)] if (u, v) in values else values[(v, u)]
+                                 for u, v in self.edges()], dtype=float)
+            except KeyError as e:
+                raise ValueError("No %s given for edge %r" % (name, e.args[0]))
+        return np.broadcast_to(np.asarray(values, dtype=float), (self.n_edges,))
+
+    def flow_dict(self, flows):
+        """
+        Returns a :class:`FlowDict` with ``flows[e]`` as the flow along edge e.
+        """
+        return FlowDict(zip(self.edges(), np.asarray(flows).tolist()))
+
+    def flow_array(self, flows):
+        """
+        The inverse of :meth:`flow_dict`: returns the flows of a dictionary
+        {(u, v): flow} as an array in edge order.
+        """
+        return np.array([flows[edge] for edge in self.edges()], dtype=float)
@@ -0,0 +1,517 @@
+"""
+Domain decomposition: one large steady state solve spread over processes.
+
+The network is partitioned into balanced subdomains with small edge cuts
+by recursive bisection along breadth first orders started from pseudo
+peripheral nodes, which cut a mesh along a front. Every subdomain lives
+in a worker process, which keeps its factorizations between calls.
+
+The linear model is solved by a Schur complement on the interface nodes,
+the endpoints of the cut edges. Every worker factorizes the Laplacian
+block of the interior nodes of its subdomain and returns its
+contribution to the Schur complement ``S = L_GG - sum_k L_Gk L_kk^-1
+L_kG``, which is the Laplacian of the Kron reduced network on the
+interface. The parent factorizes S; a solve then condenses the inputs on
+the interface in parallel, solves with S, and recovers the interior
+pressures in parallel::
+
+    with DomainDecomposition(network, n_parts=8, workers=8) as dd:
+        flows = network.steady_flows(decomposition=dd)
+
+The Kuramoto model starts with restricted additive Schwarz sweeps:
+every subdomain, extended by `overlap` layers of neighbours, solves its
+own steady state equations by Newton's method with the phases outside
+held fixed, and keeps the phases of its own nodes. These sweeps alone
+would need more and more iterations as the number of subdomains grows,
+since information only travels through the overlaps, so Newton's method
+on the whole network finishes the job. Its Jacobian is a Laplacian with
+the weights ``K cos(theta_i - theta_j)``, solved by the same Schur
+complement machinery after refactorizing the subdomains in parallel.
+"""
+
+from __future__ import division
+
+import multiprocessing
+import traceback
+
+import numpy as np
+
+from .resistance import _compiled
+
+
+def _bisect(adjacency, nodes, n_parts, labels, first_label):
+    """
+    Splits `nodes` into `n_parts` parts of balanced sizes, labelled from
+    `first_label` on.
+    """
+    from scipy.sparse.csgraph import breadth_first_order, connected_components
+
+    if n_parts == 1 or nodes.size <= 1:
+        labels[nodes] = first_label
+        return
+    sub = adjacency[nodes][:, nodes]
+    n_components, components = connected_components(sub, directed=False)
+    order = []
+    for component in range(n_components):
+        start = np.flatnonzero(components == component)[0]
+        # two sweeps find a pseudo peripheral node
+        for _ in range(2):
+            visited = breadth_first_order(sub, start, directed=False,
+                                          return_predecessors=False)
+            start = visited[-1]
+        order.append(visited)
+    order = nodes[np.concatenate(order)]
+    left = n_parts // 2
+    split = int(round(order.size * left / n_parts))
+    _bisect(adjacency, order[:split], left, labels, first_label)
+    _bisect(adjacency, order[split:], n_parts - left, labels, first_label + left)
+
+
+def partition(network, n_parts):
+    """
+    Returns the part of every node, in the order of ``compile().nodes``,
+    for `n_parts` parts of balanced sizes with small edge cuts.
+    """
+    compiled = _compiled(network)
+    if not 1 <= n_parts <= max(compiled.n_nodes, 1):
+        raise ValueError("Cannot split %d nodes into %r parts" % (compiled.n_nodes, n_parts))
+    labels = np.zeros(compiled.n_nodes, dtype=np.intp)
+    adjacency = abs(compiled.laplacian(weights=np.ones(compiled.n_edges))).tocsr()
+    _bisect(adjacency, np.arange(compiled.n_nodes), n_parts, labels, 0)
+    return labels
+
+
+def _grow(adjacency, nodes, layers):
+    """
+    Returns the sorted nodes within `layers` edges of `nodes`.
+    """
+    inside = np.zeros(adjacency.shape[0], dtype=bool)
+    inside[nodes] = True
+    for _ in range(layers):
+        inside |= adjacency.dot(inside.astype(float)) > 0
+    return np.flatnonzero(inside)
+
+
+class _Subdomain(object):
+    """
+    The part of the problem owned by one subdomain.
+
+    For the linear model: the interior nodes and the interface nodes
+    `interface` they are coupled to, as indices into the interface of the
+    whole network; :meth:`factorize` sets the Laplacian blocks.
+
+    For the Kuramoto model: the extended nodes, followed by the outside
+    endpoints of their edges, the local edges and inputs, and the
+    positions of the owned nodes among the extended ones.
+    """
+
+    def __init__(self, interior, interface, nodes, n_free, owned, head, tail, weights,
+                 inputs, grounded):
+        self.interior = interior
+        self.interface = interface
+        self.nodes = nodes
+        self.n_free = n_free
+        self.owned = owned
+        self.head = head
+        self.tail = tail
+        self.weights = weights
+        self.inputs = inputs
+        self.grounded = grounded
+        self.coupling = None
+        self._lu = None
+
+    def factorize(self, interior_block, coupling):
+        """
+        Factorizes the Laplacian block of the interior nodes, coupled to
+        the interface nodes by `coupling`.
+        """
+        from scipy.sparse.linalg import splu
+
+        self.coupling = coupling
+        self._lu = None
+        if self.interior.size:
+            self._lu = splu(interior_block.tocsc(), permc_spec='MMD_AT_PLUS_A',
+                            options=dict(SymmetricMode=True))
+
+    def _solve(self, b):
+        if self._lu is None:
+            return np.zeros(b.shape)
+        return self._lu.solve(np.ascontiguousarray(b))
+
+    def schur(self, block=256):
+        """
+        Returns ``L_Gk L_kk^-1 L_kG`` as a dense matrix on the interface
+        nodes of the subdomain.
+        """
+        coupling = self.coupling.tocsc()
+        n = coupling.shape[1]
+        out = np.zeros((n, n))
+        for start in range(0, n, block):
+            columns = coupling[:, start:start + block].toarray()
+            out[:, start:start + block] = coupling.T.dot(self._solve(columns))
+        return out
+
+    def condense(self, b):
+        """
+        Returns (``L_Gk L_kk^-1 b_k``, ``L_kk^-1 b_k``).
+        """
+        y = self._solve(b)
+        return self.coupling.T.dot(y), y
+
+    def interior_solution(self, y, x_interface):
+        """
+        Returns ``L_kk^-1 (b_k - L_kG x_G)``, given ``y = L_kk^-1 b_k``.
+        """
+        return y - self._solve(self.coupling.dot(x_interface))
+
+    def schwarz(self, thetas, tol=1e-12, max_iter=20, inputs=None):
+        """
+        Solves the Kuramoto steady state of the extended subdomain with the
+        phases of the outside nodes held at their values in `thetas`, the
+        phases of ``self.nodes``. Returns the phases of the owned nodes, or
+        None if Newton's method fails.
+
+        `inputs` replaces the inputs of the extended nodes if given.
+        """
+        from scipy.sparse.linalg import splu
+        from .flowmodel.incidence import incidence_matrix
+        from .flowmodel.linear import laplacian
+
+        x = np.array(thetas, dtype=float)
+        free = self.n_free
+        inputs = self.inputs if inputs is None else inputs
+        incidence = incidence_matrix(self.head, self.tail, self.nodes.size)
+        for _ in range(max_iter + 1):
+            diff = x[self.head] - x[self.tail]
+            F = inputs + incidence.dot(self.weights * np.sin(diff))[:free]
+            F[self.grounded] = 0
+            if F.size == 0 or np.abs(F).max() < tol:
+                return x[self.owned]
+            gains = self.weights * np.cos(diff)
+            if np.any(gains[self.weights > 0] <= 0):
+                return None
+            jacobian = laplacian(incidence, gains)[:free][:, :free].tolil()
+            for node in self.grounded:
+                jacobian[node, :] = 0
+                jacobian[node, node] = 1
+            x[:free] += splu(jacobian.tocsc()).solve(F)
+        return None
+
+
+def _serve(connection, subdomains):
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        method, calls = message
+        try:
+            results = [getattr(subdomains[k], method)(*args) for k, args in calls]
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+        else:
+            connection.send((True, results))
+    connection.close()
+
+
+class DomainDecomposition(object):
+    """
+    Solves a network split into subdomains, each held by a worker process.
+
+    Args:
+        network: a FlowNetwork or CompiledNetwork
+        n_parts: number of subdomains, by default `workers`
+        workers: number of processes, None for one per CPU; with 1 the
+            subdomains are solved in the calling process
+        overlap: layers of neighbours added to every subdomain for the
+            Schwarz iterations of the Kuramoto model
+        parts: the subdomain of every node, computed with
+            :func:`partition` if not given
+
+    Attributes:
+        compiled: the compiled network
+        parts: the subdomain of every node
+        interface: the indices of the interface nodes
+
+    The instance also has the interface of a
+    :class:`flownetpy.laplacian.LaplacianSolver`. Close it, or use it as
+    a context manager, to stop the workers.
+    """
+
+    def __init__(self, network, n_parts=None, workers=None, overlap=2, parts=None):
+        from scipy.sparse.csgraph import connected_components
+
+        compiled = _compiled(network)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if n_parts is None:
+            n_parts = max(workers, 1)
+        if parts is None:
+            parts = partition(compiled, n_parts)
+        parts = np.asarray(parts, dtype=np.intp)
+        n_parts = parts.max() + 1 if parts.size else 0
+        self.compiled = compiled
+        self.parts = parts
+
+        laplacian = compiled.laplacian().tocsr()
+        self.n = compiled.n_nodes
+        self.n_components, self.labels = connected_components(laplacian, directed=False)
+        self._component_sizes = np.bincount(self.labels, minlength=self.n_components)
+
+        # the endpoints of cut edges, and a node of every component without
+        # any, so that every interior block is grounded
+        cut = parts[compiled.head] != parts[compiled.tail]
+        on_interface = np.zeros(self.n, dtype=bool)
+        on_interface[compiled.head[cut]] = on_interface[compiled.tail[cut]] = True
+        missing = np.ones(self.n_components, dtype=bool)
+        missing[self.labels[on_interface]] = False
+        on_interface[np.unique(self.labels, return_index=True)[1][missing]] = True
+        self.interface = np.flatnonzero(on_interface)
+
+        adjacency = abs(compiled.laplacian(weights=np.ones(compiled.n_edges))).tocsr()
+        adjacency.setdiag(0)
+        subdomains = []
+        for k in range(n_parts):
+            interior = np.flatnonzero((parts == k) & ~on_interface)
+            neighbours = np.unique(adjacency[interior][:, self.interface].tocoo().col)
+            subdomains.append(_Subdomain(
+                interior, neighbours,
+                *self._schwarz_data(adjacency, np.flatnonzero(parts == k), overlap)))
+
+        self._subdomains = subdomains
+        self._workers = []
+        self._assignment = [k % max(workers, 1) for k in range(n_parts)]
+        if workers > 1 and n_parts > 1:
+            for worker in range(min(workers, n_parts)):
+                mine = {k: subdomains[k] for k in range(n_parts)
+                        if self._assignment[k] == worker}
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_serve, args=(child, mine))
+                process.daemon = True
+                process.start()
+                child.close()
+                self._workers.append((process, parent))
+
+        self._factorized = None
+        self._factorize(None)
+
+    def _factorize(self, weights):
+        """
+        Factorizes the Laplacian with edge weights `weights`, by default
+        the weights of the network, in every subdomain, and its Schur
+        complement on the interface.
+        """
+        from .laplacian import LaplacianSolver
+
+        laplacian = self.compiled.laplacian(weights=weights).tocsr()
+        interface = self.interface
+        args = []
+        for subdomain in self._subdomains:
+            rows = laplacian[subdomain.interior]
+            args.append((rows[:, subdomain.interior],
+                         rows[:, interface[subdomain.interface]]))
+        self._map('factorize', args)
+        schur = self._map('schur', [() for _ in self._subdomains])
+        reduced = laplacian[interface][:, interface].toarray()
+        for subdomain, block in zip(self._subdomains, schur):
+            index = subdomain.interface
+            reduced[np.ix_(index, index)] -= block
+        self._interface_solver = LaplacianSolver(reduced)
+        self._factorized = weights
+
+    def _schwarz_data(self, adjacency, owned, overlap):
+        from scipy.sparse.csgraph import connected_components
+        from .flowmodel.incidence import incidence_matrix
+
+        compiled = self.compiled
+        extended = _grow(adjacency, owned, overlap)
+        inside = np.zeros(self.n, dtype=bool)
+        inside[extended] = True
+        touching = inside[compiled.head] | inside[compiled.tail]
+        head, tail = compiled.head[touching], compiled.tail[touching]
+        outside = np.setdiff1d(np.union1d(head, tail), extended)
+        nodes = np.concatenate([extended, outside])
+        local = np.full(self.n, -1, dtype=np.intp)
+        local[nodes] = np.arange(nodes.size)
+
+        # extended components without outside nodes keep the phase of one
+        # of their nodes, which fixes the gauge of their Jacobian
+        incidence = incidence_matrix(local[head], local[tail], nodes.size)
+        n_components, components = connected_components(incidence.dot(incidence.T),
+                                                        directed=False)
+        anchored = np.zeros(n_components, dtype=bool)
+        anchored[components[extended.size:]] = True
+        first = np.unique(components, return_index=True)[1]
+        grounded = first[~anchored[components[first]]]
+        return (nodes, extended.size, local[owned], local[head], local[tail],
+                compiled.weights[touching], compiled.inputs[extended], grounded)
+
+    def _map(self, method, args):
+        """
+        Calls `method` of every subdomain with its arguments, in parallel
+        on the workers, and returns the results in subdomain order.
+        """
+        if not self._workers:
+            return [getattr(subdomain, method)(*a) for subdomain, a in
+                    zip(self._subdomains, args)]
+        for worker, (_, connection) in enumerate(self._workers):
+            connection.send((method, [(k, args[k]) for k in range(len(args))
+                                      if self._assignment[k] == worker]))
+        results = [None] * len(args)
+        errors = []
+        for worker, (_, connection) in enumerate(self._workers):
+            ok, value = connection.recv()
+            if not ok:
+                errors.append(value)
+                continue
+            mine = [k for k in range(len(args)) if self._assignment[k] == worker]
+            for k, result in zip(mine, value):
+                results[k] = result
+        if errors:
+            raise RuntimeError("A subdomain failed:\n%s" % errors[0])
+        return results
+
+    @property
+    def n_parts(self):
+        return len(self._subdomains)
+
+    def check(self, compiled):
+        """
+        Raises a ValueError unless `compiled` has the nodes and edges of the
+        decomposed network; its inputs may differ.
+        """
+        if (compiled.n_nodes != self.n
+                or not np.array_equal(compiled.head, self.compiled.head)
+                or not np.array_equal(compiled.tail, self.compiled.tail)
+                or not np.array_equal(compiled.weights, self.compiled.weights)):
+            raise ValueError("The decomposition was built for another network")
+
+    def _component_means(self, x):
+        sums = np.zeros((self.n_components,) + x.shape[1:])
+        np.add.at(sums, self.labels, x)
+        return sums / self._component_sizes.reshape((-1,) + (1,) * (x.ndim - 1))
+
+    def solve(self, b, tol=None, max_refinements=None):
+        """
+        Returns L^+ b for b of shape (n,) or (n, k), as
+        :meth:`flownetpy.laplacian.LaplacianSolver.solve`; the tolerances
+        are ignored.
+        """
+        if self._factorized is not None:
+            self._factorize(None)
+        return self._solve(b)
+
+    def _solve(self, b):
+        b = np.asarray(b, dtype=float)
+        b = b - self._component_means(b)[self.labels]
+        condensed = self._map('condense', [(b[s.interior],) for s in self._subdomains])
+        rhs = b[self.interface].copy()
+        for subdomain, (g, _) in zip(self._subdomains, condensed):
+            rhs[subdomain.interface] -= g
+        x_interface = self._interface_solver.solve(rhs)
+        interiors = self._map('interior_solution', [
+            (y, x_interface[s.interface]) for s, (_, y) in zip(self._subdomains, condensed)])
+        x = np.empty(b.shape)
+        x[self.interface] = x_interface
+        for subdomain, interior in zip(self._subdomains, interiors):
+            x[subdomain.interior] = interior
+        return x - self._component_means(x)[self.labels]
+
+    def pressures(self, inputs=None):
+        """
+        Returns the pressures of the linear model, for the inputs of the
+        network by default.
+        """
+        return self.solve(self.compiled.inputs if inputs is None else inputs)
+
+    def kuramoto_phases(self, inputs=None, initguess=None, tol=1e-9, max_iter=50,
+                        schwarz_sweeps=2):
+        """
+        Computes phases close to a stable fixed point of the Kuramoto
+        dynamics: a few restricted additive Schwarz sweeps, in which every
+        subdomain solves its local problem with the phases outside fixed,
+        followed by Newton steps whose Jacobian systems are solved by the
+        subdomains and the interface Schur complement.
+
+        Args:
+            inputs: the inputs, those of the network by default
+            initguess: the initial phases, by default the linear response
+            tol: the largest right hand side accepted
+            max_iter: maximal number of Newton steps
+            schwarz_sweeps: number of Schwarz sweeps before the Newton steps
+
+        Returns:
+            (thetas, stable), as :func:`flownetpy.multilevel.newton`;
+            thetas is meant as an initial condition for the integration
+            if stable is False
+        """
+        from .kuramotonetwork import KuramotoRHS
+
+        compiled = self.compiled
+        inputs = compiled.inputs if inputs is None else np.asarray(inputs, dtype=float)
+        thetas = self.pressures(inputs) if initguess is None else np.array(initguess, dtype=float)
+        if compiled.n_nodes == 0:
+            return thetas, False
+        rhs = KuramotoRHS(compiled, inputs)
+        head, tail, weights = compiled.head, compiled.tail, compiled.weights
+        for _ in range(schwarz_sweeps):
+            local = self._map('schwarz', [(thetas[s.nodes], tol / 10, 20,
+                                           inputs[s.nodes[:s.n_free]])
+                                          for s in self._subdomains])
+            if any(owned is None for owned in local):
+                break
+            thetas = thetas.copy()
+            for subdomain, owned in zip(self._subdomains, local):
+                thetas[subdomain.nodes[subdomain.owned]] = owned
+
+        F = rhs(0, thetas).copy()
+        residual = np.abs(F).max()
+        for _ in range(max_iter):
+            if residual < tol:
+                break
+            gains = weights * np.cos(thetas[head] - thetas[tail])
+            if np.any(gains[weights > 0] <= 0):
+                break
+            # the Jacobian is -L with the weights w cos(theta_head - theta_tail)
+            self._factorize(gains)
+            step = self._solve(F)
+            for _ in range(8):
+                trial = thetas + step
+                F_trial = rhs(0, trial)
+                if np.abs(F_trial).max() < residual:
+                    break
+                step = step / 2
+            else:
+                break
+            thetas, F = trial, F_trial.copy()
+            residual = np.abs(F).max()
+
+        gains = np.cos(thetas[head] - thetas[tail])
+        stable = bool(residual < tol and np.all(gains[weights > 0] > 0))
+        return thetas, stable
+
+    def close(self):
+        """
+        Stops the workers.
+        """
+        for process, connection in self._workers:
+            try:
+                connection.send(None)
+                connection.close()
+            except (OSError, EOFError):
+                pass
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
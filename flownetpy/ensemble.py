@@ -0,0 +1,423 @@
+"""
+Monte Carlo ensembles of steady flows over random inputs.
+
+:func:`ensemble` solves one network for many input vectors, given as a
+matrix or drawn by a sampler, and reduces the flows on the fly into a
+:class:`FlowStatistics`: mean, variance, extremes, quantiles estimated
+from a uniform reservoir sample, and the probability of every flow
+exceeding its capacity. The individual solutions are never stored.
+
+With ``workers > 1`` the samples are split into chunks solved by a
+process pool. The compiled network and the input matrix are put in
+shared memory once, instead of pickling the network to every worker;
+each worker factorizes the Laplacian once. Chunk k draws its samples
+from the k-th child of ``numpy.random.SeedSequence(seed)`` and the
+chunk statistics are merged in chunk order, so the result depends on the
+seed and the chunk size but not on the number of workers.
+
+With ``precision='single'`` the chunks are solved in single precision
+and refined in double precision, see :mod:`flownetpy.batch`.
+
+Long runs can be checkpointed to a :class:`flownetpy.checkpoint.Checkpoint`
+file and resumed after an interruption.
+"""
+
+from __future__ import division
+
+import multiprocessing
+import time
+
+import numpy as np
+
+from .cache import _digest
+from .checkpoint import Checkpoint, read_header
+from .compiled import CompiledNetwork
+
+#: default quantiles of :class:`FlowStatistics`
+QUANTILES = (0.05, 0.5, 0.95)
+
+
+class FlowStatistics(object):
+    """
+    Streaming statistics of flows, updated with batches of samples and
+    mergeable with the statistics of other batches.
+
+    Args:
+        n_edges: number of edges
+        capacities: array of edge capacities, or None
+        reservoir: size of the reservoir sample used for quantiles
+        seed: seed of the reservoir sampling
+
+    Attributes:
+        count: number of samples
+        failures: number of samples without a steady state
+        mean, min, max: arrays of size n_edges
+        exceedances: number of samples with |flow| > capacity, by edge
+    """
+
+    def __init__(self, n_edges, capacities=None, reservoir=1024, seed=None):
+        self.n_edges = n_edges
+        self.capacities = None if capacities is None else np.asarray(capacities, dtype=float)
+        self.reservoir_size = reservoir
+        self.count = 0
+        self.failures = 0
+        self.mean = np.zeros(n_edges)
+        self._m2 = np.zeros(n_edges)
+        self.min = np.full(n_edges, np.inf)
+        self.max = np.full(n_edges, -np.inf)
+        self.exceedances = np.zeros(n_edges, dtype=np.int64)
+        self.reservoir = np.empty((0, n_edges))
+        self._rng = np.random.RandomState(seed)
+
+    def update(self, flows):
+        """
+        Adds a batch of flows of shape (k, n_edges).
+        """
+        flows = np.asarray(flows, dtype=float).reshape(-1, self.n_edges)
+        batch = FlowStatistics(self.n_edges, self.capacities, self.reservoir_size)
+        k = flows.shape[0]
+        if k:
+            batch.count = k
+            batch.mean = flows.mean(axis=0)
+            batch._m2 = ((flows - batch.mean)**2).sum(axis=0)
+            batch.min = flows.min(axis=0)
+            batch.max = flows.max(axis=0)
+            if self.capacities is not None:
+                batch.exceedances = (np.abs(flows) > self.capacities).sum(axis=0)
+            keep = self._rng.permutation(k)[:self.reservoir_size]
+            batch.reservoir = flows[np.sort(keep)]
+        self.merge(batch)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the samples summarized by another FlowStatistics.
+        """
+        n, m = self.count, other.count
+        self.failures += other.failures
+        if m == 0:
+            return self
+        total = n + m
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (m / total)
+        self._m2 = self._m2 + other._m2 + delta**2 * (n * m / total)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.exceedances = self.exceedances + other.exceedances
+
+        # a uniform sample of the union draws a hypergeometric number of
+        # items from each side
+        size = min(self.reservoir_size, total)
+        from_self = self._rng.hypergeometric(n, m, size) if n else 0
+        mine = self._rng.permutation(len(self.reservoir))[:from_self]
+        theirs = self._rng.permutation(len(other.reservoir))[:size - from_self]
+        self.reservoir = np.concatenate([self.reservoir[np.sort(mine)],
+                                         other.reservoir[np.sort(theirs)]])
+        self.count = total
+        return self
+
+    def state(self):
+        """
+        Returns the statistics as a dictionary of arrays, including the
+        state of the reservoir sampling, see :meth:`from_state`.
+        """
+        _, keys, pos, has_gauss, gauss = self._rng.get_state()
+        return {'count': np.array(self.count), 'failures': np.array(self.failures),
+                'reservoir_size': np.array(self.reservoir_size),
+                'mean': self.mean, 'm2': self._m2, 'min': self.min, 'max': self.max,
+                'exceedances': self.exceedances, 'reservoir': self.reservoir,
+                'rng_keys': keys, 'rng_pos': np.array([pos, has_gauss]),
+                'rng_gauss': np.array(gauss)}
+
+    @classmethod
+    def from_state(cls, state, capacities=None):
+        """
+        Rebuilds statistics from :meth:`state`; merging further samples
+        gives the same result as with the original object.
+        """
+        stats = cls(state['mean'].size, capacities, int(state['reservoir_size']))
+        stats.count = int(state['count'])
+        stats.failures = int(state['failures'])
+        stats.mean = np.array(state['mean'])
+        stats._m2 = np.array(state['m2'])
+        stats.min = np.array(state['min'])
+        stats.max = np.array(state['max'])
+        stats.exceedances = np.array(state['exceedances'])
+        stats.reservoir = np.array(state['reservoir'])
+        pos, has_gauss = state['rng_pos'].tolist()
+        stats._rng.set_state(('MT19937', state['rng_keys'], pos, has_gauss,
+                              float(state['rng_gauss'])))
+        return stats
+
+    @property
+    def variance(self):
+        """
+        The unbiased sample variance of the flows
+        """
+        return self._m2 / max(self.count - 1, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def quantiles(self, q=QUANTILES):
+        """
+        Returns estimated quantiles of the flows, of shape (len(q), n_edges)
+        """
+        return np.quantile(self.reservoir, q, axis=0)
+
+    def exceedance_probability(self):
+        """
+        Returns the fraction of the samples in which the magnitude of the
+        flow exceeded the capacity, by edge.
+        """
+        if self.capacities is None:
+            raise ValueError("No capacities were given")
+        return self.exceedances / max(self.count, 1)
+
+
+def _chunk_flows(compiled, model, inputs, integrator, precision='double'):
+    """
+    Returns (flows, failures) for a matrix of inputs of shape (k, n_nodes);
+    flows holds the k - failures samples with a steady state.
+    """
+    if precision != 'double':
+        from .batch import solve_batch
+
+        flows, converged = solve_batch(compiled, model, inputs, integrator, precision)
+        return flows[converged], int(inputs.shape[0] - converged.sum())
+
+    solver = compiled.laplacian_solver()
+    # the linear response; exact for the linear model, the first initial
+    # condition tried for the Kuramoto model
+    x = solver.solve(inputs.T)
+    if model == 'linear':
+        diff = x[compiled.head] - x[compiled.tail]
+        return (compiled.weights[:, np.newaxis] * diff).T, 0
+
+    from .kuramotonetwork import KuramotoNetwork, NTRY
+    flows = []
+    for i in range(inputs.shape[0]):
+        shifted = compiled.with_inputs(inputs[i])
+        thetas = KuramotoNetwork._from_compiled(shifted)._try_find_fps(
+            NTRY, integrator=integrator, warmstart=x[:, i], compiled=shifted)[0]
+        if thetas is not None:
+            flows.append(compiled.weights * np.sin(thetas[compiled.head] - thetas[compiled.tail]))
+    return np.array(flows).reshape(-1, compiled.n_edges), inputs.shape[0] - len(flows)
+
+
+def _chunk_inputs(task, inputs, sampler, n_nodes):
+    start, stop, seed = task
+    if inputs is not None:
+        return np.asarray(inputs[start:stop], dtype=float)
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(sampler(rng, stop - start), dtype=float)
+    if sample.shape != (stop - start, n_nodes):
+        raise ValueError("The sampler returned shape %r, expected %r" %
+                         (sample.shape, (stop - start, n_nodes)))
+    return sample
+
+
+def _chunk_statistics(compiled, model, task, inputs, sampler, integrator, capacities, reservoir,
+                      precision='double'):
+    flows, failures = _chunk_flows(
+        compiled, model, _chunk_inputs(task, inputs, sampler, compiled.n_nodes), integrator,
+        precision)
+    stats = FlowStatistics(compiled.n_edges, capacities, reservoir, seed=task[2].generate_state(1))
+    stats.update(flows)
+    stats.failures = failures
+    return stats
+
+
+class _Shared(object):
+    """
+    Arrays in shared memory, described by picklable specs
+    {name: (block name, shape, dtype)}.
+    """
+
+    def __init__(self, arrays):
+        from multiprocessing import shared_memory
+
+        self.blocks = []
+        self.specs = {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, arr.dtype, buffer=block.buf)[...] = arr
+            self.blocks.append(block)
+            self.specs[name] = (block.name, arr.shape, arr.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def _attach(specs):
+    """
+    Returns ({name: array}, blocks) for the shared arrays of `specs`
+    """
+    from multiprocessing import shared_memory
+
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in specs.items():
+        try:
+            block = shared_memory.SharedMemory(name=block_name, track=False)
+        except TypeError:
+            # before Python 3.13; the pool workers share the resource
+            # tracker of the parent, which unlinks the block only once
+            block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype, buffer=block.buf)
+    return arrays, blocks
+
+
+_WORKER = {}
+
+
+def _init_worker(specs, n_nodes, lattice, model, sampler, integrator, capacities, reservoir,
+                 precision):
+    arrays, blocks = _attach(specs)
+    compiled = CompiledNetwork(range(n_nodes), arrays['head'], arrays['tail'],
+                               arrays['weights'], np.zeros(n_nodes))
+    # the node labels that lattices are recognized by stay in the parent
+    compiled._lattice = lattice
+    _WORKER.update(
+        blocks=blocks,
+        compiled=compiled,
+        inputs=arrays.get('inputs'), model=model, sampler=sampler,
+        integrator=integrator, capacities=capacities, reservoir=reservoir,
+        precision=precision)
+
+
+def _run_worker_chunk(task):
+    w = _WORKER
+    return _chunk_statistics(w['compiled'], w['model'], task, w['inputs'], w['sampler'],
+                             w['integrator'], w['capacities'], w['reservoir'], w['precision'])
+
+
+def ensemble(network, inputs=None, sampler=None, n_samples=None, capacities=None,
+             workers=1, chunk_size=64, seed=None, reservoir=1024, integrator=None,
+             checkpoint=None, checkpoint_interval=60., precision='double'):
+    """
+    Solves the steady flows of `network` for many inputs and returns
+    their statistics.
+
+    Args:
+        network: a LinearFlowNetwork or KuramotoNetwork
+        inputs: matrix of shape (n_samples, n_nodes), nodes in the order
+            of ``network.compile().nodes``
+        sampler: instead of inputs, a function ``sampler(rng, size)``
+            returning a (size, n_nodes) matrix of inputs, drawn with the
+            numpy Generator rng. It must be picklable to use workers.
+        n_samples: number of samples to draw with sampler
+        capacities: edge capacities for the exceedance probabilities, as
+            accepted by :meth:`flownetpy.compiled.CompiledNetwork.edge_values`
+        workers: number of processes, None for one per CPU
+        chunk_size: number of samples per task
+        seed: seed of the sampler and of the reservoir sampling
+        reservoir: number of flow samples kept to estimate quantiles
+        integrator: integrator backend of the Kuramoto model, by name
+        checkpoint: name of a checkpoint file. The statistics of the
+            chunks done so far are saved to it at most every
+            `checkpoint_interval` seconds and when the run stops, and a
+            run with the same arguments resumes from it: the result is
+            the same as without interruption. With seed=None, the
+            entropy saved in the file is reused.
+        checkpoint_interval: minimal time between checkpoints, in seconds
+        precision: 'double', or 'single' to solve in single precision
+            with a double precision refinement, see
+            :func:`flownetpy.batch.solve_batch`
+
+    Returns:
+        a :class:`FlowStatistics`, edges in the order of
+        ``network.compile().edges()``
+    """
+    from .batch import PRECISIONS
+    from .kuramotonetwork import KuramotoNetwork
+
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision %r, choose one of %s" %
+                         (precision, ', '.join(sorted(PRECISIONS))))
+    if (inputs is None) == (sampler is None):
+        raise ValueError("Give either inputs or a sampler")
+    compiled = network.compile()
+    model = 'kuramoto' if isinstance(network, KuramotoNetwork) else 'linear'
+    if inputs is not None:
+        inputs = np.asarray(inputs, dtype=float)
+        if inputs.ndim != 2 or inputs.shape[1] != compiled.n_nodes:
+            raise ValueError("Expected inputs of shape (n_samples, %d), got %r" %
+                             (compiled.n_nodes, inputs.shape))
+        n_samples = inputs.shape[0]
+    elif n_samples is None:
+        raise ValueError("Give the number of samples to draw")
+    if capacities is not None:
+        capacities = np.array(compiled.edge_values(capacities, 'capacity'))
+
+    seed_sequence = np.random.SeedSequence(seed)
+    if checkpoint is not None and seed is None:
+        # resume with the entropy of the interrupted run
+        header = read_header(checkpoint)
+        if header is not None and header.get('format') == 'flownetpy.ensemble':
+            seed_sequence = np.random.SeedSequence(int(header['seed']))
+    seeds = seed_sequence.spawn(-(-n_samples // chunk_size) + 1)
+    tasks = [(start, min(start + chunk_size, n_samples), seeds[i + 1])
+             for i, start in enumerate(range(0, n_samples, chunk_size))]
+    total = FlowStatistics(compiled.n_edges, capacities, reservoir,
+                           seed=seeds[0].generate_state(1))
+
+    first = 0
+    if checkpoint is not None:
+        checkpoint = Checkpoint(checkpoint, {
+            'format': 'flownetpy.ensemble', 'model': model,
+            'network': _digest(np.array([compiled.n_nodes]), compiled.head,
+                               compiled.tail, compiled.weights),
+            'inputs': None if inputs is None else _digest(inputs),
+            'sampler': None if sampler is None else getattr(sampler, '__qualname__',
+                                                            type(sampler).__qualname__),
+            'capacities': None if capacities is None else _digest(capacities),
+            'n_samples': n_samples, 'chunk_size': chunk_size, 'reservoir': reservoir,
+            'precision': precision, 'seed': str(seed_sequence.entropy)})
+        if checkpoint.last() is not None:
+            total = FlowStatistics.from_state(checkpoint.last(), capacities)
+            first = int(checkpoint.last()['next_chunk'])
+        tasks = tasks[first:]
+
+    def run(results):
+        done = saved = first
+        last_save = time.time()
+        try:
+            for stats in results:
+                total.merge(stats)
+                done += 1
+                if checkpoint is not None and time.time() - last_save >= checkpoint_interval:
+                    checkpoint.append(dict(total.state(), next_chunk=np.array(done)))
+                    saved, last_save = done, time.time()
+        finally:
+            if checkpoint is not None and done > saved:
+                checkpoint.append(dict(total.state(), next_chunk=np.array(done)))
+        return total
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1 or len(tasks) <= 1:
+        return run(_chunk_statistics(compiled, model, task, inputs, sampler,
+                                     integrator, capacities, reservoir, precision)
+                   for task in tasks)
+
+    arrays = {'head': compiled.head, 'tail': compiled.tail, 'weights': compiled.weights}
+    if inputs is not None:
+        arrays['inputs'] = inputs
+    shared = _Shared(arrays)
+    try:
+        pool = multiprocessing.Pool(
+            min(workers, len(tasks)), initializer=_init_worker,
+            initargs=(shared.specs, compiled.n_nodes, compiled.lattice(), model, sampler,
+                      integrator, capacities, reservoir, precision))
+        try:
+            return run(pool.imap(_run_worker_chunk, tasks))
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shared.close()
@@ -0,0 +1,602 @@
+"""
+Executors that spread batches of independent shards over worker processes,
+on this machine or on other hosts.
+
+An executor runs ``func(context, shard)`` for every shard of a batch and
+returns the results in shard order::
+
+    with LocalExecutor(4) as executor:
+        results = executor.map(func, shards, context=network)
+
+The `context` is sent once to every worker, the shards one by one.
+
+:class:`DistributedExecutor` serves a :class:`Scheduler` over TCP with
+``multiprocessing.managers``. It listens on localhost unless it is given
+the address of another interface; workers on any host that can reach it
+connect with
+
+    FLOWNETPY_AUTHKEY=KEY python -m flownetpy.executors HOST:PORT
+
+or ``--authkey-file PATH``, so that the key does not show in the process
+list.
+
+and pull shards one at a time, so that fast workers take more of them.
+When no shard is left to hand out, an idle worker steals a copy of a
+shard that has been running for longer than the shards of its batch
+typically take; the first result to arrive wins. A shard that raises, or
+whose worker is lost or exceeds the timeout, is retried up to `retries`
+times before the batch fails with :class:`ShardError`.
+
+:class:`LocalExecutor` is a DistributedExecutor on localhost with its own
+worker processes, which it restarts when they die. :class:`SerialExecutor`
+runs the shards in the calling process.
+
+:func:`sweep` solves the steady flows of a network for many scenarios of
+inputs and weights with any executor, and can resume from a checkpoint
+of the shards it has done.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+
+from .cache import _digest
+from .checkpoint import Checkpoint
+from .compiled import CompiledNetwork
+
+#: the environment variable holding the authkey of a worker
+AUTHKEY_ENV = 'FLOWNETPY_AUTHKEY'
+
+
+class ShardError(RuntimeError):
+    """
+    A shard failed more often than allowed
+    """
+
+
+class Executor(object):
+    """
+    Base class of the executors.
+    """
+
+    def imap(self, func, shards, context=None, retries=2, timeout=None):
+        """
+        Yields ``func(context, shard)`` for every shard, in order.
+
+        Args:
+            func: a picklable function
+            shards: a sequence of picklable shards
+            context: a picklable object sent once to every worker
+            retries: number of times a failed shard is run again
+            timeout: seconds after which a running shard counts as failed,
+                None for no limit
+        """
+        raise NotImplementedError
+
+    def map(self, func, shards, context=None, retries=2, timeout=None):
+        """
+        Returns the list of ``func(context, shard)``, see :meth:`imap`.
+        """
+        return list(self.imap(func, shards, context=context, retries=retries,
+                              timeout=timeout))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class SerialExecutor(Executor):
+    """
+    Runs the shards one after the other in the calling process.
+    """
+
+    def imap(self, func, shards, context=None, retries=2, timeout=None):
+        for index, shard in enumerate(shards):
+            for attempt in range(retries + 1):
+                try:
+                    result = func(context, shard)
+                    break
+                except Exception:
+                    if attempt == retries:
+                        raise ShardError("Shard %d failed %d times:\n%s" %
+                                         (index, retries + 1, traceback.format_exc()))
+            yield result
+
+
+class _Batch(object):
+    def __init__(self, batch_id, func, shards, context, retries, timeout):
+        self.id = batch_id
+        self.func = func
+        self.shards = shards
+        self.context = context
+        self.retries = retries
+        self.timeout = timeout
+        self.pending = deque(range(len(shards)))
+        self.running = {}       # index -> {worker: start time}
+        self.results = {}
+        self.delivered = set()
+        self.failures = [0] * len(shards)
+        self.durations = []
+        self.error = None
+
+
+class Scheduler(object):
+    """
+    Hands out the shards of submitted batches to workers and collects
+    their results. The worker side methods (:meth:`get`, :meth:`context`,
+    :meth:`done`, :meth:`failed`) are called through a manager proxy.
+
+    Attributes:
+        stolen: number of shard copies handed out to idle workers
+        retried: number of failed shard runs
+    """
+
+    def __init__(self, speculative=True):
+        self.speculative = speculative
+        self.stolen = 0
+        self.retried = 0
+        self._batches = {}
+        self._next_id = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    # executor side
+
+    def submit(self, func, shards, context=None, retries=2, timeout=None):
+        with self._cond:
+            batch = _Batch(self._next_id, func, list(shards), context, retries, timeout)
+            self._next_id += 1
+            self._batches[batch.id] = batch
+            self._cond.notify_all()
+            return batch.id
+
+    def result(self, batch_id, index, poll=0.5):
+        """
+        Waits for the result of a shard and returns it.
+        """
+        with self._cond:
+            batch = self._batches[batch_id]
+            while index not in batch.results:
+                if batch.error is not None:
+                    raise ShardError(batch.error)
+                self._expire()
+                self._cond.wait(poll)
+            batch.delivered.add(index)
+            return batch.results.pop(index)
+
+    def cancel(self, batch_id):
+        with self._cond:
+            self._batches.pop(batch_id, None)
+
+    def worker_lost(self, worker):
+        """
+        Counts the shards running on `worker` as failed.
+        """
+        with self._cond:
+            for batch in list(self._batches.values()):
+                for index, copies in list(batch.running.items()):
+                    if worker in copies:
+                        self._failed(batch, index, worker, "worker %s was lost" % worker)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # worker side
+
+    def get(self, worker, wait=1.):
+        """
+        Returns the next shard for `worker` as (batch id, index, func,
+        shard), None if there is none within `wait` seconds, or 'stop'.
+        """
+        deadline = time.time() + wait
+        with self._cond:
+            while True:
+                if self._closed:
+                    return 'stop'
+                self._expire()
+                task = self._next(worker)
+                if task is not None:
+                    return task
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def context(self, batch_id):
+        with self._cond:
+            batch = self._batches.get(batch_id)
+            return None if batch is None else batch.context
+
+    def done(self, worker, batch_id, index, result):
+        with self._cond:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return
+            start = batch.running.pop(index, {}).get(worker)
+            if index in batch.results or index in batch.delivered:
+                return
+            batch.results[index] = result
+            if start is not None:
+                batch.durations.append(time.time() - start)
+            self._cond.notify_all()
+
+    def failed(self, worker, batch_id, index, error):
+        with self._cond:
+            batch = self._batches.get(batch_id)
+            if batch is not None:
+                self._failed(batch, index, worker, error)
+
+    # internals, called with the lock held
+
+    def _start(self, batch, index, worker):
+        batch.running.setdefault(index, {})[worker] = time.time()
+        return batch.id, index, batch.func, batch.shards[index]
+
+    def _next(self, worker):
+        for batch in self._batches.values():
+            if batch.pending and batch.error is None:
+                return self._start(batch, batch.pending.popleft(), worker)
+        if not self.speculative:
+            return None
+
+        # steal a copy of the shard running for the longest time, if it
+        # takes longer than the shards of its batch did on average
+        now, best = time.time(), None
+        for batch in self._batches.values():
+            if not batch.durations or batch.error is not None:
+                continue
+            typical = sum(batch.durations) / len(batch.durations)
+            for index, copies in batch.running.items():
+                if worker in copies or len(copies) > 1 or index in batch.results:
+                    continue
+                age = now - min(copies.values())
+                if age > typical and (best is None or age > best[0]):
+                    best = (age, batch, index)
+        if best is None:
+            return None
+        self.stolen += 1
+        return self._start(best[1], best[2], worker)
+
+    def _failed(self, batch, index, worker, error):
+        copies = batch.running.get(index, {})
+        copies.pop(worker, None)
+        if not copies:
+            batch.running.pop(index, None)
+        if index in batch.results or index in batch.delivered:
+            return
+        self.retried += 1
+        batch.failures[index] += 1
+        if batch.failures[index] > batch.retries:
+            batch.error = "Shard %d failed %d times, last on %s:\n%s" % (
+                index, batch.failures[index], worker, error)
+        elif not copies:
+            batch.pending.appendleft(index)
+        self._cond.notify_all()
+
+    def _expire(self):
+        now = time.time()
+        for batch in list(self._batches.values()):
+            if batch.timeout is None:
+                continue
+            for index, copies in list(batch.running.items()):
+                for worker, start in list(copies.items()):
+                    if now - start > batch.timeout:
+                        self._failed(batch, index, worker,
+                                     "timed out after %g s" % batch.timeout)
+
+
+_EXPOSED = ('get', 'context', 'done', 'failed')
+
+
+def _manager_class(scheduler=None):
+    cls = type('SchedulerManager', (BaseManager,), {})
+    if scheduler is None:
+        cls.register('scheduler', exposed=_EXPOSED)
+    else:
+        cls.register('scheduler', callable=lambda: scheduler, exposed=_EXPOSED)
+    return cls
+
+
+class DistributedExecutor(Executor):
+    """
+    Serves shards to workers connecting over TCP.
+
+    Args:
+        address: (host, port) to listen on; port 0 picks a free port. The
+            actual address is in :attr:`address`. Only local workers can
+            connect to the default; give the address of an interface, or
+            ('', port) for all of them, to accept workers on other hosts.
+        authkey: bytes shared with the workers
+        speculative: whether idle workers steal copies of slow shards
+    """
+
+    def __init__(self, address=('127.0.0.1', 0), authkey=None, speculative=True):
+        self.authkey = authkey if authkey is not None else os.urandom(16)
+        self.scheduler = Scheduler(speculative=speculative)
+        manager = _manager_class(self.scheduler)(address=address, authkey=self.authkey)
+        self._server = manager.get_server()
+        self._server.stop_event = threading.Event()
+        self.address = self._server.address
+        self._accepter = threading.Thread(target=self._accept)
+        self._accepter.daemon = True
+        self._accepter.start()
+
+    def _accept(self):
+        server = self._server
+        while not server.stop_event.is_set():
+            try:
+                conn = server.listener.accept()
+            except OSError:
+                continue
+            if server.stop_event.is_set():
+                conn.close()
+                break
+            thread = threading.Thread(target=server.handle_request, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def imap(self, func, shards, context=None, retries=2, timeout=None):
+        shards = list(shards)
+        batch_id = self.scheduler.submit(func, shards, context, retries, timeout)
+        try:
+            for index in range(len(shards)):
+                yield self.scheduler.result(batch_id, index)
+        finally:
+            self.scheduler.cancel(batch_id)
+
+    def close(self):
+        if self._server.stop_event.is_set():
+            return
+        self.scheduler.close()
+        # give the workers a moment to receive 'stop'
+        time.sleep(0.1)
+        self._server.stop_event.set()
+        # wake up the accepting thread
+        host, port = self.address
+        try:
+            socket.create_connection((host or '127.0.0.1', port), timeout=1).close()
+        except OSError:
+            pass
+        self._accepter.join(5)
+        self._server.listener.close()
+
+
+def run_worker(address, authkey, worker_id=None, wait=1.):
+    """
+    Connects to a :class:`DistributedExecutor` and runs its shards until
+    it closes.
+    """
+    worker_id = worker_id or '%s:%d' % (socket.gethostname(), os.getpid())
+    manager = _manager_class()(address=tuple(address), authkey=authkey)
+    manager.connect()
+    scheduler = manager.scheduler()
+    contexts = {}
+    while True:
+        try:
+            task = scheduler.get(worker_id, wait)
+        except (EOFError, OSError):
+            return
+        if task == 'stop':
+            return
+        if task is None:
+            continue
+        batch_id, index, func, shard = task
+        try:
+            if batch_id not in contexts:
+                contexts.clear()
+                contexts[batch_id] = scheduler.context(batch_id)
+            result = func(contexts[batch_id], shard)
+        except Exception:
+            scheduler.failed(worker_id, batch_id, index, traceback.format_exc())
+            continue
+        try:
+            scheduler.done(worker_id, batch_id, index, result)
+        except (EOFError, OSError):
+            return
+        except Exception:
+            scheduler.failed(worker_id, batch_id, index, traceback.format_exc())
+
+
+class LocalExecutor(DistributedExecutor):
+    """
+    A DistributedExecutor on localhost with `workers` local worker
+    processes, restarted when they die.
+    """
+
+    def __init__(self, workers=None, speculative=True):
+        DistributedExecutor.__init__(self, address=('127.0.0.1', 0), speculative=speculative)
+        self.n_workers = workers or multiprocessing.cpu_count()
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = {}
+        self._started = 0
+        for _ in range(self.n_workers):
+            self._spawn()
+        self._closing = threading.Event()
+        self._monitor = threading.Thread(target=self._watch)
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def _spawn(self):
+        worker_id = 'local-%d' % self._started
+        self._started += 1
+        process = self._context.Process(target=run_worker,
+                                        args=(self.address, self.authkey, worker_id))
+        process.daemon = True
+        process.start()
+        self._workers[worker_id] = process
+
+    def _watch(self):
+        while not self._closing.wait(0.2):
+            for worker_id, process in list(self._workers.items()):
+                if not process.is_alive():
+                    del self._workers[worker_id]
+                    self.scheduler.worker_lost(worker_id)
+                    if not self._closing.is_set():
+                        self._spawn()
+
+    def close(self):
+        if self._server.stop_event.is_set():
+            return
+        self._closing.set()
+        self._monitor.join()
+        DistributedExecutor.close(self)
+        for process in self._workers.values():
+            process.join(2)
+            if process.is_alive():
+                process.terminate()
+
+
+def _solve_scenarios(context, shard):
+    cls, compiled, kwargs = context
+    results = []
+    for inputs, weights in shard:
+        weights = compiled.weights if weights is None else np.asarray(weights, dtype=float)
+        inputs = compiled.inputs if inputs is None else inputs
+        # edges of weight zero are taken out, so that islands are solved apart
+        kept = weights != 0
+        scenario = CompiledNetwork(compiled.nodes, compiled.head[kept], compiled.tail[kept],
+                                   weights[kept], inputs)
+        flows = cls._from_compiled(scenario).steady_flows(**kwargs)
+        if flows is None:
+            results.append(None)
+        else:
+            full = np.zeros(compiled.n_edges)
+            full[kept] = scenario.flow_array(flows)
+            results.append(full)
+    return results
+
+
+def sweep(network, scenarios, executor=None, shard_size=1, retries=2, timeout=None,
+          checkpoint=None, **kwargs):
+    """
+    Solves the steady flows of `network` for a list of scenarios.
+
+    Args:
+        network: a LinearFlowNetwork or KuramotoNetwork
+        scenarios: iterable of dictionaries with an optional 'inputs'
+            array, in the order of ``network.compile().nodes``, and an
+            optional 'weights' array, in edge order; an edge of weight
+            zero is out of service
+        executor: an :class:`Executor`, defaults to a SerialExecutor
+        shard_size: number of scenarios per shard
+        checkpoint: name of a checkpoint file. The flows of every shard
+            are recorded in it, keyed by the shard, as soon as the shard is
+            done, and a sweep with the same arguments only solves the
+            shards that are missing.
+        kwargs: passed to ``steady_flows``
+
+    Returns:
+        a list with, for every scenario, the array of flows in edge order
+        or None if no steady state was found
+    """
+    compiled = network.compile()
+    scenarios = [(scenario.get('inputs'), scenario.get('weights')) for scenario in scenarios]
+    shards = [scenarios[i:i + shard_size] for i in range(0, len(scenarios), shard_size)]
+
+    done = {}
+    if checkpoint is not None:
+        checkpoint = Checkpoint(checkpoint, {
+            'format': 'flownetpy.sweep', 'model': type(network).__name__,
+            'network': _digest(np.array([compiled.n_nodes]), compiled.head, compiled.tail,
+                               compiled.weights, compiled.inputs),
+            'scenarios': _digest(*[None if part is None else np.asarray(part, dtype=float)
+                                   for scenario in scenarios for part in scenario]),
+            'shard_size': shard_size, 'kwargs': repr(sorted(kwargs.items()))},
+            max_states=None)
+        for state in checkpoint.states():
+            done[int(state['shard'])] = [flows if solved else None
+                                         for flows, solved in zip(state['flows'], state['solved'])]
+    missing = [index for index in range(len(shards)) if index not in done]
+
+    executor = executor or SerialExecutor()
+    results = executor.imap(_solve_scenarios, [shards[index] for index in missing],
+                            context=(type(network), compiled, kwargs),
+                            retries=retries, timeout=timeout)
+    for index, result in zip(missing, results):
+        done[index] = result
+        if checkpoint is not None:
+            solved = np.array([flows is not None for flows in result])
+            flows = np.full((len(result), compiled.n_edges), np.nan)
+            for row, shard_flows in enumerate(result):
+                if shard_flows is not None:
+                    flows[row] = shard_flows
+            checkpoint.append({'shard': np.array(index), 'flows': flows, 'solved': solved})
+    return [flows for index in range(len(shards)) for flows in done[index]]
+
+
+def outages(network):
+    """
+    Returns the N-1 scenarios of `network` for :func:`sweep`: one per
+    edge, with that edge out of service.
+    """
+    weights = network.compile().weights
+    scenarios = []
+    for edge in range(weights.size):
+        scenario = weights.copy()
+        scenario[edge] = 0
+        scenarios.append({'weights': scenario})
+    return scenarios
+
+
+def read_authkey(path=None, environ=None):
+    """
+    Returns the authkey of a worker, read from the file `path` if given,
+    and otherwise from the AUTHKEY_ENV environment variable, or None.
+    Surrounding whitespace is dropped.
+    """
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read().strip()
+    value = (os.environ if environ is None else environ).get(AUTHKEY_ENV)
+    return value.strip().encode('utf8') if value else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m flownetpy.executors',
+                                     description='Runs a worker of a DistributedExecutor')
+    parser.add_argument('address', help='HOST:PORT of the executor')
+    parser.add_argument('--authkey-file', metavar='PATH',
+                        help='file holding the authkey, instead of the %s '
+                             'environment variable' % AUTHKEY_ENV)
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of worker processes to run')
+    args = parser.parse_args(argv)
+
+    host, port = args.address.rsplit(':', 1)
+    address = (host, int(port))
+    authkey = read_authkey(args.authkey_file)
+    if not authkey:
+        parser.error("set %s or give --authkey-file" % AUTHKEY_ENV)
+    if args.processes == 1:
+        run_worker(address, authkey)
+        return 0
+    processes = [multiprocessing.Process(target=run_worker, args=(address, authkey))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,28 @@
-from __future__ import division, print_function
+"""
+The numerical core of flownetpy, on plain arrays.
+
+A network is described by its oriented (n_nodes x n_edges) incidence
+matrix in CSR form, with -1 at the head and +1 at the tail of every edge
+(see :func:`incidence_matrix`), an array of edge weights and an array of
+node inputs. The flow along an edge (u, v) is ``w * g(x_u - x_v)``, with
+x the pressures and g the identity in :mod:`flownetpy.flowmodel.linear`,
+x the phases and g the sine in :mod:`flownetpy.flowmodel.kuramoto`.
+Any other law g of :mod:`flownetpy.flowmodel.laws` is solved by the
+Newton solver of :mod:`flownetpy.flowmodel.newton`.
+
+Nothing here uses networkx. The network classes of flownetpy compile
+their graph to these arrays once and call the functions of this package,
+which services can also call directly, e.g.::
+
+    from flownetpy.flowmodel import incidence_matrix, linear
+
+    incidence = incidence_matrix(head, tail, n_nodes)
+    solver = linear.laplacian_solver(incidence, weights)
+    flows, pressures = linear.steady_state(incidence, weights, inputs, solver=solver)
+
+Functions returning arrays accept an `out` buffer to write them into.
+"""
+
+from .incidence import incidence_matrix, endpoints, cycle_basis
+
+__all__ = ['incidence_matrix', 'endpoints', 'cycle_basis']
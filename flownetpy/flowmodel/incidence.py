@@ -0,0 +1,94 @@
+"""
+Oriented incidence matrices and the cycle space of a network.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+
+def incidence_matrix(head, tail, n_nodes, weights=None):
+    """
+    Returns the oriented (n_nodes x n_edges) incidence matrix in CSR form,
+    with -1 at the head and +1 at the tail of every edge, as in
+    ``nx.incidence_matrix(graph, oriented=True)``.
+
+    If `weights` is given, column e is multiplied by weights[e].
+    """
+    import scipy.sparse as sp
+
+    head = np.asarray(head, dtype=np.intp)
+    tail = np.asarray(tail, dtype=np.intp)
+    data = np.ones(head.size) if weights is None else np.asarray(weights, dtype=float)
+    cols = np.arange(head.size)
+    return sp.csr_matrix((np.concatenate([-data, data]),
+                          (np.concatenate([head, tail]), np.concatenate([cols, cols]))),
+                         shape=(n_nodes, head.size))
+
+
+def endpoints(incidence):
+    """
+    Returns the (head, tail) node index arrays of the edges of an
+    unweighted oriented incidence matrix.
+
+    Raises:
+        ValueError: if a column does not hold exactly one -1 and one +1
+    """
+    coo = incidence.tocoo()
+    n_edges = incidence.shape[1]
+    negative = coo.data < 0
+    if not (np.array_equal(np.bincount(coo.col[negative], minlength=n_edges), np.ones(n_edges))
+            and np.array_equal(np.bincount(coo.col[~negative], minlength=n_edges),
+                               np.ones(n_edges))):
+        raise ValueError("Every edge needs one head (-1) and one tail (+1)")
+    head = np.empty(n_edges, dtype=np.intp)
+    tail = np.empty(n_edges, dtype=np.intp)
+    head[coo.col[negative]] = coo.row[negative]
+    tail[coo.col[~negative]] = coo.row[~negative]
+    return head, tail
+
+
+def cycle_basis(incidence=None, head=None, tail=None, n_nodes=None):
+    """
+    Returns a basis of the cycle space as a list of int arrays; each array
+    lists the node indices of a cycle in traversal order.
+
+    The basis holds the fundamental cycles of a breadth first spanning
+    forest. The network is given by its incidence matrix, or by the edge
+    endpoints and the number of nodes.
+    """
+    import scipy.sparse as sp
+    from scipy.sparse.csgraph import breadth_first_order, connected_components
+
+    if incidence is not None:
+        head, tail = endpoints(incidence)
+        n_nodes = incidence.shape[0]
+    n = n_nodes
+    adjacency = sp.csr_matrix(
+        (np.ones(2 * head.size),
+         (np.concatenate([head, tail]), np.concatenate([tail, head]))), shape=(n, n))
+
+    parent = np.full(n, -1, dtype=np.intp)
+    depth = np.zeros(n, dtype=np.intp)
+    labels = connected_components(adjacency, directed=False)[1]
+    for root in np.unique(labels, return_index=True)[1]:
+        order, pred = breadth_first_order(adjacency, root, directed=False)
+        parent[order[1:]] = pred[order[1:]]
+        for node in order[1:].tolist():
+            depth[node] = depth[pred[node]] + 1
+
+    cycles = []
+    for u, v in zip(head.tolist(), tail.tolist()):
+        if u == v or parent[u] == v or parent[v] == u:
+            continue
+        # walk both ends up to their lowest common ancestor
+        left, right = [u], [v]
+        while depth[left[-1]] > depth[right[-1]]:
+            left.append(parent[left[-1]])
+        while depth[right[-1]] > depth[left[-1]]:
+            right.append(parent[right[-1]])
+        while left[-1] != right[-1]:
+            left.append(parent[left[-1]])
+            right.append(parent[right[-1]])
+        cycles.append(np.array(left + right[-2::-1], dtype=np.intp))
+    return cycles
@@ -1,184 +1,485 @@
-from  __future__ import division
+"""
+The Kuramoto model on arrays: the phases follow
+
+    d theta_i/dt = P_i - \\sum_j K_ij sin(theta_i - theta_j)
+
+and the flow along an edge (u, v) is ``K_uv sin(theta_u - theta_v)``.
+Steady states are found by integrating the dynamics until the phases
+settle, from a given initial condition or from random ones.
+"""
+
+from __future__ import division
 
 import numpy as np
-import networkx as nx
-from scipy.integrate import ode
 
-from .tools import FlowDict
+from ..instrument import phase
+from ..integrators import get_integrator
+from .incidence import endpoints as _endpoints
 
 TMAX = 200
 TOL = 10e-6
-NTRY=10
+NTRY = 10
 
-def steady_flows(flownet, initguess=None, extra_output=True):
+
+def _csr_kernels():
+    """
+    Returns the module of the in place CSR products of scipy, or None if
+    this version of scipy does not have it.
     """
-    Computes the steady state flows. 
+    try:
+        from scipy.sparse import _sparsetools
+    except ImportError:
+        return None
+    return _sparsetools
 
-    Args:
-        flownet: A FlowNetwork object
-        initguess: Initial conditions
-        extra_output: boolean
 
-    Returns:
-        A dictionary
-            d = {edge1 : flow1, edge2 : flow2,...}
-        If extra_output=True, returns another dictionary
-            data = {initguess: the_initial_condition, 'thetas': steady_state_thetas, 'omega': winding_vector}
+def _check_scatter(scatter, matrix):
+    """
+    Returns whether the in place CSR products in `scatter` give the public
+    product with `matrix`, for a single state and a batch of states. The
+    products are private to scipy, so any error means they are not used.
+    """
+    kernels, (n, m, indptr, indices, data) = scatter
+    x = np.linspace(1., 2., 2 * m).reshape(m, 2).astype(matrix.dtype)
+    y = np.zeros(n, matrix.dtype)
+    ys = np.zeros((n, 2), matrix.dtype)
+    try:
+        kernels.csr_matvec(n, m, indptr, indices, data, x[:, 0].copy(), y)
+        kernels.csr_matvecs(n, m, 2, indptr, indices, data,
+                            x.ravel(), ys.ravel())
+    except Exception:
+        return False
+    expected = matrix.dot(x)
+    return np.allclose(y, expected[:, 0]) and np.allclose(ys, expected)
+
+
+class KuramotoRHS(object):
     """
+    The right hand side of the Kuramoto dynamics,
 
-    thetas, initguess = _try_find_fps(NTRY, flownet, initguess=initguess)
+        d theta_i/dt = P_i - \\sum_j K_ij sin(theta_i - theta_j)
 
-    if thetas is None:
-        return None, {'initguess': initguess}
+    Called as ``rhs(t, th)`` with a single state of shape (n_nodes,) or a
+    batch of states of shape (n_nodes, k). The edge and node sized work
+    buffers are allocated once for every batch size and reused on later
+    calls, so an object must not be shared between threads.
 
-    node_indices = {node: idx for idx, node in enumerate(flownet.nodes())}
-    flows = FlowDict({(u, v): np.sin(thetas[node_indices[u]] - thetas[node_indices[v]])*
-        dat.get(flownet.weight_attr, 1) for (u, v, dat) in flownet.edges(data=True)})
+    Args:
+        incidence: the oriented incidence matrix, see
+            :func:`flownetpy.flowmodel.incidence_matrix`
+        weights: the couplings K of the edges
+        inputs: the inputs P, of shape (n_nodes,) or (n_nodes, k) for a
+            batch with different inputs
+        reuse_output: if True, the returned array is an internal buffer that
+            is overwritten by the next call. Only safe with integrators that
+            copy it, see :attr:`flownetpy.integrators.Integrator.copies_output`.
+        dtype: the precision of the evaluation. With np.float32 the edge
+            and node arrays take half the memory and bandwidth, at single
+            precision accuracy.
+        endpoints: the (head, tail) arrays of the edges, if at hand
+
+    Attributes:
+        nfev: number of evaluations so far
+    """
+
+    #: smaller networks are evaluated with dense products, as the calls
+    #: into the sparse kernels cost more than the arithmetic at that size
+    DENSE_NODES = 32
+
+    def __init__(self, incidence, weights, inputs, reuse_output=False, dtype=np.float64,
+                 endpoints=None):
+        self.dtype = np.dtype(dtype)
+        self.head, self.tail = endpoints if endpoints is not None else _endpoints(incidence)
+        self.weights = np.asarray(weights, dtype=self.dtype)
+        self.inputs = np.asarray(inputs, dtype=self.dtype)
+        self.reuse_output = reuse_output
+        self.nfev = 0
+        self._n_nodes = incidence.shape[0]
+        self._incidence = incidence
+        self._incidence_w = None
+        self._scatter = False
+        self._dense = False
+        self._buffers = {}
+
+    def _get_buffers(self, shape):
+        try:
+            return self._buffers[shape]
+        except KeyError:
+            edge_shape = (self.head.size,) + shape[1:]
+            bufs = (np.empty(edge_shape, self.dtype), np.empty(edge_shape, self.dtype),
+                    np.empty(shape, self.dtype))
+            self._buffers[shape] = bufs
+            return bufs
+
+    def _weighted_incidence(self):
+        if self._incidence_w is None:
+            self._incidence_w = self._incidence.multiply(
+                self.weights[np.newaxis, :]).tocsr().astype(self.dtype)
+        return self._incidence_w
+
+    def _csr_scatter(self):
+        """
+        Returns the scipy module of the in place CSR products and the
+        (n_rows, n_cols, indptr, indices, data) of the weighted incidence
+        matrix, or None if this version of scipy does not have them or
+        they fail the check against the public product.
+        """
+        if self._scatter is False:
+            self._scatter = None
+            kernels = _csr_kernels()
+            if kernels is not None:
+                incidence_w = self._weighted_incidence().tocsr()
+                scatter = kernels, incidence_w.shape + (
+                    incidence_w.indptr, incidence_w.indices, incidence_w.data)
+                if _check_scatter(scatter, incidence_w):
+                    self._scatter = scatter
+        return self._scatter
+
+    def _dense_incidence(self):
+        """
+        Returns the dense (B^T, -B_w) pair for networks of fewer than
+        `DENSE_NODES` nodes, and None for larger ones.
+        """
+        if self._dense is False:
+            self._dense = None
+            if self._n_nodes < self.DENSE_NODES:
+                self._dense = (np.ascontiguousarray(self._incidence.T.toarray(), self.dtype),
+                               -self._weighted_incidence().toarray())
+        return self._dense
+
+    def __call__(self, t, th, out=None):
+        self.nfev += 1
+        th = np.asarray(th, dtype=self.dtype)
+        diff, tmp, node_buf = self._get_buffers(th.shape)
+        if out is None:
+            out = node_buf if self.reuse_output else np.empty(th.shape, self.dtype)
+        ok_out = out.dtype == self.dtype and out.flags.c_contiguous
+
+        dense = self._dense if self._dense is not False else self._dense_incidence()
+        if dense is not None and ok_out:
+            # B^T theta = theta_tail - theta_head, so -B_w scatters its sine
+            np.dot(dense[0], th, out=diff)
+            np.sin(diff, out=diff)
+            np.dot(dense[1], diff, out=out)
+            out += self.inputs if self.inputs.ndim == th.ndim else self.inputs[:, np.newaxis]
+            return out
+
+        # diff = sin(theta_u - theta_v) on every edge (u, v), and the
+        # weighted incidence matrix scatters K_uv * diff to u and v
+        th.take(self.head, axis=0, out=diff)
+        th.take(self.tail, axis=0, out=tmp)
+        np.subtract(diff, tmp, out=diff)
+        np.sin(diff, out=diff)
+
+        out[...] = self.inputs if self.inputs.ndim == th.ndim else self.inputs[:, np.newaxis]
+        scatter = self._scatter if self._scatter is not False else self._csr_scatter()
+        if scatter is None or not ok_out:
+            out += self._weighted_incidence().dot(diff)
+        elif th.ndim == 1:
+            # y += A x into the output buffer, without the temporaries of A.dot
+            scatter[0].csr_matvec(*(scatter[1] + (diff, out)))
+        else:
+            n, m, indptr, indices, data = scatter[1]
+            scatter[0].csr_matvecs(n, m, th.shape[1], indptr, indices, data, diff.ravel(),
+                                   out.ravel())
+        return out
 
-    if extra_output:
-        omega = _omega(flownet, nx.cycle_basis(flownet), thetas)
-        return flows, {'initguess': initguess, 'thetas': thetas, 'omega': omega}
-    else:
-        return flows
 
-def _try_find_fps(ntry, flownet, tmax=TMAX, tol=TOL, initguess=None):
+class KuramotoJacobian(object):
     """
-    Tries to find a fixed point of the Kuramoto network. 
+    The jacobian of :class:`KuramotoRHS`,
 
-    Args:
-        ntry    : number of initial conditions that will be tried to reach a fixed point
-        flownet : a FlowNetwork  object
-        tmax    : integration time
-        tol     : the odesolver ends when the variance of thetas  are less than tol
-        initguess : initial condition. If specified, ntry doesn't have any effect
+        J_ij = K_ij cos(theta_i - theta_j),   J_ii = -\\sum_j J_ij
 
-    Returns:
-        (fixed point, initguess)
+    returned as a CSR matrix, or as a dense array if `dense` is True. The
+    sparsity pattern and the data buffers are built once and only the
+    values are updated on every call.
 
-    Note:
-        If no fixed point is found, returns (None, initguess)
-    """
+    A batch of states of shape (n_nodes, k) is treated as the flattened
+    state ``th.ravel()`` of k independent copies of the network; the
+    jacobian then has shape (n_nodes*k, n_nodes*k).
 
-    dt = tmax / 1000
+    Args:
+        incidence: the oriented incidence matrix
+        weights: the couplings K of the edges
+        dense: whether to return dense arrays
+        reuse_output: if True, the returned matrix is overwritten by the
+            next call
+        endpoints: the (head, tail) arrays of the edges, if at hand
+
+    Attributes:
+        njev: number of evaluations so far
+    """
 
-    if initguess is not None: # then use the specified initguess    
-        sol = _evolve(flownet, np.arange(0, tmax, dt), initguess = initguess)
-        if _has_converged(sol):
-            return sol[-1], initguess
+    def __init__(self, incidence, weights, dense=False, reuse_output=False, endpoints=None):
+        self.head, self.tail = endpoints if endpoints is not None else _endpoints(incidence)
+        self.weights = np.asarray(weights, dtype=float)
+        self.dense = dense
+        self.reuse_output = reuse_output
+        self.njev = 0
+        self._n_nodes = incidence.shape[0]
+        self._patterns = {}
+
+    def _get_pattern(self, k):
+        """
+        Returns (order, matrix, buffers) for a batch of k states
+        """
+        try:
+            return self._patterns[k]
+        except KeyError:
+            pass
+
+        n, E = self._n_nodes, self.head.size
+        nodes = np.arange(n)
+        rows = np.concatenate([self.head, self.tail, nodes])
+        cols = np.concatenate([self.tail, self.head, nodes])
+        # entry (i, j) of copy c sits at (i*k + c, j*k + c) of the flat state
+        shift = np.arange(k)
+        rows = (rows[:, np.newaxis] * k + shift).ravel()
+        cols = (cols[:, np.newaxis] * k + shift).ravel()
+
+        order = np.lexsort((cols, rows))
+        values = np.empty((2*E + n, k))
+        diff = np.empty((E, k))
+        if self.dense:
+            matrix = np.zeros((n*k, n*k))
+            order = (rows, cols)
         else:
-            return None, initguess
-    
-    for ntry in range(ntry): # otherwise try `ntry` random initguesses
-        initguess = _random_stableop_initguess(flownet.number_of_nodes())
-        sol = _evolve(flownet, np.arange(0, tmax, dt), initguess)
-        if _has_converged(sol):
-            return sol[-1], initguess
-
-    return None, initguess
+            import scipy.sparse as sp
+
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n*k))])
+            matrix = sp.csr_matrix((np.empty(rows.size), cols[order], indptr),
+                                   shape=(n*k, n*k))
+        self._patterns[k] = (order, matrix, (values, diff))
+        return self._patterns[k]
+
+    def __call__(self, t, th):
+        self.njev += 1
+        th = np.asarray(th)
+        n, E = self._n_nodes, self.head.size
+        k = th.size // n
+        order, matrix, (values, diff) = self._get_pattern(k)
+        th = th.reshape(n, k)
+
+        edge_vals = values[:E]
+        np.take(th, self.head, axis=0, out=edge_vals)
+        np.take(th, self.tail, axis=0, out=diff)
+        np.subtract(edge_vals, diff, out=edge_vals)
+        np.cos(edge_vals, out=edge_vals)
+        np.multiply(edge_vals, self.weights[:, np.newaxis], out=edge_vals)
+        values[E:2*E] = edge_vals
+
+        diag = values[2*E:]
+        diag[...] = 0
+        np.subtract.at(diag, self.head, edge_vals)
+        np.subtract.at(diag, self.tail, edge_vals)
+
+        if self.dense:
+            if not self.reuse_output:
+                matrix = np.zeros_like(matrix)
+            else:
+                matrix[...] = 0
+            np.add.at(matrix, order, values.ravel())
+            return matrix
+
+        np.take(values.ravel(), order, out=matrix.data)
+        if self.reuse_output:
+            return matrix
+        return type(matrix)((matrix.data.copy(), matrix.indices, matrix.indptr),
+                             shape=matrix.shape)
+
+
+def system(incidence, weights, inputs, integrator, endpoints=None):
+    """
+    Returns the (rhs, jacobian) pair for integrating the Kuramoto dynamics
+    with `integrator`; the jacobian is None if the integrator does not use
+    one.
+    """
+    if endpoints is None:
+        endpoints = _endpoints(incidence)
+    rhs = KuramotoRHS(incidence, weights, inputs, reuse_output=integrator.copies_output,
+                      endpoints=endpoints)
+    jac = None
+    if integrator.jacobian is not None:
+        jac = KuramotoJacobian(incidence, weights, dense=integrator.jacobian == 'dense',
+                               endpoints=endpoints)
+    return rhs, jac
+
+
+def rhs(thetas, incidence, weights, inputs, out=None):
+    """
+    Returns the right hand side of the dynamics at `thetas`, of shape
+    (n_nodes,) or (n_nodes, k).
+    """
+    return KuramotoRHS(incidence, weights, inputs)(0, thetas, out=out)
 
 
-def _evolve(flownet, tarr, initguess=None):
+def flows(thetas, incidence, weights, out=None):
     """
-    Evolves the flow network from `initguess` by timesteps in `tarr`
+    Returns the flows ``K sin(theta_head - theta_tail)`` for phases of
+    shape (n_nodes,) or (n_nodes, k).
     """
-    M = nx.incidence_matrix(flownet, oriented=True).toarray()
-    Mw = nx.incidence_matrix(flownet, oriented=True, weight=flownet.weight_attr).toarray()
-    P = np.array([flownet.node[n]['input'] for n in flownet.nodes()])
-    
-    if initguess is None:
-        initguess = _random_stableop_initguess(flownet.number_of_nodes())
-    
-    return odeint(_kuramoto_ode, initguess, t=tarr, args=(M, Mw, P))
+    thetas = np.asarray(thetas, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape((-1,) + (1,) * (thetas.ndim - 1))
+    # the incidence is -1 at the head: B^T theta = theta_tail - theta_head
+    diff = incidence.T.dot(thetas)
+    if out is None:
+        out = diff
+    np.sin(-diff, out=out)
+    return np.multiply(out, weights, out=out)
 
 
-def _has_converged(time_series, window_size=0):
+def has_converged(time_series, window_size=0):
     """
     Detects if the time series has converged, by
     checking the values during the window given by 'window_size'
     """
 
     if window_size == 0:  # The window over which time series must be constant
-        window_size = time_series.shape[0]//10 
+        window_size = time_series.shape[0]//10
 
     return np.allclose(np.var(time_series[-window_size:, :], axis=0), 0)
 
 
-def odeint(func, x0, t=None, args=None, jac = None):
+def odeint(func, x0, t=None, args=None, jac = None, integrator=None, final_only=False,
+           dtype=np.float64):
     """
     Integrate an ode for time array t
+
+    Args:
+        integrator: backend name or Integrator object, see
+            :func:`flownetpy.integrators.get_integrator`
+        final_only: if True, return only the state at t[-1]
+        dtype: dtype of the returned states
     """
-    if jac:
-        r = ode(func, func).set_integrator('vode', method='bdf')
-        r.set_initial_value(x0, t[0]).set_f_params(*args)
-        r.set_jac_params(*args)
-    else:
-        r = ode(func).set_integrator('vode', method='bdf')
-        r.set_initial_value(x0, t[0]).set_f_params(*args)
+    integrator = get_integrator(integrator)
+    return integrator.integrate(func, np.asarray(x0, dtype=float), t,
+                                args=args or (), jac=jac, final_only=final_only,
+                                dtype=dtype)
 
-    res = np.zeros((t.size, x0.size))
-    res[0,:] = x0
 
-    for idx, tnow in enumerate(t[1:]):
-        r.integrate(tnow)
-        res[idx+1, :] = r.y
-    return res
+def evolve(incidence, weights, inputs, tarr, initguess=None, integrator=None,
+           final_only=False, endpoints=None):
+    """
+    Evolves the phases from `initguess`, random if not given, by timesteps
+    in `tarr`, and returns them at every time, or only at tarr[-1] if
+    `final_only` is True.
+    """
+    integrator = get_integrator(integrator)
+    rhs, jac = system(incidence, weights, inputs, integrator, endpoints)
+    if initguess is None:
+        initguess = random_stable_initguess(incidence.shape[0])
+    return odeint(rhs, initguess, t=tarr, jac=jac, integrator=integrator,
+                  final_only=final_only)
 
 
-def _kuramoto_ode(t, th, M_I, M_I_w, P):
+def find_fixed_point(incidence, weights, inputs, ntry=NTRY, tmax=TMAX, initguess=None,
+                     integrator=None, warmstart=None, endpoints=None, stats=None):
     """
+    Tries to find a fixed point of the Kuramoto dynamics.
+
     Args:
-	    th: theta, array with size=nnodes
-	    t: time
-	    M_I: unweighted oriented incidence matrix
-	    M_I_W: weighted oriented incidence matrix
-	    P: Power production at each node
+        ntry    : number of initial conditions that will be tried to reach a fixed point
+        tmax    : integration time
+        initguess : initial condition. If specified, ntry doesn't have any effect
+        integrator : integrator backend, see :func:`flownetpy.integrators.get_integrator`
+        warmstart : initial condition tried before the `ntry` random ones
+        endpoints : the (head, tail) arrays of the edges, if at hand
+        stats : a :class:`flownetpy.instrument.SolverStats` to update
+
+    Returns:
+        (fixed point, initguess)
+
+    Note:
+        If no fixed point is found, returns (None, initguess)
+    """
+    dt = tmax / 1000
+    tarr = np.arange(0, tmax, dt)
+    integrator = get_integrator(integrator)
+    with phase(stats, 'compile'):
+        rhs, jac = system(incidence, weights, inputs, integrator, endpoints)
+
+    def attempt(x0):
+        with phase(stats, 'integrate'):
+            sol = odeint(rhs, x0, t=tarr, jac=jac, integrator=integrator)
+        if stats is not None:
+            stats.attempts += 1
+            stats.nfev = rhs.nfev
+            stats.njev = jac.njev if jac is not None else 0
+        return sol[-1] if has_converged(sol) else None
+
+    if initguess is not None: # then use the specified initguess
+        return attempt(initguess), initguess
+
+    if warmstart is not None:
+        thetas = attempt(warmstart)
+        if thetas is not None:
+            return thetas, warmstart
+
+    for ntry in range(ntry): # otherwise try `ntry` random initguesses
+        initguess = random_stable_initguess(incidence.shape[0])
+        thetas = attempt(initguess)
+        if thetas is not None:
+            return thetas, initguess
+
+    return None, initguess
+
+
+def steady_state(incidence, weights, inputs, initguess=None, integrator=None,
+                 warmstart=None, out=None):
+    """
+    Returns (flows, phases) of a stable steady state, or (None, None) if
+    none was found; see :func:`find_fixed_point`.
+
+    Args:
+        out: array to write the flows into
     """
-    return P - np.dot(M_I_w, np.sin(np.dot(M_I.T, th)))
+    thetas, _ = find_fixed_point(incidence, weights, inputs, initguess=initguess,
+                                 integrator=integrator, warmstart=warmstart)
+    if thetas is None:
+        return None, None
+    return flows(thetas, incidence, weights, out=out), thetas
 
-def _kuramoto_jacobian(t, th, M_I, M_I_w, P):
-    return -np.dot(M_I_w, np.cos(np.dot(M_I.T, th)))
 
-def _omega(graph, cycles, thetas):
+def winding_numbers(cycles, thetas):
     """
-    Calculates the winding number:
-        (\sum_{i,j \in cycle} asin(\theta_j-\theta_i))/2\pi
+    Returns the winding numbers of the phases along cycles given as
+    sequences of node indices:
+
+        (\\sum_{i,j \\in cycle} asin(\\theta_j-\\theta_i))/2\\pi
     """
     omegas = []
-    node2idx = {node:idx for idx, node in enumerate(graph.nodes())}
     for cycle in cycles:
-        omega = 0
-        angles_cycle = np.array([thetas[node2idx[node]]\
-                       for node in cycle])
-        phasediffs_cycle = _mod_pi(angles_cycle - np.roll(angles_cycle, 1))
-
+        angles_cycle = np.asarray(thetas)[np.asarray(cycle, dtype=np.intp)]
+        phasediffs_cycle = mod_pi(angles_cycle - np.roll(angles_cycle, 1))
 
         omega = np.sum(phasediffs_cycle) / np.pi / 2
         omegas.append(omega)
     return omegas
 
 
-def _random_stableop_initguess(size):
+def random_stable_initguess(size):
     """
     Args:
         size: int
 
     Returns:
-        An array res of random numbers s.t. 
-        |res[i]-res[i+1 % size]| < \pi/2
+        An array res of random numbers s.t.
+        |res[i]-res[i+1 % size]| < \\pi/2
     """
     low = -np.pi / 2
     high = np.pi / 2
-    
+
     initguess = np.cumsum(np.random.uniform(low=low, high=high, size=size - 1))
     initguess = np.insert(initguess, 0, 0)
 
-    if np.abs(_mod_pi(initguess[-1])) > np.pi/2:
-        return _random_stableop_initguess(size)
+    if np.abs(mod_pi(initguess[-1])) > np.pi/2:
+        return random_stable_initguess(size)
     else:
         return initguess
 
 
-def _mod_pi(angle):
+def mod_pi(angle):
     """
     given an angle, returns an equivalent angle
     within the interval [-pi,pi]
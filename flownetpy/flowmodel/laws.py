@@ -0,0 +1,180 @@
+"""
+Edge flow laws: the flow along an edge (u, v) of weight w is
+``w * law.flow(x_u - x_v)``.
+
+A law is vectorized over arrays of potential differences and has an
+analytic derivative, which the Newton solver of
+:mod:`flownetpy.flowmodel.newton` uses for its jacobian, and optionally
+an antiderivative, the energy that its line search decreases. Laws must
+be increasing wherever a steady state is sought: the jacobian is then a
+weighted Laplacian, and steady states minimize the energy. Concave laws,
+whose flow grows slower than the potential difference, also have an
+inverse: the solver then carries the flows between its steps.
+
+New laws subclass :class:`FlowLaw`; their repr must tell them apart,
+since it is part of the cache keys of their solutions.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+
+class FlowLaw(object):
+    """
+    Base class of the flow laws.
+
+    Attributes:
+        concave: True if the flow grows slower than linearly away from
+            zero, as for a square root law. Newton's method on the
+            potentials overshoots around the zero flows of such laws, and
+            :func:`flownetpy.flowmodel.newton.solve` linearizes them
+            around flows instead, which needs :meth:`inverse`.
+    """
+    concave = False
+
+    def flow(self, dx, out=None):
+        """
+        Returns the flow for potential differences `dx` and unit weight.
+        """
+        raise NotImplementedError
+
+    def derivative(self, dx, out=None):
+        """
+        Returns the derivative of :meth:`flow` at `dx`.
+        """
+        raise NotImplementedError
+
+    def energy(self, dx):
+        """
+        Returns an antiderivative of :meth:`flow` at `dx`, the energy that
+        steady states minimize; laws without one return None.
+        """
+        return None
+
+    def inverse(self, flow, out=None):
+        """
+        Returns the potential differences of the flows `flow`, for unit
+        weight.
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '%s()' % type(self).__name__
+
+    def __eq__(self, other):
+        return type(self) is type(other) and repr(self) == repr(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(repr(self))
+
+
+class Linear(FlowLaw):
+    """
+    The flow is the potential difference, as in
+    :class:`flownetpy.LinearFlowNetwork`.
+    """
+
+    def flow(self, dx, out=None):
+        if out is None:
+            return np.array(dx, dtype=float)
+        out[...] = dx
+        return out
+
+    def derivative(self, dx, out=None):
+        if out is None:
+            return np.ones(np.shape(dx))
+        out[...] = 1.
+        return out
+
+    def energy(self, dx):
+        return np.square(dx) / 2
+
+
+class Sine(FlowLaw):
+    """
+    The flow is the sine of the phase difference, as in
+    :class:`flownetpy.KuramotoNetwork`. It only increases for phase
+    differences within (-pi/2, pi/2), which is where stable steady states
+    lie.
+    """
+
+    def flow(self, dx, out=None):
+        return np.sin(dx, out=out)
+
+    def derivative(self, dx, out=None):
+        return np.cos(dx, out=out)
+
+    def energy(self, dx):
+        return 1 - np.cos(dx)
+
+
+class Power(FlowLaw):
+    """
+    The flow is ``sign(dx) * |dx|**exponent``, smoothed around zero as
+
+        dx * (dx**2 + smoothing**2)**((exponent - 1) / 2)
+
+    so that the derivative stays finite and positive.
+
+    Pipe networks follow such laws with the pressure (or head) drop as
+    the potential difference: exponent 1/2 for a quadratic friction law
+    such as Darcy-Weisbach in the turbulent regime, 0.54 for the
+    Hazen-Williams law of water networks. The weights are then the
+    conductances ``r**(-exponent)`` of pipes with resistances r.
+    """
+
+    def __init__(self, exponent, smoothing=1e-6):
+        if exponent <= 0:
+            raise ValueError("The exponent must be positive, got %r" % exponent)
+        self.exponent = float(exponent)
+        self.smoothing = float(smoothing)
+
+    @property
+    def concave(self):
+        return self.exponent < 1
+
+    def flow(self, dx, out=None):
+        dx = np.asarray(dx, dtype=float)
+        scale = (dx**2 + self.smoothing**2)**((self.exponent - 1) / 2)
+        return np.multiply(dx, scale, out=out)
+
+    def derivative(self, dx, out=None):
+        dx = np.asarray(dx, dtype=float)
+        square = dx**2
+        # d/dx dx s**((a-1)/2) = s**((a-3)/2) (a dx**2 + smoothing**2)
+        scale = (square + self.smoothing**2)**((self.exponent - 3) / 2)
+        return np.multiply(scale, self.exponent * square + self.smoothing**2, out=out)
+
+    def energy(self, dx):
+        dx = np.asarray(dx, dtype=float)
+        return (dx**2 + self.smoothing**2)**((self.exponent + 1) / 2) / (self.exponent + 1)
+
+    def inverse(self, flow, out=None, max_iter=50):
+        flow = np.asarray(flow, dtype=float)
+        # the unsmoothed inverse, refined by Newton steps on flow(dx) = flow:
+        # it underestimates |dx| for exponents below 1, where the law is
+        # concave away from zero, overestimates it above 1, where it is
+        # convex, and the steps move |dx| monotonically to the solution
+        dx = np.sign(flow) * np.abs(flow)**(1 / self.exponent)
+        for _ in range(max_iter):
+            step = (flow - self.flow(dx)) / self.derivative(dx)
+            dx += step
+            if np.all(np.abs(step) <= 1e-15 * np.maximum(np.abs(dx), self.smoothing)):
+                break
+        if out is None:
+            return dx
+        out[...] = dx
+        return out
+
+    def __repr__(self):
+        return 'Power(%r, smoothing=%r)' % (self.exponent, self.smoothing)
+
+
+#: a friction law with the pressure drop quadratic in the flow
+QUADRATIC = Power(0.5)
+#: the Hazen-Williams law of water networks
+HAZEN_WILLIAMS = Power(0.54)
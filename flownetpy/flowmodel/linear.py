@@ -0,0 +1,91 @@
+"""
+The linear flow model on arrays: the flow along an edge (u, v) is
+``w * (p_u - p_v)`` and the steady state pressures solve ``L p = P``,
+with L the weighted Laplacian and P the inputs.
+
+The inputs of every connected component are balanced first: an excess is
+spread evenly over the nodes of its component, and the pressures have zero
+mean on every component.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+
+def laplacian(incidence, weights):
+    """
+    Returns the weighted (n_nodes x n_nodes) Laplacian ``B diag(w) B^T``
+    in CSR form.
+    """
+    import scipy.sparse as sp
+
+    weighted = incidence.dot(sp.diags(np.asarray(weights, dtype=float)))
+    return sp.csr_matrix(weighted.dot(incidence.T))
+
+
+def laplacian_solver(incidence, weights, dtype=np.float64):
+    """
+    Returns a :class:`flownetpy.laplacian.LaplacianSolver` of the weighted
+    Laplacian, to be reused for many inputs.
+    """
+    from ..laplacian import LaplacianSolver
+
+    return LaplacianSolver(laplacian(incidence, weights), dtype=dtype)
+
+
+def pressures(incidence, weights, inputs, solver=None, out=None):
+    """
+    Returns the steady state pressures for inputs of shape (n_nodes,) or
+    (n_nodes, k).
+
+    Args:
+        solver: the :func:`laplacian_solver` of the network, built if not given
+        out: array to write the pressures into
+    """
+    if solver is None:
+        solver = laplacian_solver(incidence, weights)
+    x = solver.solve(inputs)
+    if out is None:
+        return x
+    out[...] = x
+    return out
+
+
+def flows(incidence, weights, pressures, out=None):
+    """
+    Returns the flows ``w * (p_head - p_tail)`` for pressures of shape
+    (n_nodes,) or (n_nodes, k).
+    """
+    pressures = np.asarray(pressures, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape((-1,) + (1,) * (pressures.ndim - 1))
+    # the incidence is -1 at the head: B^T p = p_tail - p_head
+    diff = incidence.T.dot(pressures)
+    if out is None:
+        out = diff
+    return np.multiply(diff, -weights, out=out)
+
+
+def residual(incidence, inputs, flows, out=None):
+    """
+    Returns the imbalance ``P - outflow`` at every node, zero at a steady
+    state with balanced inputs.
+    """
+    net = incidence.dot(flows)
+    if out is None:
+        out = net
+    # the incidence is -1 at the head: B f is minus the outflow
+    return np.add(inputs, net, out=out)
+
+
+def steady_state(incidence, weights, inputs, solver=None, out=None):
+    """
+    Returns (flows, pressures) of the steady state for inputs of shape
+    (n_nodes,) or (n_nodes, k).
+
+    Args:
+        solver: the :func:`laplacian_solver` of the network, built if not given
+        out: array to write the flows into
+    """
+    x = pressures(incidence, weights, inputs, solver=solver)
+    return flows(incidence, weights, x, out=out), x
@@ -0,0 +1,201 @@
+"""
+Steady states of any flow law by Newton's method.
+
+The steady state equations of a network with flows ``w * g(x_u - x_v)``
+are
+
+    F(x) = P + B (w * g(-B^T x)) = 0
+
+with B the oriented incidence matrix (-1 at the head of an edge) and P
+the inputs. Their jacobian is ``-L``, with L the Laplacian weighted by
+``w * g'(x_u - x_v)``; every Newton step solves ``L dx = F(x)`` with a
+sparse factorization. F is minus the gradient of an energy that is convex
+where the law increases, see :func:`energy`, and a step is halved until
+it decreases the energy enough or halves the norm of F (backtracking line
+search).
+
+Around the zero flows of concave laws, such as a square root law, the
+law is steep and Newton steps on the potentials overshoot: on a single
+edge they map dx to -dx. For these laws the solver carries the flows q
+of the linearized laws instead, as the global gradient algorithm of
+water networks does (Todini and Pilati, 1988): every edge is linearized
+around the potential difference ``law.inverse(q / w)`` of its flow, and
+the new flows follow the linearized laws. Near a zero flow the flow is
+then at worst halved by every step.
+
+Starting from a nearby solution, e.g. of similar inputs, saves most of
+the steps.
+
+A steady state needs inputs that sum to zero on every connected
+component, and an increasing law at the solution, so that L is a
+Laplacian with positive weights.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+from .linear import laplacian
+
+
+def residual(x, incidence, weights, inputs, law, out=None):
+    """
+    Returns F(x), the net inflow at every node.
+    """
+    # the incidence is -1 at the head: -B^T x = x_head - x_tail
+    flows = np.asarray(weights) * law.flow(-incidence.T.dot(x))
+    net = incidence.dot(flows)
+    if out is None:
+        out = net
+    return np.add(inputs, net, out=out)
+
+
+def energy(x, incidence, weights, inputs, law):
+    """
+    Returns the energy ``sum_e w_e G(x_u - x_v) - P.x``, with G the
+    antiderivative of the law, or None if the law has none. F(x) is minus
+    its gradient.
+    """
+    edge_energy = law.energy(-incidence.T.dot(x))
+    if edge_energy is None:
+        return None
+    return np.dot(weights, edge_energy) - np.dot(inputs, x)
+
+
+def jacobian_weights(x, incidence, weights, law):
+    """
+    Returns the edge weights ``w * g'(x_u - x_v)`` of the Laplacian of the
+    jacobian at `x`.
+    """
+    return np.asarray(weights) * law.derivative(-incidence.T.dot(x))
+
+
+def _potential_steps(x, incidence, weights, inputs, law, tol, max_iter, max_halvings, order):
+    """
+    Newton steps on the potentials with a backtracking line search.
+    Returns (x, F, converged, nfev, njev).
+    """
+    from ..laplacian import LaplacianSolver
+
+    nfev = njev = 0
+    F = residual(x, incidence, weights, inputs, law)
+    nfev += 1
+    norm = np.linalg.norm(F)
+    E = energy(x, incidence, weights, inputs, law)
+    for _ in range(max_iter + 1):
+        if F.size == 0 or np.abs(F).max() < tol:
+            return x, F, True, nfev, njev
+        gains = jacobian_weights(x, incidence, weights, law)
+        if np.any(gains[weights > 0] <= 0):
+            break
+        step = LaplacianSolver(laplacian(incidence, gains), order=order).solve(F)
+        njev += 1
+        slope = np.dot(F, step)
+        t = 1.
+        for _ in range(max_halvings + 1):
+            trial = x + t * step
+            trial_F = residual(trial, incidence, weights, inputs, law)
+            trial_E = energy(trial, incidence, weights, inputs, law)
+            nfev += 1
+            trial_norm = np.linalg.norm(trial_F)
+            # the Newton step is a descent direction of the energy, and of
+            # |F|; near the solution, only |F| is resolved in floating point
+            if trial_norm <= norm / 2:
+                break
+            if E is None:
+                if trial_norm <= (1 - 1e-4 * t) * norm:
+                    break
+            elif trial_E <= E - 1e-4 * t * slope:
+                break
+            t /= 2
+        else:
+            break
+        x, F, norm, E = trial, trial_F, trial_norm, trial_E
+    return x, F, False, nfev, njev
+
+
+def _flow_steps(x, incidence, weights, inputs, law, tol, max_iter, order):
+    """
+    Newton steps on the flows of a concave law. Returns (x, F, converged,
+    nfev, njev).
+    """
+    from ..laplacian import LaplacianSolver
+
+    nfev = njev = 0
+    positive = weights > 0
+    q = flows(x, incidence, weights, law)
+    for _ in range(max_iter + 1):
+        F = residual(x, incidence, weights, inputs, law)
+        nfev += 1
+        if F.size == 0 or np.abs(F).max() < tol:
+            return x, F, True, nfev, njev
+        # edges without weight carry no flow and are linearized at x
+        dx = -incidence.T.dot(x)
+        dx[positive] = law.inverse(q[positive] / weights[positive])
+        gains = weights * law.derivative(dx)
+        if np.any(gains[positive] <= 0) or not np.all(np.isfinite(gains)):
+            break
+        # the linearized flows q + gains (-B^T x - dx) balance the inputs
+        x = LaplacianSolver(laplacian(incidence, gains), order=order).solve(
+            inputs + incidence.dot(q - gains * dx))
+        njev += 1
+        q += gains * (-incidence.T.dot(x) - dx)
+    return x, F, False, nfev, njev
+
+
+def solve(incidence, weights, inputs, law, x0=None, tol=1e-10, max_iter=50,
+          max_halvings=30, stats=None, order=None):
+    """
+    Solves the steady state equations by Newton's method, on the flows for
+    concave laws and on the potentials otherwise.
+
+    Args:
+        incidence: the oriented incidence matrix
+        weights: the edge weights w
+        inputs: the inputs P, summing to zero on every component
+        law: a :class:`flownetpy.flowmodel.laws.FlowLaw`
+        x0: the initial potentials, by default the solution of the
+            linear law
+        tol: the largest residual |F_i| accepted
+        max_iter: maximal number of Newton steps
+        max_halvings: maximal number of times a step on the potentials
+            is halved by the line search
+        stats: a :class:`flownetpy.instrument.SolverStats` to update:
+            njev counts the factorized jacobians, nfev the residuals
+        order: the node order in which the jacobians are factorized, see
+            :class:`flownetpy.laplacian.LaplacianSolver`
+
+    Returns:
+        (x, converged): converged is False if the residual is still above
+        `tol` after `max_iter` steps, if the line search fails, or if the
+        law does not increase along an edge of positive weight
+    """
+    from ..laplacian import LaplacianSolver
+
+    weights = np.asarray(weights, dtype=float)
+    inputs = np.asarray(inputs, dtype=float)
+    if x0 is None:
+        x = LaplacianSolver(laplacian(incidence, weights), order=order).solve(inputs)
+    else:
+        x = np.array(x0, dtype=float)
+
+    if law.concave:
+        x, F, converged, nfev, njev = _flow_steps(x, incidence, weights, inputs, law,
+                                                  tol, max_iter, order)
+    else:
+        x, F, converged, nfev, njev = _potential_steps(x, incidence, weights, inputs, law,
+                                                       tol, max_iter, max_halvings, order)
+    if stats is not None:
+        stats.attempts += 1
+        stats.nfev += nfev
+        stats.njev += njev
+        stats.residual = float(np.abs(F).max()) if F.size else 0.
+    return x, converged
+
+
+def flows(x, incidence, weights, law, out=None):
+    """
+    Returns the flows ``w * g(x_head - x_tail)``.
+    """
+    flows = law.flow(-incidence.T.dot(x), out=out)
+    return np.multiply(flows, weights, out=flows)
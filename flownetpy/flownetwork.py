@@ -4,8 +4,44 @@ A module for flow network simulations
 
 from __future__ import division, print_function
 import networkx as nx
+import numpy as np
 from numbers import Number
 
+from .compiled import CompiledNetwork
+from .storage import save_network, load_network
+
+
+class _LazyGraphData(object):
+    """
+    Descriptor for the node and adjacency dictionaries of nx.Graph.
+
+    A network built from arrays does not fill them until they are first
+    accessed; the networkx view is then built from the compiled network.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            if obj._compiled is None:
+                raise AttributeError(self.name)
+            obj._materialize()
+            return obj.__dict__[self.name]
+
+    def __set__(self, obj, value):
+        # let networkx reset its cached views, if it has such a descriptor
+        parent = vars(nx.Graph).get(self.name)
+        if hasattr(parent, '__set__'):
+            parent.__set__(obj, value)
+        else:
+            obj.__dict__[self.name] = value
+
+
 class FlowNetwork(nx.Graph):
     """
     A class to describe a flow network. 
@@ -16,7 +52,14 @@ class FlowNetwork(nx.Graph):
 
     How the input flows distribute themselves into currents 
     is determined by a :class:`flowmodel`. 
+
+    Networks built with :meth:`from_arrays` or :meth:`from_scipy_sparse`
+    keep only their compiled form; the networkx graph is built the first
+    time it is used.
     """
+    _adj = _LazyGraphData('_adj')
+    _node = _LazyGraphData('_node')
+    _compiled = None
 
     def __init__(self, graph, inputs, weight=None):
         """
@@ -32,8 +75,8 @@ class FlowNetwork(nx.Graph):
         nx.Graph.__init__(self, graph)
         if isinstance(weight, Number):
             # assign uniform weight to all edges
-            for u,v in self.edges():
-                self[u][v]['weight'] = weight
+            for u, v, dat in self.edges(data=True):
+                dat['weight'] = weight
             self.weight_attr = 'weight'
         elif isinstance(weight, str):
             # assume graph aupplied already has specified weights
@@ -42,15 +85,137 @@ class FlowNetwork(nx.Graph):
         else:
             raise ValueError("We do not understand the meaning of weight %r"%weight)
 
+        node_attrs = dict(self.nodes(data=True))
         if isinstance(inputs, dict):
             # then inputs is a dictionary
             for node in inputs.keys():
-                self.node[node]['input'] = inputs[node]
+                node_attrs[node]['input'] = inputs[node]
         else:
             # Assume inputs is a list-like object with
             # the same order as graph.nodes()
             for node, inpt in zip(graph.nodes(), inputs):
-                self.node[node]['input'] = inpt
+                node_attrs[node]['input'] = inpt
+
+    @classmethod
+    def from_arrays(cls, edges, weights, inputs, nodes=None, weight_attr='weight'):
+        """
+        Builds a network directly from arrays, without a networkx graph.
+
+        Parameters
+        ----------
+        edges: integer array of shape (n_edges, 2).
+            Each row holds the indices of the two endpoints of an edge.
+        weights: number or array of size n_edges.
+        inputs: array of size n_nodes.
+        nodes: list of node labels, optional.
+            Defaults to range(n_nodes).
+        weight_attr: string.
+            Name of the weight attribute in the networkx view.
+        """
+        edges = np.asarray(edges, dtype=np.intp).reshape(-1, 2)
+        inputs = np.asarray(inputs, dtype=float)
+        n_nodes = inputs.size
+        if nodes is None:
+            nodes = range(n_nodes)
+        if edges.size and (edges.min() < 0 or edges.max() >= n_nodes):
+            raise ValueError("Edge endpoints must be node indices in [0, %d)" % n_nodes)
+
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), (edges.shape[0],))
+        compiled = CompiledNetwork(nodes, edges[:, 0], edges[:, 1], weights, inputs)
+        return cls._from_compiled(compiled, weight_attr)
+
+    @classmethod
+    def from_scipy_sparse(cls, adjacency, inputs, nodes=None, weight_attr='weight'):
+        """
+        Builds a network from a symmetric sparse weighted adjacency matrix,
+        without a networkx graph.
+
+        Parameters
+        ----------
+        adjacency: scipy.sparse matrix of shape (n_nodes, n_nodes).
+            Only the upper triangle is read, the diagonal is ignored.
+        inputs: array of size n_nodes.
+        nodes: list of node labels, optional.
+            Defaults to range(n_nodes).
+        """
+        import scipy.sparse as sp
+
+        upper = sp.triu(adjacency, k=1, format='coo')
+        edges = np.column_stack([upper.row, upper.col])
+        return cls.from_arrays(edges, upper.data, inputs, nodes=nodes,
+                               weight_attr=weight_attr)
+
+    @classmethod
+    def _from_compiled(cls, compiled, weight_attr='weight'):
+        """
+        Wraps a compiled network, leaving the networkx view unbuilt.
+        """
+        self = cls.__new__(cls)
+        nx.Graph.__init__(self)
+        del self.__dict__['_adj']
+        del self.__dict__['_node']
+        self.weight_attr = weight_attr
+        self._compiled = compiled
+        return self
+
+    def _materialize(self):
+        """
+        Builds the networkx view of a network built from arrays. From then
+        on, the graph is the authoritative form of the network.
+        """
+        compiled = self._compiled
+        self._compiled = None
+        self._node = self.node_dict_factory()
+        self._adj = self.adjlist_outer_dict_factory()
+
+        nodes = compiled.nodes
+        self.add_nodes_from((node, {'input': inpt})
+                            for node, inpt in zip(nodes, compiled.inputs.tolist()))
+        self.add_edges_from((nodes[u], nodes[v], {self.weight_attr: w})
+                            for u, v, w in zip(compiled.head.tolist(), compiled.tail.tolist(),
+                                               compiled.weights.tolist()))
+
+    def number_of_nodes(self):
+        if self._compiled is not None:
+            return self._compiled.n_nodes
+        return nx.Graph.number_of_nodes(self)
+
+    def number_of_edges(self, u=None, v=None):
+        if self._compiled is not None and u is None and v is None:
+            return self._compiled.n_edges
+        return nx.Graph.number_of_edges(self, u, v)
+
+    def compile(self):
+        """
+        Returns the network as a :class:`flownetpy.compiled.CompiledNetwork`.
+
+        For a network built from arrays whose networkx view has not been
+        used, this is the stored compiled network. Otherwise it is built
+        from the graph, as a snapshot: later changes to the graph are not
+        reflected in it.
+        """
+        if self._compiled is not None:
+            return self._compiled
+        return CompiledNetwork.from_graph(self, self.weight_attr)
+
+    def save(self, path, cycle_basis=False):
+        """
+        Saves the network to the directory `path`, see
+        :func:`flownetpy.storage.save_network`.
+        """
+        save_network(self, path, cycle_basis=cycle_basis)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads a network saved with :meth:`save`, memory-mapping its arrays.
+
+        Called on FlowNetwork, it returns an instance of the class the
+        network was saved from; called on a subclass, an instance of that
+        subclass.
+        """
+        return load_network(path, cls=None if cls is FlowNetwork else cls,
+                            mmap_mode=mmap_mode)
 
     def steady_flows(self, **kwargs):
         """
@@ -0,0 +1,190 @@
+"""
+Instrumentation of the steady state solvers.
+
+Every ``steady_flows`` call can describe itself with a
+:class:`SolverStats` object: the number of attempts, right hand side and
+jacobian evaluations, the time spent in each phase (``compile``,
+``integrate``, ``flows``, ``cycle_basis``, ...) and the residual of the
+returned solution. It is returned as ``data['stats']`` with
+``extra_output=True`` and passed to every registered :class:`Hook`.
+
+When no hook is registered and no extra output is requested, no stats
+are collected and the solvers do not read the clock at all.
+
+Example, exporting to a metrics system::
+
+    class Export(Hook):
+        def on_solve(self, stats):
+            metrics.record(stats.as_dict())
+
+    add_hook(Export())
+"""
+
+from __future__ import division
+
+import logging
+import time
+
+_HOOKS = []
+
+
+class Hook(object):
+    """
+    Base class of instrumentation hooks; override the methods you need.
+    """
+
+    def on_phase(self, stats, phase, seconds):
+        """
+        Called when a solver phase ends, with its duration in seconds.
+        """
+        pass
+
+    def on_solve(self, stats):
+        """
+        Called with the final stats when a solve ends.
+        """
+        pass
+
+
+class LoggingHook(Hook):
+    """
+    Logs the stats of every solve at the given level.
+    """
+
+    def __init__(self, logger='flownetpy', level=logging.INFO):
+        self.logger = logging.getLogger(logger) if isinstance(logger, str) else logger
+        self.level = level
+
+    def on_solve(self, stats):
+        self.logger.log(self.level, 'steady_flows %s', stats.as_dict())
+
+
+def add_hook(hook):
+    """
+    Registers a :class:`Hook` for all subsequent solves.
+    """
+    _HOOKS.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    """
+    Unregisters a hook added with :func:`add_hook`.
+    """
+    _HOOKS.remove(hook)
+
+
+class _Phase(object):
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        timings = self.stats.timings
+        timings[self.name] = timings.get(self.name, 0.) + seconds
+        for hook in self.stats.hooks:
+            hook.on_phase(self.stats, self.name, seconds)
+        return False
+
+
+class _NoPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class SolverStats(object):
+    """
+    Counters and phase timings of one steady state solve.
+
+    Attributes:
+        model: 'linear' or 'kuramoto'
+        n_nodes, n_edges: size of the network
+        attempts: number of initial conditions integrated
+        converged: whether a steady state was found
+        cached: whether the result came from a cache
+        nfev: right hand side evaluations
+        njev: jacobian evaluations
+        residual: max norm of the steady state equations at the result
+        timings: dictionary {phase: seconds}
+    """
+
+    def __init__(self, model, hooks=()):
+        self.model = model
+        self.hooks = list(hooks)
+        self.n_nodes = self.n_edges = None
+        self.attempts = 0
+        self.converged = False
+        self.cached = False
+        self.nfev = self.njev = 0
+        self.residual = None
+        self.timings = {}
+
+    def phase(self, name):
+        """
+        Returns a context manager that times the phase `name`.
+        """
+        return _Phase(self, name)
+
+    def finish(self):
+        """
+        Passes the stats to the hooks; called by the solver when done.
+        """
+        for hook in self.hooks:
+            hook.on_solve(self)
+        return self
+
+    def as_dict(self):
+        """
+        Returns the stats as a flat dictionary, with one 'time_<phase>'
+        entry per phase.
+        """
+        data = {
+            'model': self.model,
+            'n_nodes': self.n_nodes,
+            'n_edges': self.n_edges,
+            'attempts': self.attempts,
+            'converged': self.converged,
+            'cached': self.cached,
+            'nfev': self.nfev,
+            'njev': self.njev,
+            'residual': self.residual,
+            'time_total': sum(self.timings.values()),
+        }
+        for name, seconds in self.timings.items():
+            data['time_' + name] = seconds
+        return data
+
+    def __repr__(self):
+        return 'SolverStats(%r)' % self.as_dict()
+
+
+def start_stats(model, wanted=False):
+    """
+    Returns a new :class:`SolverStats`, or None if it is not `wanted` and
+    no hook is registered.
+    """
+    if wanted or _HOOKS:
+        return SolverStats(model, _HOOKS)
+    return None
+
+
+def phase(stats, name):
+    """
+    Returns ``stats.phase(name)``, or a no-op context manager if stats is None.
+    """
+    return _NO_PHASE if stats is None else _Phase(stats, name)
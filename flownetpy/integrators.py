@@ -0,0 +1,232 @@
+"""
+Integrator backends for the flow network dynamics.
+
+An integrator advances ``dx/dt = func(t, x, *args)`` from ``x0`` and returns
+the state either at every time in ``t`` or only at ``t[-1]``. Backends are
+chosen by name through :func:`get_integrator`:
+
+    ========  ==========================================  ===========
+    name      method                                      thread safe
+    ========  ==========================================  ===========
+    vode      legacy ``scipy.integrate.ode``, BDF          serialized
+    bdf       ``solve_ivp``, variable order BDF            yes
+    radau     ``solve_ivp``, implicit Runge-Kutta          yes
+    lsoda     ``solve_ivp``, automatic stiffness switch    serialized
+    rk45      ``solve_ivp``, explicit Runge-Kutta 4(5)     yes
+    rk23      ``solve_ivp``, explicit Runge-Kutta 2(3)     yes
+    dop853    ``solve_ivp``, explicit Runge-Kutta 8        yes
+    ========  ==========================================  ===========
+
+The Fortran solvers behind ``vode`` and ``lsoda`` are not re-entrant; calls
+to them are guarded by a module level lock, so they are safe but serialized
+when used from several threads. The pure Python backends hold no global
+state and run concurrently.
+"""
+
+from __future__ import division
+
+import threading
+
+import numpy as np
+
+DEFAULT_INTEGRATOR = 'vode'
+RTOL = 1e-6
+ATOL = 1e-9
+
+# Guards the non re-entrant ODEPACK solvers
+_ODEPACK_LOCK = threading.RLock()
+
+
+class Integrator(object):
+    """
+    Base class of the integrator backends.
+
+    An integrator object only holds its configuration and, for some
+    backends, a solver object that is reused between calls to
+    :meth:`integrate`. :meth:`reset` discards any such state.
+    """
+
+    #: Whether :meth:`integrate` may run concurrently from several threads
+    thread_safe = True
+    #: The jacobian the backend can use: None, 'dense' or 'sparse'
+    jacobian = None
+    #: Whether the backend copies the array returned by the right hand side,
+    #: so that the right hand side may return the same buffer on every call
+    copies_output = False
+
+    def __init__(self, rtol=RTOL, atol=ATOL, **options):
+        self.rtol = rtol
+        self.atol = atol
+        self.options = options
+
+    def integrate(self, func, x0, t, args=(), jac=None, final_only=False, dtype=np.float64):
+        """
+        Integrates ``func`` from ``x0`` over the time array ``t``.
+
+        Args:
+            func: right hand side, ``func(t, x, *args)``
+            x0: initial state
+            t: increasing array of output times, starting at the initial time
+            args: extra arguments passed to ``func`` and ``jac``
+            jac: optional jacobian, ``jac(t, x, *args)``
+            final_only: if True, only the state at ``t[-1]`` is returned
+            dtype: dtype of the returned states; the integration itself
+                runs in double precision
+
+        Returns:
+            An array of shape ``(t.size, x0.size)``, or the final state of
+            shape ``(x0.size,)`` if ``final_only`` is True. States the solver
+            failed to reach are filled with ``nan``.
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """
+        Discards any solver state kept from previous calls.
+        """
+        pass
+
+    def __repr__(self):
+        return '%s(rtol=%r, atol=%r)' % (type(self).__name__, self.rtol, self.atol)
+
+
+class VodeIntegrator(Integrator):
+    """
+    The legacy ``scipy.integrate.ode`` integrator with the ``vode`` backend.
+
+    The underlying ``ode`` object is created once and reused as long as the
+    same right hand side is integrated.
+    """
+    thread_safe = False
+    copies_output = True
+
+    def __init__(self, method='bdf', rtol=RTOL, atol=1e-12, **options):
+        Integrator.__init__(self, rtol=rtol, atol=atol, **options)
+        self.method = method
+        self._solver = None
+        self._solver_funcs = None
+
+    def _get_solver(self, func, jac):
+        from scipy.integrate import ode
+
+        if self._solver is None or self._solver_funcs != (func, jac):
+            options = dict(self.options)
+            if jac is not None:
+                options['with_jacobian'] = True
+            self._solver = ode(func, jac).set_integrator(
+                'vode', method=self.method, rtol=self.rtol, atol=self.atol,
+                **options)
+            self._solver_funcs = (func, jac)
+        return self._solver
+
+    def integrate(self, func, x0, t, args=(), jac=None, final_only=False, dtype=np.float64):
+        t = np.asarray(t, dtype=float)
+        x0 = np.asarray(x0, dtype=float)
+
+        with _ODEPACK_LOCK:
+            r = self._get_solver(func, jac)
+            r.set_initial_value(x0, t[0]).set_f_params(*args)
+            if jac is not None:
+                r.set_jac_params(*args)
+
+            # vode limits the number of steps per call, so the output
+            # times are still visited one by one when only the final
+            # state is kept
+            res = np.full((1 if final_only else t.size, x0.size), np.nan, dtype=dtype)
+            res[0, :] = x0
+            for idx, tnow in enumerate(t[1:]):
+                r.integrate(tnow)
+                if not r.successful():
+                    res[-1, :] = np.nan
+                    break
+                res[0 if final_only else idx+1, :] = r.y
+        return res[0] if final_only else res
+
+    def reset(self):
+        self._solver = None
+        self._solver_funcs = None
+
+
+class SolveIvpIntegrator(Integrator):
+    """
+    An integrator based on ``scipy.integrate.solve_ivp``.
+
+    The solver only stores the states at the requested output times; with
+    ``final_only`` it never builds the full trajectory.
+    """
+    _non_reentrant = ('LSODA',)
+
+    def __init__(self, method='BDF', rtol=RTOL, atol=ATOL, **options):
+        Integrator.__init__(self, rtol=rtol, atol=atol, **options)
+        self.method = method
+        self.thread_safe = method not in self._non_reentrant
+        self.jacobian = {'BDF': 'sparse', 'Radau': 'sparse', 'LSODA': 'dense'}.get(method)
+
+    def integrate(self, func, x0, t, args=(), jac=None, final_only=False, dtype=np.float64):
+        from scipy.integrate import solve_ivp
+
+        t = np.asarray(t, dtype=float)
+        x0 = np.asarray(x0, dtype=float)
+        t_eval = t[-1:] if final_only else t
+
+        kwargs = dict(self.options)
+        if jac is not None and self.method in ('BDF', 'Radau', 'LSODA'):
+            kwargs['jac'] = jac
+
+        if self.thread_safe:
+            sol = solve_ivp(func, (t[0], t[-1]), x0, method=self.method,
+                            t_eval=t_eval, args=tuple(args),
+                            rtol=self.rtol, atol=self.atol, **kwargs)
+        else:
+            with _ODEPACK_LOCK:
+                sol = solve_ivp(func, (t[0], t[-1]), x0, method=self.method,
+                                t_eval=t_eval, args=tuple(args),
+                                rtol=self.rtol, atol=self.atol, **kwargs)
+
+        res = np.full((t_eval.size, x0.size), np.nan, dtype=dtype)
+        res[:sol.y.shape[1], :] = sol.y.T
+        return res[-1] if final_only else res
+
+    def __repr__(self):
+        return '%s(method=%r, rtol=%r, atol=%r)' % (
+            type(self).__name__, self.method, self.rtol, self.atol)
+
+
+INTEGRATORS = {
+    'vode': (VodeIntegrator, {'method': 'bdf'}),
+    'bdf': (SolveIvpIntegrator, {'method': 'BDF'}),
+    'radau': (SolveIvpIntegrator, {'method': 'Radau'}),
+    'lsoda': (SolveIvpIntegrator, {'method': 'LSODA'}),
+    'rk45': (SolveIvpIntegrator, {'method': 'RK45'}),
+    'rk23': (SolveIvpIntegrator, {'method': 'RK23'}),
+    'dop853': (SolveIvpIntegrator, {'method': 'DOP853'}),
+}
+
+
+def get_integrator(integrator=None, **options):
+    """
+    Returns an :class:`Integrator`.
+
+    Args:
+        integrator: None (the default backend), a backend name from
+            :data:`INTEGRATORS` or an :class:`Integrator` instance, which
+            is returned unchanged.
+        options: passed to the constructor of the backend, e.g. rtol, atol
+
+    Returns:
+        An :class:`Integrator` object
+    """
+    if isinstance(integrator, Integrator):
+        return integrator
+    if integrator is None:
+        integrator = DEFAULT_INTEGRATOR
+
+    try:
+        cls, defaults = INTEGRATORS[integrator.lower()]
+    except (KeyError, AttributeError):
+        raise ValueError("Unknown integrator %r, choose one of %s" %
+                         (integrator, ', '.join(sorted(INTEGRATORS))))
+
+    kwargs = dict(defaults)
+    kwargs.update(options)
+    return cls(**kwargs)
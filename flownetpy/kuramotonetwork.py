@@ -1,134 +1,303 @@
 from  __future__ import division
 
 from .flownetwork import FlowNetwork
-from .tools import FlowDict
+from .flowmodel import kuramoto
+from .flowmodel.kuramoto import TMAX, TOL, NTRY
+from .instrument import start_stats, phase
 
 import numpy as np
 import networkx as nx
-from scipy.integrate import ode
-
-
-TMAX = 200
-TOL = 10e-6
-NTRY=10
+# every solve integrates with sparse matrices; importing scipy with the
+# module rather than on the first solve keeps that solve as fast as the
+# next ones. The package only imports this module with KuramotoNetwork.
+import scipy.integrate
+import scipy.sparse
+import scipy.sparse.linalg
 
 
 class KuramotoNetwork(FlowNetwork):
-    def steady_flows(self, initguess=None, extra_output=False):
+    def steady_flows(self, initguess=None, extra_output=False, integrator=None, cache=None,
+                     decomposition=None):
         """
         Computes the steady state flows. 
 
         Args:
             self: A selfwork object
-            initguess: Initial conditions
+            initguess: Initial conditions, or 'multilevel' to start from
+                phases computed on a hierarchy of coarsened networks, see
+                :mod:`flownetpy.multilevel`. This pays off on large networks.
+                On a ring, 'ring' returns the stable fixed point of the
+                smallest winding number without integrating, see
+                :meth:`ring_fixed_points`, and integrates from random
+                initial conditions if there is none.
             extra_output: boolean
+            integrator: name of an integrator backend or an
+                :class:`flownetpy.integrators.Integrator` object, which is
+                reused for all attempts. See :mod:`flownetpy.integrators`.
+            cache: a :class:`flownetpy.cache.SolutionCache`. A cached
+                solution for the same network, inputs and initguess is
+                returned without solving. Otherwise, unless initguess is
+                given, the cached solution with the closest inputs is
+                tried as the first initial condition.
+            decomposition: a :class:`flownetpy.decomposition.DomainDecomposition`
+                of the network. Unless initguess is given, the phases are
+                then found by its worker processes, and only integrated if
+                they are not a stable fixed point.
 
         Returns:
             A dictionary
                 d = {edge1 : flow1, edge2 : flow2,...}
             If extra_output=True, returns another dictionary
-                data = {initguess: the_initial_condition, 'thetas': steady_state_thetas, 'omega': winding_vector}
+                data = {initguess: the_initial_condition, 'thetas': steady_state_thetas, 'omega': winding_vector,
+                        'stats': a flownetpy.instrument.SolverStats}
         """
-
-        thetas, initguess = self._try_find_fps(NTRY, initguess=initguess)
+        stats = start_stats('kuramoto', wanted=extra_output)
+        with phase(stats, 'compile'):
+            compiled = self.compile()
+        if stats is not None:
+            stats.n_nodes, stats.n_edges = compiled.n_nodes, compiled.n_edges
+
+        warmstart = None
+        named = isinstance(initguess, str)
+        if named and initguess not in ('multilevel', 'ring'):
+            raise ValueError("Unknown initguess %r" % (initguess,))
+        if cache is not None:
+            with phase(stats, 'cache'):
+                key = cache.key(compiled, 'kuramoto', initguess)
+                entry = cache.get(key, compiled.inputs)
+                if entry is None and initguess is None:
+                    nearest = cache.nearest(key, compiled.inputs)
+                    if nearest is not None:
+                        warmstart = nearest['thetas']
+            if entry is not None:
+                flows = compiled.flow_dict(entry['flows'])
+                if stats is not None:
+                    stats.cached = stats.converged = True
+                    stats.finish()
+                if extra_output:
+                    return flows, {'initguess': entry.get('initguess'), 'thetas': entry['thetas'],
+                                   'omega': list(entry['winding']), 'stats': stats}
+                return flows
+
+        stable = False
+        if named and initguess == 'ring':
+            from .periodic import ring_fixed_points
+
+            with phase(stats, 'ring'):
+                fixed_points = ring_fixed_points(compiled, lattice=compiled.lattice())
+            initguess = None
+            if fixed_points:
+                warmstart = fixed_points[min(fixed_points, key=abs)]
+                stable = True
+        elif decomposition is not None and initguess is None:
+            decomposition.check(compiled)
+            with phase(stats, 'decomposition'):
+                warmstart, stable = decomposition.kuramoto_phases(compiled.inputs,
+                                                                   initguess=warmstart)
+        elif named:
+            from .multilevel import multilevel_solve
+
+            with phase(stats, 'multilevel'):
+                warmstart, stable = multilevel_solve(compiled, integrator=integrator)
+            initguess = None
+
+        if stable:
+            # a stable fixed point already, the integration would stay there
+            thetas, initguess = warmstart, warmstart
+        else:
+            thetas, initguess = self._try_find_fps(NTRY, initguess=initguess,
+                                                   integrator=integrator,
+                                                   warmstart=warmstart, compiled=compiled,
+                                                   stats=stats)
 
         if thetas is None:
+            if stats is not None:
+                stats.finish()
             if extra_output:
-                return None, {'initguess': initguess}
+                return None, {'initguess': initguess, 'stats': stats}
             else:
                 return None
 
-        node_indices = {node: idx for idx, node in enumerate(self.nodes())}
-        flows = FlowDict({(u, v): np.sin(thetas[node_indices[u]] - thetas[node_indices[v]])*
-            dat.get(self.weight_attr, 1) for (u, v, dat) in self.edges(data=True)})
+        with phase(stats, 'flows'):
+            flow_array = compiled.weights * np.sin(thetas[compiled.head] - thetas[compiled.tail])
+            flows = compiled.flow_dict(flow_array)
+
+        if extra_output or cache is not None:
+            with phase(stats, 'cycle_basis'):
+                if self._compiled is None:
+                    cycles = [[compiled.node_index[node] for node in cycle]
+                              for cycle in nx.cycle_basis(self)]
+                else:
+                    cycles = compiled.cycle_basis()
+            with phase(stats, 'winding'):
+                omega = _winding_numbers(cycles, thetas)
+            if cache is not None:
+                with phase(stats, 'cache'):
+                    cache.put(key, compiled.inputs, flows=flow_array, thetas=thetas,
+                              winding=omega, initguess=initguess)
+
+        if stats is not None:
+            stats.converged = True
+            stats.residual = float(np.abs(KuramotoRHS(compiled)(0, thetas)).max())
+            stats.finish()
 
         if extra_output:
-            omega = _omega(self, nx.cycle_basis(self), thetas)
-            return flows, {'initguess': initguess, 'thetas': thetas, 'omega': omega}
+            return flows, {'initguess': initguess, 'thetas': thetas, 'omega': omega,
+                           'stats': stats}
         else:
             return flows
 
-    def _try_find_fps(self, ntry, tmax=TMAX, tol=TOL, initguess=None):
+    def ring_fixed_points(self, windings=None):
+        """
+        Returns the stable fixed points of a ring network for every winding
+        number, without integrating, see
+        :func:`flownetpy.periodic.ring_fixed_points`.
+
+        Args:
+            windings: the winding numbers of the wanted fixed points, by
+                default all of those with a stable fixed point
+
+        Returns:
+            A dictionary {winding_number: thetas}, with thetas in the order
+            of ``compile().nodes`` and the winding numbers along
+            ``compile().lattice().sites``
+
+        Raises:
+            ValueError: if the network is not a ring, or if its inputs do
+                not sum to zero
+        """
+        from .periodic import ring_fixed_points
+
+        compiled = self.compile()
+        return ring_fixed_points(compiled, windings, lattice=compiled.lattice())
+
+    def sensitivities(self, thetas=None, **kwargs):
         """
-        Tries to find a fixed point of the Kuramoto network. 
+        Returns the derivatives of the steady state flows with respect to
+        the inputs and the weights, as a
+        :class:`flownetpy.sensitivity.Sensitivities`.
+
+        Args:
+            thetas: the phases of the steady state. If None, it is found
+                with :meth:`steady_flows`, to which kwargs are passed.
+
+        Returns:
+            The sensitivities, or None if no steady state is found
+        """
+        from .sensitivity import Sensitivities
+
+        if thetas is None:
+            flows, data = self.steady_flows(extra_output=True, **kwargs)
+            if flows is None:
+                return None
+            thetas = data['thetas']
+        return Sensitivities(self.compile(), thetas, 'kuramoto')
+
+    def _try_find_fps(self, ntry, tmax=TMAX, tol=TOL, initguess=None, integrator=None,
+                      warmstart=None, compiled=None, stats=None):
+        """
+        Tries to find a fixed point of the Kuramoto network, see
+        :func:`flownetpy.flowmodel.kuramoto.find_fixed_point`.
 
         Args:
             ntry    : number of initial conditions that will be tried to reach a fixed point
-            self : a selfwork  object
             tmax    : integration time
             tol     : the odesolver ends when the variance of thetas  are less than tol
             initguess : initial condition. If specified, ntry doesn't have any effect
+            integrator : integrator backend, see :func:`flownetpy.integrators.get_integrator`
+            warmstart : initial condition tried before the `ntry` random ones
+            compiled : the compiled network, if already at hand
+            stats : a :class:`flownetpy.instrument.SolverStats` to update
 
         Returns:
             (fixed point, initguess)
 
         Note:
             If no fixed point is found, returns (None, initguess)
-        """
-
-        dt = tmax / 1000
 
-        if initguess is not None: # then use the specified initguess    
-            sol = self._evolve(np.arange(0, tmax, dt), initguess = initguess)
-            if _has_converged(sol):
-                return sol[-1], initguess
-            else:
-                return None, initguess
-
-        for ntry in range(ntry): # otherwise try `ntry` random initguesses
-            initguess = _random_stableop_initguess(self.number_of_nodes())
-            sol = self._evolve(np.arange(0, tmax, dt), initguess)
-            if _has_converged(sol):
-                return sol[-1], initguess
-
-        return None, initguess
-
-
-    def _evolve(self, tarr, initguess=None):
+        The integration runs on the network in its locality ordering, see
+        :meth:`flownetpy.compiled.CompiledNetwork.local`.
+        """
+        with phase(stats, 'compile'):
+            if compiled is None:
+                compiled = self.compile()
+            ordering = compiled.ordering()
+            local = compiled.local()
+            incidence = local.incidence()
+        if ordering is not None:
+            if initguess is not None:
+                initguess = ordering.to_local(initguess)
+            if warmstart is not None:
+                warmstart = ordering.to_local(warmstart)
+        thetas, initguess = kuramoto.find_fixed_point(
+            incidence, local.weights, local.inputs, ntry=ntry, tmax=tmax, initguess=initguess,
+            integrator=integrator, warmstart=warmstart, endpoints=(local.head, local.tail),
+            stats=stats)
+        if ordering is not None:
+            if thetas is not None:
+                thetas = ordering.from_local(thetas)
+            if initguess is not None:
+                initguess = ordering.from_local(initguess)
+        return thetas, initguess
+
+    def _evolve(self, tarr, initguess=None, integrator=None, final_only=False):
         """
         Evolves the flow network from `initguess` by timesteps in `tarr`
+
+        If `final_only` is True, only the state at tarr[-1] is returned.
         """
-        M = nx.incidence_matrix(self, oriented=True).toarray()
-        Mw = nx.incidence_matrix(self, oriented=True, weight=self.weight_attr).toarray()
-        P = np.array([self.node[n]['input'] for n in self.nodes()])
+        compiled = self.compile()
+        ordering = compiled.ordering()
+        local = compiled.local()
+        if ordering is not None and initguess is not None:
+            initguess = ordering.to_local(initguess)
+        sol = kuramoto.evolve(local.incidence(), local.weights, local.inputs, tarr,
+                              initguess=initguess, integrator=integrator,
+                              final_only=final_only, endpoints=(local.head, local.tail))
+        if ordering is not None:
+            sol = ordering.from_local(sol, axis=-1)
+        return sol
+
+
+class KuramotoRHS(kuramoto.KuramotoRHS):
+    """
+    :class:`flownetpy.flowmodel.kuramoto.KuramotoRHS` of a compiled network.
 
-        if initguess is None:
-            initguess = _random_stableop_initguess(self.number_of_nodes())
+    Args:
+        compiled: a :class:`flownetpy.compiled.CompiledNetwork`
+        inputs: the inputs P, defaults to compiled.inputs. Either of shape
+            (n_nodes,) or (n_nodes, k) for a batch with different inputs.
+        reuse_output: see the base class
+        dtype: see the base class
+    """
 
-        return odeint(_kuramoto_ode, initguess, t=tarr, args=(M, Mw, P))
+    def __init__(self, compiled, inputs=None, reuse_output=False, dtype=np.float64):
+        inputs = compiled.inputs if inputs is None else inputs
+        super(KuramotoRHS, self).__init__(compiled.incidence(), compiled.weights, inputs,
+                                          reuse_output=reuse_output, dtype=dtype,
+                                          endpoints=(compiled.head, compiled.tail))
+        self._incidence_w = compiled.incidence(weighted=True).astype(self.dtype, copy=False)
 
 
-def _has_converged(time_series, window_size=0):
+class KuramotoJacobian(kuramoto.KuramotoJacobian):
     """
-    Detects if the time series has converged, by
-    checking the values during the window given by 'window_size'
+    :class:`flownetpy.flowmodel.kuramoto.KuramotoJacobian` of a compiled network.
     """
 
-    if window_size == 0:  # The window over which time series must be constant
-        window_size = time_series.shape[0]//10 
-
-    return np.allclose(np.var(time_series[-window_size:, :], axis=0), 0)
+    def __init__(self, compiled, dense=False, reuse_output=False):
+        super(KuramotoJacobian, self).__init__(compiled.incidence(), compiled.weights,
+                                               dense=dense, reuse_output=reuse_output,
+                                               endpoints=(compiled.head, compiled.tail))
 
 
-def odeint(func, x0, t=None, args=None, jac = None):
+def _kuramoto_system(compiled, integrator):
     """
-    Integrate an ode for time array t
+    Returns the (rhs, jacobian) pair for integrating the Kuramoto dynamics
+    of `compiled` with `integrator`; the jacobian is None if the integrator
+    does not use one.
     """
-    if jac:
-        r = ode(func, func).set_integrator('vode', method='bdf')
-        r.set_initial_value(x0, t[0]).set_f_params(*args)
-        r.set_jac_params(*args)
-    else:
-        r = ode(func).set_integrator('vode', method='bdf')
-        r.set_initial_value(x0, t[0]).set_f_params(*args)
-
-    res = np.zeros((t.size, x0.size))
-    res[0,:] = x0
-
-    for idx, tnow in enumerate(t[1:]):
-        r.integrate(tnow)
-        res[idx+1, :] = r.y
-    return res
+    return kuramoto.system(compiled.incidence(), compiled.weights, compiled.inputs,
+                           integrator, endpoints=(compiled.head, compiled.tail))
 
 
 def _kuramoto_ode(t, th, M_I, M_I_w, P):
@@ -150,48 +319,13 @@ def _omega(graph, cycles, thetas):
     Calculates the winding number:
         (\sum_{i,j \in cycle} asin(\theta_j-\theta_i))/2\pi
     """
-    omegas = []
     node2idx = {node:idx for idx, node in enumerate(graph.nodes())}
-    for cycle in cycles:
-        omega = 0
-        angles_cycle = np.array([thetas[node2idx[node]]\
-                       for node in cycle])
-        phasediffs_cycle = _mod_pi(angles_cycle - np.roll(angles_cycle, 1))
-
+    return _winding_numbers([[node2idx[node] for node in cycle] for cycle in cycles],
+                            thetas)
 
-        omega = np.sum(phasediffs_cycle) / np.pi / 2
-        omegas.append(omega)
-    return omegas
 
-
-def _random_stableop_initguess(size):
-    """
-    Args:
-        size: int
-
-    Returns:
-        An array res of random numbers s.t. 
-        |res[i]-res[i+1 % size]| < \pi/2
-    """
-    low = -np.pi / 2
-    high = np.pi / 2
-
-    initguess = np.cumsum(np.random.uniform(low=low, high=high, size=size - 1))
-    initguess = np.insert(initguess, 0, 0)
-
-    if np.abs(_mod_pi(initguess[-1])) > np.pi/2:
-        return _random_stableop_initguess(size)
-    else:
-        return initguess
-
-
-def _mod_pi(angle):
-    """
-    given an angle, returns an equivalent angle
-    within the interval [-pi,pi]
-
-    Warning:
-        Result is not well defined for angle = pi*(2k+1)
-    """
-    rem = np.remainder(angle, 2 * np.pi)
-    return np.where(rem<=np.pi, rem, rem-2*np.pi)
+odeint = kuramoto.odeint
+_has_converged = kuramoto.has_converged
+_winding_numbers = kuramoto.winding_numbers
+_random_stableop_initguess = kuramoto.random_stable_initguess
+_mod_pi = kuramoto.mod_pi
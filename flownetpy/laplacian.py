@@ -0,0 +1,123 @@
+"""
+Sparse solves with graph Laplacians.
+"""
+
+from __future__ import division
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import splu
+
+
+class LaplacianSolver(object):
+    """
+    Applies the pseudoinverse of a graph Laplacian through a sparse LU
+    factorization.
+
+    One node of every connected component is grounded, the remaining
+    (nonsingular) system is factorized once, and :meth:`solve` then
+    returns the same result as ``np.dot(np.linalg.pinv(L), b)``: the part
+    of b that does not sum to zero on a component is dropped and the
+    solution has zero mean on every component.
+
+    With ``dtype=np.float32`` the factors are stored and applied in single
+    precision, which halves their memory and the bandwidth of every solve,
+    and the result is brought to double precision accuracy by iterative
+    refinement: the residual is computed in double precision with the
+    Laplacian itself and corrected with further single precision solves.
+
+    With an `order`, the Laplacian is permuted before factorizing, which
+    keeps neighbours close in memory and helps the fill reducing ordering
+    of the factorization; :meth:`solve` permutes back, and the labels are
+    in the order of the Laplacian given.
+
+    Args:
+        laplacian: a symmetric (n x n) scipy.sparse Laplacian
+        dtype: np.float64 or np.float32, the precision of the factors
+        order: a permutation of the nodes, see
+            :func:`flownetpy.ordering.locality_order`
+
+    Attributes:
+        refinements: number of refinement steps of the last solve
+    """
+
+    def __init__(self, laplacian, dtype=np.float64, order=None):
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float64, np.float32):
+            raise ValueError("Unsupported dtype %r" % (dtype,))
+        self.refinements = 0
+        laplacian = sp.csc_matrix(laplacian, dtype=float)
+        self.n = laplacian.shape[0]
+        self.order = None if order is None else np.asarray(order, dtype=np.intp)
+        if self.order is not None:
+            laplacian = laplacian[self.order, :][:, self.order]
+        self.n_components, self._labels = connected_components(laplacian, directed=False)
+        self._component_sizes = np.bincount(self._labels, minlength=self.n_components)
+        self.labels = self._labels
+        if self.order is not None:
+            self.labels = np.empty_like(self._labels)
+            self.labels[self.order] = self._labels
+
+        # ground the first node of every component
+        grounded = np.zeros(self.n, dtype=bool)
+        grounded[np.unique(self._labels, return_index=True)[1]] = True
+        self.free = np.flatnonzero(~grounded)
+
+        self._lu = self._reduced = None
+        if self.free.size:
+            reduced = laplacian[self.free, :][:, self.free]
+            # the grounded Laplacian is symmetric with a dominant diagonal:
+            # pivoting on the diagonal keeps the fill of the ordering
+            self._lu = splu(sp.csc_matrix(reduced, dtype=self.dtype),
+                            permc_spec='MMD_AT_PLUS_A', options=dict(SymmetricMode=True))
+            if self.dtype != np.float64:
+                self._reduced = sp.csr_matrix(reduced)
+
+    def _component_means(self, x, labels=None):
+        labels = self.labels if labels is None else labels
+        sums = np.zeros((self.n_components,) + x.shape[1:])
+        np.add.at(sums, labels, x)
+        return sums / self._component_sizes.reshape((-1,) + (1,) * (x.ndim - 1))
+
+    def solve(self, b, tol=1e-12, max_refinements=20):
+        """
+        Returns L^+ b for b of shape (n,) or (n, k).
+
+        In single precision, the solution is refined until the max norm of
+        the residual of every column is below `tol` times the max norm of
+        the column of b, or for at most `max_refinements` steps.
+        """
+        b = np.asarray(b, dtype=float)
+        labels = self._labels
+        if self.order is not None:
+            b = b[self.order]
+        b = b - self._component_means(b, labels)[labels]
+        x = np.zeros(b.shape)
+        if self._lu is not None:
+            x[self.free] = self._refine(np.ascontiguousarray(b[self.free]), tol,
+                                        max_refinements)
+        x -= self._component_means(x, labels)[labels]
+        if self.order is not None:
+            out = np.empty(x.shape)
+            out[self.order] = x
+            return out
+        return x
+
+    def _refine(self, b, tol, max_refinements):
+        dtype = self.dtype
+        x = self._lu.solve(b.astype(dtype)).astype(float)
+        self.refinements = 0
+        if dtype == np.float64:
+            return x
+        bound = tol * np.abs(b).max(axis=0)
+        for self.refinements in range(1, max_refinements + 1):
+            r = b - self._reduced.dot(x)
+            # residuals are scaled to avoid underflow in single precision
+            scale = np.abs(r).max(axis=0)
+            if np.all(scale <= bound):
+                self.refinements -= 1
+                break
+            scale[scale == 0] = 1
+            x += self._lu.solve((r / scale).astype(dtype)).astype(float) * scale
+        return x
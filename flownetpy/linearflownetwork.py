@@ -1,10 +1,11 @@
 from  __future__ import division
 
 from .flownetwork import FlowNetwork
-from .tools import FlowDict
+from .flowmodel import linear
+from .instrument import start_stats, phase
 
 import numpy as np
-import networkx as nx
+
 
 TMAX = 200
 TOL = 10e-6
@@ -12,17 +13,128 @@ NTRY=10
 
 class LinearFlowNetwork(FlowNetwork):
     # The linear Poiseullie flow in a network
-    def steady_flows(self):
+    def steady_flows(self, cache=None, extra_output=False, sparsifier=None, decomposition=None):
         """
         The fixed points are given by:
             \sum_j (p_j-p_i)
+
+        Args:
+            cache: a :class:`flownetpy.cache.SolutionCache`, optional. A
+                cached solution for the same network and inputs is
+                returned without solving.
+            extra_output: boolean
+            sparsifier: a :class:`flownetpy.sparsify.Sparsifier` of the
+                network. The pressures are then solved on the sparsifier,
+                which is approximate and bypasses the cache.
+            decomposition: a :class:`flownetpy.decomposition.DomainDecomposition`
+                of the network, which then solves for the pressures in its
+                worker processes instead of a single factorization.
+
+        Returns:
+            A dictionary
+                d = {edge1 : flow1, edge2 : flow2,...}
+            If extra_output=True, returns another dictionary
+                data = {'pressures': node_pressures, 'stats': a flownetpy.instrument.SolverStats}
+            With a sparsifier, data also holds 'error_bound', a dictionary
+            of bounds on the errors of the flows.
+        """
+        return self._steady_flows(None, cache, extra_output, sparsifier, decomposition)
+
+    def _steady_flows(self, compiled, cache=None, extra_output=False, sparsifier=None,
+                      decomposition=None):
         """
-        L = nx.laplacian_matrix(self).toarray()
-        I = np.array([self.node[n]['input'] for n in self.nodes()])
-
-#        pressures = np.insert(np.linalg.solve(L[1:, 1:], I[1:]), 0, 0)
-        pressures = np.dot(np.linalg.pinv(L), I)
-        node_indices = {node: idx for idx, node in enumerate(self.nodes())}
-        flows = FlowDict({(u, v): (pressures[node_indices[u]] - pressures[node_indices[v]]) * dat.get(
-            self.weight_attr, 1) for (u, v, dat) in self.edges(data=True)})
-        return flows
+        :meth:`steady_flows` of the compiled network `compiled`, compiled
+        here if None.
+        """
+        stats = start_stats('linear', wanted=extra_output)
+        with phase(stats, 'compile'):
+            if compiled is None:
+                compiled = self.compile()
+        if stats is not None:
+            stats.n_nodes, stats.n_edges = compiled.n_nodes, compiled.n_edges
+
+        if sparsifier is not None:
+            return self._sparsified_flows(compiled, sparsifier, stats, extra_output)
+
+        pressures = None
+        if cache is not None:
+            with phase(stats, 'cache'):
+                key = cache.key(compiled, 'linear')
+                entry = cache.get(key, compiled.inputs)
+            if entry is not None:
+                flows, pressures = entry['flows'], entry['thetas']
+                if stats is not None:
+                    stats.cached = True
+
+        if decomposition is not None:
+            decomposition.check(compiled)
+            solver = decomposition
+        if pressures is None:
+            with phase(stats, 'factorize'):
+                if decomposition is None:
+                    solver = compiled.laplacian_solver()
+            incidence = compiled.incidence()
+            with phase(stats, 'solve'):
+                pressures = linear.pressures(incidence, compiled.weights, compiled.inputs,
+                                             solver=solver)
+            with phase(stats, 'flows'):
+                flows = linear.flows(incidence, compiled.weights, pressures)
+            if cache is not None:
+                with phase(stats, 'cache'):
+                    cache.put(key, compiled.inputs, flows=flows, thetas=pressures)
+            if stats is not None:
+                stats.attempts = 1
+
+        flowdict = compiled.flow_dict(flows)
+        if stats is not None:
+            stats.converged = True
+            if not stats.cached:
+                # the solver balances the inputs within every component
+                residual = compiled.laplacian().dot(pressures) - compiled.inputs
+                residual -= solver._component_means(residual)[solver.labels]
+                stats.residual = float(np.abs(residual).max())
+            stats.finish()
+
+        if extra_output:
+            return flowdict, {'pressures': pressures, 'stats': stats}
+        return flowdict
+
+    def _sparsified_flows(self, compiled, sparsifier, stats, extra_output):
+        if (sparsifier.original.n_nodes != compiled.n_nodes
+                or not np.array_equal(sparsifier.original.head, compiled.head)
+                or not np.array_equal(sparsifier.original.tail, compiled.tail)):
+            raise ValueError("The sparsifier was built for another network")
+        with phase(stats, 'factorize'):
+            sparsifier.solver()
+        with phase(stats, 'solve'):
+            pressures, info = sparsifier.pressures(compiled.inputs)
+        with phase(stats, 'flows'):
+            flows = linear.flows(compiled.incidence(), compiled.weights, pressures)
+        flowdict = compiled.flow_dict(flows)
+        if stats is not None:
+            stats.attempts = 1
+            stats.converged = True
+            stats.finish()
+        if extra_output:
+            bound = np.sqrt(compiled.weights) * info['energy_bound']
+            return flowdict, {'pressures': pressures, 'stats': stats,
+                              'error_bound': compiled.flow_dict(bound)}
+        return flowdict
+
+    def sensitivities(self, cache=None):
+        """
+        Returns the derivatives of the steady state flows with respect to
+        the inputs and the weights, as a
+        :class:`flownetpy.sensitivity.Sensitivities`. They reuse the
+        factorization of the Laplacian that solved the steady state.
+
+        Args:
+            cache: passed to :meth:`steady_flows`
+        """
+        from .sensitivity import Sensitivities
+
+        # compiled once, so that the steady state and the sensitivities
+        # share its factorization
+        compiled = self.compile()
+        flows, data = self._steady_flows(compiled, cache=cache, extra_output=True)
+        return Sensitivities(compiled, data['pressures'], 'linear')
@@ -0,0 +1,131 @@
+"""
+Multilevel initial conditions for the Kuramoto model on large networks.
+
+The network is coarsened into a hierarchy by heavy edge matching: every
+node is merged with at most one neighbour, preferring the heaviest edges,
+the inputs of merged nodes are summed and the weights of parallel edges
+between aggregates are added. The coarsest network is solved first; its
+phases are then copied to the aggregated nodes of the next finer level
+and refined there by Newton steps, whose linear systems are Laplacians
+weighted by ``K cos(theta_u - theta_v)``, down to the original network.
+
+Every level starts close to its fixed point, so a few Newton steps
+suffice and the cost grows with the size of the network about as fast
+as a sparse factorization. ``KuramotoNetwork.steady_flows(initguess=
+'multilevel')`` returns the result directly when it is a stable fixed
+point, and otherwise uses it as the initial condition of the integration.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+from .compiled import CompiledNetwork
+from .flowmodel.laws import Sine
+from .flowmodel.newton import solve as newton_solve
+from .kuramotonetwork import KuramotoNetwork, NTRY, TOL
+
+#: coarsening stops at this number of nodes
+COARSEST = 64
+
+
+def coarsen(compiled):
+    """
+    Merges the nodes of `compiled` pairwise along a heavy edge matching.
+
+    Returns:
+        (coarse, aggregates): the coarse compiled network, whose nodes are
+        numbered from 0, and the array mapping every node index of
+        `compiled` to its coarse node
+    """
+    n = compiled.n_nodes
+    match = np.full(n, -1, dtype=np.intp)
+    order = np.argsort(-compiled.weights, kind='stable')
+    for u, v in zip(compiled.head[order].tolist(), compiled.tail[order].tolist()):
+        if u != v and match[u] < 0 and match[v] < 0:
+            match[u] = v
+            match[v] = u
+
+    nodes = np.arange(n)
+    representative = np.where(match < 0, nodes, np.minimum(nodes, match))
+    _, aggregates = np.unique(representative, return_inverse=True)
+    n_coarse = aggregates.max() + 1 if n else 0
+
+    head, tail = aggregates[compiled.head], aggregates[compiled.tail]
+    between = head != tail
+    low = np.minimum(head, tail)[between]
+    high = np.maximum(head, tail)[between]
+    pairs, index = np.unique(low * n_coarse + high, return_inverse=True)
+    weights = np.bincount(index, weights=compiled.weights[between], minlength=pairs.size)
+    inputs = np.bincount(aggregates, weights=compiled.inputs, minlength=n_coarse)
+    coarse = CompiledNetwork(range(n_coarse), pairs // n_coarse, pairs % n_coarse,
+                             weights, inputs)
+    return coarse, aggregates
+
+
+def hierarchy(compiled, coarsest=COARSEST, min_reduction=0.9):
+    """
+    Returns the list of (network, aggregates) from `compiled` down to a
+    network of at most `coarsest` nodes; the aggregates of the coarsest
+    network are None. Coarsening also stops when a level keeps more than
+    `min_reduction` of the nodes of the previous one.
+    """
+    levels = []
+    while compiled.n_nodes > coarsest:
+        coarse, aggregates = coarsen(compiled)
+        if coarse.n_nodes > min_reduction * compiled.n_nodes:
+            break
+        levels.append((compiled, aggregates))
+        compiled = coarse
+    levels.append((compiled, None))
+    return levels
+
+
+def newton(compiled, thetas, tol=TOL, max_iter=10):
+    """
+    Refines phases toward a fixed point of the Kuramoto dynamics with
+    damped Newton steps, see :func:`flownetpy.flowmodel.newton.solve`.
+
+    Stops early if an edge leaves the stable region |theta_u - theta_v|
+    < pi/2, where the Laplacian of the linearized dynamics is no longer
+    positive semidefinite; the integration then takes over.
+
+    Returns:
+        (thetas, stable): stable is True if the right hand side is below
+        `tol` and all edges are in the stable region, so that thetas is a
+        stable fixed point
+    """
+    ordering = compiled.ordering()
+    x, converged = newton_solve(compiled.incidence(), compiled.weights, compiled.inputs,
+                                Sine(), x0=thetas, tol=tol, max_iter=max_iter, max_halvings=8,
+                                order=None if ordering is None else ordering.nodes)
+    gains = np.cos(x[compiled.head] - x[compiled.tail])
+    return x, bool(converged and np.all(gains[compiled.weights > 0] > 0))
+
+
+def multilevel_solve(compiled, integrator=None, coarsest=COARSEST, tol=1e-9):
+    """
+    Computes phases of `compiled` close to a fixed point of the Kuramoto
+    dynamics on a hierarchy of coarsened networks.
+
+    The coarsest network is solved by Newton steps from its linear
+    response, or by integration if they fail. If it has no fixed point,
+    its linear response is refined instead.
+
+    Returns:
+        (thetas, stable): stable is True if thetas is a stable fixed point
+        of `compiled`, see :func:`newton`; otherwise thetas is meant as an
+        initial condition for the integration
+    """
+    levels = hierarchy(compiled, coarsest)
+    coarse = levels[-1][0]
+    linear = coarse.laplacian_solver().solve(coarse.inputs)
+    thetas, stable = newton(coarse, linear, tol=tol)
+    if not stable:
+        thetas = KuramotoNetwork._from_compiled(coarse)._try_find_fps(
+            NTRY, integrator=integrator, warmstart=linear, compiled=coarse)[0]
+        if thetas is None:
+            thetas = linear
+    for fine, aggregates in reversed(levels[:-1]):
+        thetas, stable = newton(fine, thetas[aggregates], tol=tol)
+    return thetas, stable
@@ -0,0 +1,110 @@
+from  __future__ import division
+
+from .flownetwork import FlowNetwork
+from .flowmodel import newton
+from .flowmodel.laws import FlowLaw, Linear
+from .instrument import start_stats, phase
+
+import numpy as np
+
+
+class NonlinearFlowNetwork(FlowNetwork):
+    """
+    A flow network whose edge flows follow a pluggable law: the flow along
+    (u, v) is ``w * law.flow(x_u - x_v)``, see :mod:`flownetpy.flowmodel.laws`.
+    Steady states are found by the Newton solver of
+    :mod:`flownetpy.flowmodel.newton`.
+
+    As in the linear model, the inputs of every connected component are
+    balanced first, by spreading an excess evenly over its nodes.
+
+    The law defaults to the class attribute `law`; set the attribute of a
+    network built with :meth:`from_arrays` to change it.
+    """
+    law = Linear()
+
+    def __init__(self, graph, inputs, weight=None, law=None):
+        FlowNetwork.__init__(self, graph, inputs, weight)
+        if law is not None:
+            self.law = law
+
+    def steady_flows(self, initguess=None, extra_output=False, cache=None, tol=1e-10,
+                     max_iter=50):
+        """
+        Computes the steady state flows.
+
+        Args:
+            initguess: initial potentials, in the order of
+                ``compile().nodes``. Defaults to the solution of the linear
+                law, or to the cached solution with the closest inputs.
+            extra_output: boolean
+            cache: a :class:`flownetpy.cache.SolutionCache`. A cached
+                solution for the same network, law and inputs is returned
+                without solving; otherwise, unless initguess is given, the
+                cached solution with the closest inputs is the initial guess.
+            tol, max_iter: see :func:`flownetpy.flowmodel.newton.solve`
+
+        Returns:
+            A dictionary
+                d = {edge1 : flow1, edge2 : flow2,...}
+            or None if Newton's method did not converge.
+            If extra_output=True, returns another dictionary
+                data = {'potentials': node_potentials, 'stats': a flownetpy.instrument.SolverStats}
+        """
+        if not isinstance(self.law, FlowLaw):
+            raise ValueError("Unknown flow law %r" % (self.law,))
+        stats = start_stats('nonlinear', wanted=extra_output)
+        with phase(stats, 'compile'):
+            compiled = self.compile()
+            incidence = compiled.incidence()
+        if stats is not None:
+            stats.n_nodes, stats.n_edges = compiled.n_nodes, compiled.n_edges
+
+        inputs = compiled.inputs
+        with phase(stats, 'factorize'):
+            solver = compiled.laplacian_solver()
+        inputs = inputs - solver._component_means(inputs)[solver.labels]
+
+        x = None
+        if cache is not None:
+            with phase(stats, 'cache'):
+                key = cache.key(compiled, 'nonlinear %r' % (self.law,))
+                entry = cache.get(key, compiled.inputs)
+                if entry is not None:
+                    x, flows = entry['thetas'], entry['flows']
+                    if stats is not None:
+                        stats.cached = True
+                elif initguess is None:
+                    nearest = cache.nearest(key, compiled.inputs)
+                    if nearest is not None:
+                        initguess = nearest['thetas']
+
+        if x is None:
+            if initguess is None:
+                with phase(stats, 'solve'):
+                    initguess = solver.solve(inputs)
+            with phase(stats, 'newton'):
+                ordering = compiled.ordering()
+                x, converged = newton.solve(incidence, compiled.weights, inputs, self.law,
+                                            x0=initguess, tol=tol, max_iter=max_iter,
+                                            stats=stats,
+                                            order=None if ordering is None else ordering.nodes)
+            if not converged:
+                if stats is not None:
+                    stats.finish()
+                if extra_output:
+                    return None, {'potentials': x, 'stats': stats}
+                return None
+            with phase(stats, 'flows'):
+                flows = newton.flows(x, incidence, compiled.weights, self.law)
+            if cache is not None:
+                with phase(stats, 'cache'):
+                    cache.put(key, compiled.inputs, flows=flows, thetas=x)
+
+        flowdict = compiled.flow_dict(flows)
+        if stats is not None:
+            stats.converged = True
+            stats.finish()
+        if extra_output:
+            return flowdict, {'potentials': x, 'stats': stats}
+        return flowdict
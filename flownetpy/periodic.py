@@ -0,0 +1,337 @@
+"""
+Fast transform solvers for rings, paths and lattices.
+
+The Laplacian of a lattice whose edges have the same weight along every
+dimension is a sum of Kronecker products of one dimensional Laplacians,
+which the discrete Fourier transform diagonalizes along periodic
+dimensions and the discrete cosine transform (DCT-II) along open ones.
+Its pseudoinverse is then applied in O(n log n) with
+:mod:`scipy.fft`, without any factorization; rings are periodic
+lattices of dimension one and paths open ones.
+
+:func:`detect` recognizes
+
+- rings and paths, whatever their node labels, and
+- lattices whose nodes are labelled by their integer coordinates, as in
+  ``nx.grid_2d_graph`` and ``nx.grid_graph``, periodic or not along
+  every dimension.
+
+:meth:`flownetpy.compiled.CompiledNetwork.laplacian_solver` returns a
+:class:`LatticeSolver` for these networks when their weights are uniform
+along every dimension and they have at least `MIN_NODES` nodes, so that
+the linear model and everything else solving with the Laplacian use it
+without further ado.
+
+On a ring, the stable fixed points of the Kuramoto model have a closed
+form up to the loop flow, which is set by the winding number:
+:func:`ring_fixed_points` lists all of them, for any weights.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+#: smaller lattices are factorized, which costs next to nothing
+MIN_NODES = 64
+
+
+class Lattice(object):
+    """
+    The lattice structure of a compiled network.
+
+    Attributes:
+        sites: int array of the shape of the lattice, with the node index of
+            every site
+        periodic: tuple of booleans, whether every dimension wraps around
+        weights: tuple of the weight of the edges along every dimension,
+            or None if they are not uniform
+        ring_edges: for rings, the index of the edge from ``sites[i]`` to
+            ``sites[i + 1]``, cyclically; None otherwise
+    """
+
+    def __init__(self, sites, periodic, weights, ring_edges=None):
+        self.sites = sites
+        self.periodic = tuple(periodic)
+        self.weights = weights
+        self.ring_edges = ring_edges
+
+    @property
+    def shape(self):
+        return self.sites.shape
+
+    @property
+    def is_ring(self):
+        return self.ring_edges is not None
+
+    def __repr__(self):
+        return 'Lattice(shape=%r, periodic=%r, weights=%r)' % (self.shape, self.periodic,
+                                                               self.weights)
+
+
+def detect(compiled):
+    """
+    Returns the :class:`Lattice` of `compiled`, or None if it is not a
+    ring, a path or a lattice labelled by coordinates.
+    """
+    if compiled.n_nodes < 2:
+        return None
+    lattice = _detect_chain(compiled)
+    if lattice is None or lattice.weights is None:
+        # a 2 x 2 grid is also a ring, whose weights need not be uniform
+        grid = _detect_grid(compiled)
+        if grid is not None:
+            lattice = grid
+    return lattice
+
+
+def _uniform(weights):
+    if weights.size and np.all(weights == weights[0]) and weights[0] > 0:
+        return float(weights[0])
+    return None
+
+
+def _detect_chain(compiled):
+    n, head, tail = compiled.n_nodes, compiled.head, compiled.tail
+    ring = compiled.n_edges == n
+    if not ring and compiled.n_edges != n - 1:
+        return None
+    degrees = np.bincount(head, minlength=n) + np.bincount(tail, minlength=n)
+    if ring:
+        if n < 3 or np.any(degrees != 2):
+            return None
+        start = 0
+    else:
+        ends = np.flatnonzero(degrees == 1)
+        if ends.size != 2 or np.any(degrees > 2):
+            return None
+        start = ends[0]
+
+    # the edges of every node, at most two; a path end has -1 as second
+    ends = np.concatenate([head, tail])
+    by_node = np.argsort(ends, kind='stable') % compiled.n_edges
+    offsets = np.concatenate([[0], np.cumsum(degrees)])
+    first = by_node[offsets[:-1]].tolist()
+    second = np.where(degrees == 2, by_node[np.minimum(offsets[:-1] + 1, by_node.size - 1)],
+                      -1).tolist()
+    heads, tails = head.tolist(), tail.tolist()
+    order, edges = [], []
+    previous, node = -1, int(start)
+    for _ in range(compiled.n_edges):
+        order.append(node)
+        edge = first[node] if first[node] != previous else second[node]
+        edges.append(edge)
+        previous = edge
+        node = tails[edge] if heads[edge] == node else heads[edge]
+    if not ring:
+        order.append(node)
+    elif node != start:
+        return None
+    # a chain is connected if the walk visits every node
+    order = np.array(order, dtype=np.intp)
+    if np.unique(order).size != n:
+        return None
+    edges = np.array(edges, dtype=np.intp)
+    weights = _uniform(compiled.weights)
+    return Lattice(order, (ring,), None if weights is None else (weights,),
+                   edges if ring else None)
+
+
+def _detect_grid(compiled):
+    nodes = compiled.nodes
+    first = nodes[0]
+    if not isinstance(first, tuple) or len(first) < 2:
+        return None
+    try:
+        coords = np.array(nodes)
+    except ValueError:
+        return None
+    if coords.dtype.kind not in 'iu' or coords.shape != (len(nodes), len(first)):
+        return None
+
+    coords = coords - coords.min(axis=0)
+    shape = tuple((coords.max(axis=0) + 1).tolist())
+    n = compiled.n_nodes
+    if np.prod(shape) != n:
+        return None
+    sites = np.full(shape, -1, dtype=np.intp)
+    sites[tuple(coords.T)] = np.arange(n)
+    if np.any(sites < 0):
+        return None
+
+    # every edge joins neighbours along one dimension, possibly wrapping
+    diff = np.abs(coords[compiled.tail] - coords[compiled.head])
+    moves = diff > 0
+    if np.any(moves.sum(axis=1) != 1):
+        return None
+    axis = np.argmax(moves, axis=1)
+    step = diff[np.arange(axis.size), axis]
+    size = np.array(shape)[axis]
+    wraps = (step == size - 1) & (size >= 3)
+    if np.any((step != 1) & ~wraps):
+        return None
+    low = np.minimum(compiled.head, compiled.tail)
+    high = np.maximum(compiled.head, compiled.tail)
+    if np.unique(low * n + high).size != compiled.n_edges:
+        return None
+
+    periodic, weights = [], []
+    for k, length in enumerate(shape):
+        along = axis == k
+        lines = n // length
+        if np.count_nonzero(along & ~wraps) != lines * (length - 1):
+            return None
+        n_wraps = np.count_nonzero(along & wraps)
+        if n_wraps not in (0, lines):
+            return None
+        periodic.append(bool(n_wraps))
+        weights.append(_uniform(compiled.weights[along]) if np.any(along) else 1.)
+    if any(weight is None for weight in weights):
+        weights = None
+    return Lattice(sites, periodic, None if weights is None else tuple(weights))
+
+
+class LatticeSolver(object):
+    """
+    Applies the pseudoinverse of the Laplacian of a lattice with uniform
+    weights along every dimension by fast transforms, with the interface
+    of :class:`flownetpy.laplacian.LaplacianSolver`.
+
+    The transforms are computed in double precision and are exact up to
+    rounding, so that there is nothing to refine.
+
+    Args:
+        lattice: a :class:`Lattice` with weights
+    """
+
+    def __init__(self, lattice):
+        if lattice.weights is None:
+            raise ValueError("Fast transforms need uniform weights along every dimension")
+        self.lattice = lattice
+        self.dtype = np.dtype(np.float64)
+        self.refinements = 0
+        self.n = lattice.sites.size
+        self.n_components = 1
+        self.labels = np.zeros(self.n, dtype=np.intp)
+        self._component_sizes = np.array([self.n])
+        self._open = [k for k, periodic in enumerate(lattice.periodic) if not periodic]
+        self._periodic = [k for k, periodic in enumerate(lattice.periodic) if periodic]
+
+        # the eigenvalues, in the layout of the transformed arrays: the
+        # real transform halves the last periodic dimension
+        shape = lattice.shape
+        eigenvalues = np.zeros(())
+        for k, (length, weight) in enumerate(zip(shape, lattice.weights)):
+            if lattice.periodic[k]:
+                count = length // 2 + 1 if k == self._periodic[-1] else length
+                angles = 2 * np.pi * np.arange(count) / length
+            else:
+                angles = np.pi * np.arange(length) / length
+            mu = weight * (2 - 2 * np.cos(angles))
+            eigenvalues = np.add.outer(eigenvalues, mu)
+        eigenvalues.flat[0] = np.inf
+        self._inverse = 1 / eigenvalues
+
+    def _component_means(self, x):
+        return x.mean(axis=0)[np.newaxis]
+
+    def solve(self, b, tol=None, max_refinements=None):
+        """
+        Returns L^+ b for b of shape (n,) or (n, k); the tolerances of
+        :meth:`flownetpy.laplacian.LaplacianSolver.solve` are ignored.
+        """
+        import scipy.fft
+
+        b = np.asarray(b, dtype=float)
+        extra = b.shape[1:]
+        x = b[self.lattice.sites]
+        for k in self._open:
+            x = scipy.fft.dct(x, type=2, axis=k, norm='ortho')
+        shape = self.lattice.shape
+        inverse = self._inverse.reshape(self._inverse.shape + (1,) * len(extra))
+        if self._periodic:
+            x = scipy.fft.rfftn(x, axes=self._periodic)
+            x *= inverse
+            x = scipy.fft.irfftn(x, s=[shape[k] for k in self._periodic],
+                                 axes=self._periodic)
+        else:
+            x *= inverse
+        for k in self._open:
+            x = scipy.fft.idct(x, type=2, axis=k, norm='ortho')
+        out = np.empty(b.shape)
+        out[self.lattice.sites.ravel()] = x.reshape((-1,) + extra)
+        return out
+
+
+def ring_fixed_points(compiled, windings=None, lattice=None):
+    """
+    Returns the fixed points of the Kuramoto model on a ring whose phase
+    differences all lie within (-pi/2, pi/2), which are stable; there is
+    at most one per winding number.
+
+    Along the ring, the flow out of the i-th node toward the next one is
+    ``c + S_i``, with S the cumulated inputs and c the loop flow, and the
+    phase differences are ``arcsin((c + S_i) / K_i)``. They add up to
+    ``-2 pi m`` for the winding number m, which fixes c, found by
+    bisection since the sum increases with c.
+
+    Args:
+        compiled: the compiled ring, with inputs summing to zero
+        windings: the winding numbers of the fixed points, by default all
+            winding numbers with a stable fixed point
+        lattice: the :class:`Lattice` of compiled, detected if not given
+
+    Returns:
+        A dictionary {m: thetas}, with m the winding number along
+        ``lattice.sites``, as computed by
+        :func:`flownetpy.flowmodel.kuramoto.winding_numbers`, and thetas
+        in the order of the nodes of compiled, with zero mean
+
+    Raises:
+        ValueError: if compiled is not a ring, or if the inputs do not sum
+            to zero
+    """
+    if lattice is None:
+        lattice = detect(compiled)
+    if lattice is None or not lattice.is_ring:
+        raise ValueError("Not a ring network")
+    order = lattice.sites
+    inputs = compiled.inputs[order]
+    scale = np.abs(inputs).sum()
+    if abs(inputs.sum()) > 1e-12 * max(scale, 1.):
+        raise ValueError("The inputs of a ring must sum to zero, got %r" % inputs.sum())
+    weights = compiled.weights[lattice.ring_edges]
+    cumulated = np.cumsum(inputs)
+    if np.any(weights <= 0):
+        return {}
+
+    # all phase differences are defined for c in [low, high]
+    low = np.max(-weights - cumulated)
+    high = np.min(weights - cumulated)
+    if low >= high:
+        return {}
+
+    def total(c):
+        return np.sum(np.arcsin(np.clip((c + cumulated) / weights, -1, 1)))
+
+    bounds = -total(high) / (2 * np.pi), -total(low) / (2 * np.pi)
+    feasible = range(int(np.floor(bounds[0])) + 1, int(np.ceil(bounds[1])))
+    if windings is None:
+        windings = feasible
+    fixed_points = {}
+    for m in windings:
+        if m not in feasible:
+            continue
+        a, b = low, high
+        for _ in range(200):
+            c = (a + b) / 2
+            if c in (a, b):
+                break
+            if total(c) < -2 * np.pi * m:
+                a = c
+            else:
+                b = c
+        differences = np.arcsin(np.clip((c + cumulated) / weights, -1, 1))
+        thetas = np.empty(compiled.n_nodes)
+        thetas[order] = -np.concatenate([[0.], np.cumsum(differences[:-1])])
+        fixed_points[m] = thetas - thetas.mean()
+    return fixed_points
@@ -0,0 +1,191 @@
+"""
+Redispatch: the smallest change of the inputs that brings all flows within
+the edge capacities.
+
+:func:`redispatch` solves
+
+    min |dP|**2   subject to   |flows(P + dP)_e| <= capacity_e for all e
+
+by sequential quadratic programming. Every iteration linearizes the flows
+around the current steady state with :class:`flownetpy.sensitivity.Sensitivities`,
+solves the quadratic program restricted to the lines close to their
+limits with Hildreth's dual coordinate ascent, and solves for the new
+steady state starting from the previous one. The linear model needs a
+single iteration unless further lines overload; the Kuramoto model
+converges in a few.
+
+Only the rows of the PTDF matrix of monitored lines are computed, with one
+solve per line, and the factorization of the linear model is reused
+throughout.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+from .sensitivity import Sensitivities
+
+
+def _hildreth(G, b, lam=None, tol=1e-10, max_sweeps=10000):
+    """
+    Solves min |x|**2 / 2 subject to G x <= b by Hildreth's algorithm,
+    coordinate ascent on the dual.
+
+    Args:
+        G: array of shape (m, n)
+        b: array of shape (m,)
+        lam: initial multipliers, for a warm start
+
+    Returns:
+        (x, lam, converged)
+    """
+    m = b.size
+    lam = np.zeros(m) if lam is None else np.array(lam, dtype=float)
+    P = G.dot(G.T)
+    diag = np.diag(P).copy()
+    # rows of G that vanish cannot be influenced, leave them out
+    rows = np.flatnonzero(diag > 1e-14 * max(diag.max(initial=0), 1))
+    lam[np.setdiff1d(np.arange(m), rows)] = 0
+    Plam = P.dot(lam)
+
+    converged = False
+    for _ in range(max_sweeps):
+        largest = 0.
+        for i in rows.tolist():
+            new = max(0., lam[i] - (Plam[i] + b[i]) / diag[i])
+            step = new - lam[i]
+            if step != 0:
+                lam[i] = new
+                Plam += step * P[:, i]
+                largest = max(largest, abs(step) * diag[i])
+        if largest < tol:
+            converged = True
+            break
+    return -G.T.dot(lam), lam, converged
+
+
+def _balance_projector(labels, controllable):
+    """
+    Returns a function projecting rows of shape (m, n) onto the vectors
+    that vanish outside `controllable` and sum to zero on every component
+    """
+    counts = np.bincount(labels[controllable], minlength=labels.max() + 1)
+
+    def project(rows):
+        rows = np.where(controllable, rows, 0.)
+        sums = np.zeros((rows.shape[0], counts.size))
+        np.add.at(sums.T, labels[controllable], rows[:, controllable].T)
+        means = sums / np.maximum(counts, 1)
+        rows[:, controllable] -= means[:, labels[controllable]]
+        return rows
+    return project
+
+
+def redispatch(network, capacities, nodes=None, margin=0., tol=1e-6, screen=0.1,
+               max_iter=20, integrator=None):
+    """
+    Finds the smallest change of the inputs, in euclidean norm, that keeps
+    the magnitude of every flow within its capacity.
+
+    Args:
+        network: a LinearFlowNetwork or KuramotoNetwork
+        capacities: a number, an array in the order of
+            ``network.compile().edges()`` or a dictionary {(u, v): capacity}
+        nodes: labels of the nodes whose input may change, defaults to
+            all. The changes sum to zero on every connected component.
+        margin: the flows are brought to at most (1 - margin) * capacity
+        tol: flows may exceed their capacity by this much
+        screen: lines loaded above (1 - screen) * capacity are monitored
+        max_iter: maximal number of linearizations
+        integrator: integrator backend of the Kuramoto steady states
+
+    Returns:
+        (changes, data) with changes a dictionary {node: change of input}
+        and data = {'flows': new steady flows, 'inputs': new input array,
+        'feasible': bool, 'iterations': int, 'solves': number of linear
+        or ODE solves}, or None if the network has no steady state to
+        begin with. If the limits cannot be met, or the Kuramoto network
+        loses its steady state, the last iterate with a steady state
+        is returned with feasible=False.
+    """
+    from .kuramotonetwork import KuramotoNetwork
+
+    compiled = network.compile()
+    model = 'kuramoto' if isinstance(network, KuramotoNetwork) else 'linear'
+    capacities = compiled.edge_values(capacities, 'capacity')
+    limits = (1 - margin) * capacities
+
+    if model == 'linear':
+        solver = compiled.laplacian_solver()
+
+        def steady_state(inputs, state):
+            return solver.solve(inputs)
+    else:
+        cls = type(network)
+
+        def steady_state(inputs, state):
+            shifted = compiled.with_inputs(inputs)
+            return cls._from_compiled(shifted)._try_find_fps(
+                1, initguess=state, integrator=integrator, compiled=shifted)[0]
+
+    flows, data = network.steady_flows(extra_output=True, **(
+        {'integrator': integrator} if model == 'kuramoto' else {}))
+    if flows is None:
+        return None
+    state = data['thetas'] if model == 'kuramoto' else data['pressures']
+    solves = 1
+
+    sens = Sensitivities(compiled, state, model)
+    controllable = np.ones(compiled.n_nodes, dtype=bool)
+    if nodes is not None:
+        controllable[:] = False
+        controllable[[compiled.node_index[node] for node in nodes]] = True
+    project = _balance_projector(sens.solver.labels, controllable)
+
+    change = np.zeros(compiled.n_nodes)
+    monitored = np.zeros(compiled.n_edges, dtype=bool)
+    multipliers = {}
+    feasible = False
+    iterations = 0
+    while True:
+        flow_array = compiled.weights * sens.values
+        load = np.abs(flow_array)
+        if np.all(load <= limits + tol):
+            feasible = True
+            break
+        if iterations == max_iter:
+            break
+        iterations += 1
+
+        monitored |= load > (1 - screen) * limits
+        lines = np.flatnonzero(monitored)
+        # PTDF rows of the monitored lines, one solve per line
+        unit = np.zeros((compiled.n_edges, lines.size))
+        unit[lines, np.arange(lines.size)] = 1
+        rows = sens.vjp(unit)[0].T
+        signs = np.sign(flow_array[lines])
+        signs[signs == 0] = 1
+        G = project(signs[:, np.newaxis] * rows)
+        # s (f + G (x - change)) <= limit, for the total change x
+        b = limits[lines] - load[lines] + G.dot(change)
+
+        lam = np.array([multipliers.get(line, 0.) for line in lines.tolist()])
+        new_change, lam, converged = _hildreth(G, b, lam=lam)
+        if not converged:
+            # the multipliers diverge when the limits cannot be met
+            break
+        multipliers = dict(zip(lines.tolist(), lam.tolist()))
+
+        new_state = steady_state(compiled.inputs + new_change, state)
+        solves += 1 + lines.size
+        if new_state is None:
+            # the Kuramoto network lost its steady state
+            break
+        change, state = new_change, new_state
+        sens = Sensitivities(compiled, state, model)
+
+    new_inputs = compiled.inputs + change
+    flows = compiled.flow_dict(flow_array)
+    changes = dict(zip(compiled.nodes, change.tolist()))
+    return changes, {'flows': flows, 'inputs': new_inputs, 'feasible': feasible,
+                     'iterations': iterations, 'solves': solves}
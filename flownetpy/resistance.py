@@ -0,0 +1,204 @@
+"""
+Effective resistances and power transfer distribution factors (PTDFs).
+
+Both are entries of the pseudoinverse L^+ of the weighted Laplacian, with
+the weights read as conductances: the effective resistance between u and
+v is ``(e_u - e_v)^T L^+ (e_u - e_v)`` and the PTDF of edge (h, t) for an
+input at node j, balanced evenly by the other nodes of its component, is
+``w_ht (L^+_hj - L^+_tj)``. L^+ is never formed: exact values cost one
+solve with the cached factorization of the network
+(:meth:`flownetpy.compiled.CompiledNetwork.laplacian_solver`) per pair or
+per monitored edge, and :class:`ResistanceSketch` approximates all
+resistances at once from O(log n / epsilon**2) solves with random
+projections (Spielman and Srivastava, 2008).
+
+All functions take a :class:`flownetpy.FlowNetwork` or a compiled network
+and node labels.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+
+def _compiled(network):
+    return network.compile() if hasattr(network, 'compile') else network
+
+
+def _pair_indices(compiled, pairs):
+    index = compiled.node_index
+    pairs = list(pairs)
+    u = np.array([index[a] for a, _ in pairs], dtype=np.intp)
+    v = np.array([index[b] for _, b in pairs], dtype=np.intp)
+    return u, v
+
+
+def _resistances(compiled, u, v, block):
+    solver = compiled.laplacian_solver()
+    out = np.empty(u.size)
+    for start in range(0, u.size, block):
+        stop = min(start + block, u.size)
+        cols = np.arange(stop - start)
+        rhs = np.zeros((compiled.n_nodes, stop - start))
+        rhs[u[start:stop], cols] += 1
+        rhs[v[start:stop], cols] -= 1
+        x = solver.solve(rhs)
+        out[start:stop] = x[u[start:stop], cols] - x[v[start:stop], cols]
+    out[solver.labels[u] != solver.labels[v]] = np.inf
+    return out
+
+
+def effective_resistance(network, pairs, block=256):
+    """
+    Returns the exact effective resistances between pairs of nodes.
+
+    Args:
+        network: a FlowNetwork or CompiledNetwork
+        pairs: iterable of (u, v) node labels
+        block: number of pairs solved at once
+
+    Returns:
+        array with one resistance per pair, inf for nodes in different
+        components
+    """
+    compiled = _compiled(network)
+    u, v = _pair_indices(compiled, pairs)
+    return _resistances(compiled, u, v, block)
+
+
+def edge_resistances(network, edges=None, block=256):
+    """
+    Returns the exact effective resistances between the ends of edges.
+
+    Args:
+        edges: iterable of (u, v) node labels, defaults to all edges in
+            the order of ``compiled.edges()``
+    """
+    compiled = _compiled(network)
+    if edges is None:
+        return _resistances(compiled, compiled.head, compiled.tail, block)
+    return effective_resistance(compiled, edges, block)
+
+
+def _edge_indices(compiled, edges):
+    """
+    Returns the indices of edges given by node labels, and +1 or -1 for
+    edges given in the same or the opposite orientation as in `compiled`.
+    """
+    lookup = {}
+    for idx, (u, v) in enumerate(compiled.edges()):
+        lookup[(u, v)] = (idx, 1.)
+        lookup.setdefault((v, u), (idx, -1.))
+    try:
+        found = [lookup[tuple(edge)] for edge in edges]
+    except KeyError as e:
+        raise ValueError("%r is not an edge of the network" % (e.args[0],))
+    if not found:
+        return np.empty(0, dtype=np.intp), np.empty(0)
+    idx, sign = zip(*found)
+    return np.array(idx, dtype=np.intp), np.array(sign)
+
+
+def ptdf(network, edges=None, nodes=None, block=256):
+    """
+    Returns the PTDFs of monitored edges: entry (i, j) is the change of
+    the flow along ``edges[i]`` per unit of input at ``nodes[j]``.
+
+    It costs one solve per monitored edge, whatever the number of nodes.
+
+    Args:
+        edges: iterable of (u, v) node labels, defaults to all edges in
+            the order of ``compiled.edges()``. The flow is counted from u
+            to v.
+        nodes: iterable of node labels, defaults to all nodes
+    """
+    compiled = _compiled(network)
+    if edges is None:
+        idx, sign = np.arange(compiled.n_edges), np.ones(compiled.n_edges)
+    else:
+        idx, sign = _edge_indices(compiled, edges)
+    head, tail = compiled.head[idx], compiled.tail[idx]
+    weights = sign * compiled.weights[idx]
+    if nodes is None:
+        cols = np.arange(compiled.n_nodes)
+    else:
+        cols = np.array([compiled.node_index[node] for node in nodes], dtype=np.intp)
+
+    solver = compiled.laplacian_solver()
+    out = np.empty((idx.size, cols.size))
+    for start in range(0, idx.size, block):
+        stop = min(start + block, idx.size)
+        rows = np.arange(stop - start)
+        rhs = np.zeros((compiled.n_nodes, stop - start))
+        rhs[head[start:stop], rows] += 1
+        rhs[tail[start:stop], rows] -= 1
+        out[start:stop] = weights[start:stop, np.newaxis] * solver.solve(rhs)[cols].T
+    return out
+
+
+def sketch_size(n_nodes, epsilon):
+    """
+    Returns the number of random projections that preserve all effective
+    resistances of a network with `n_nodes` nodes within a factor
+    (1 +- epsilon) with high probability, by the Johnson-Lindenstrauss
+    lemma in the form of Dasgupta and Gupta.
+    """
+    if not 0 < epsilon < 1:
+        raise ValueError("epsilon must be in (0, 1), got %r" % epsilon)
+    return int(np.ceil(4 * np.log(max(n_nodes, 2)) / (epsilon**2 / 2 - epsilon**3 / 3)))
+
+
+class ResistanceSketch(object):
+    """
+    Approximate effective resistances between all pairs of nodes.
+
+    With Q a random (k x n_edges) sign matrix scaled by 1/sqrt(k), the
+    columns of ``Z = Q W^(1/2) B^T L^+`` are an embedding of the nodes
+    where ``|Z_u - Z_v|**2`` approximates the resistance between u and v.
+    Z costs k solves and takes 8 * k * n_nodes bytes.
+
+    Args:
+        network: a FlowNetwork or CompiledNetwork with nonnegative weights
+        epsilon: relative error bound, used to choose k
+        k: number of projections, overrides epsilon
+        seed: seed of the random projections
+        block: number of projections solved at once
+    """
+
+    def __init__(self, network, epsilon=0.5, k=None, seed=None, block=64):
+        compiled = _compiled(network)
+        if np.any(compiled.weights < 0):
+            raise ValueError("Effective resistances need nonnegative weights")
+        if k is None:
+            k = sketch_size(compiled.n_nodes, epsilon)
+        self.compiled = compiled
+        self.k = k
+
+        rng = np.random.RandomState(seed)
+        solver = compiled.laplacian_solver()
+        incidence = compiled.incidence()
+        root_weights = np.sqrt(compiled.weights / k)[:, np.newaxis]
+        self.embedding = np.empty((compiled.n_nodes, k))
+        for start in range(0, k, block):
+            stop = min(start + block, k)
+            signs = 2. * rng.randint(0, 2, size=(compiled.n_edges, stop - start)) - 1
+            self.embedding[:, start:stop] = solver.solve(incidence.dot(root_weights * signs))
+        self._labels = solver.labels
+
+    def _resistances(self, u, v):
+        out = np.sum((self.embedding[u] - self.embedding[v])**2, axis=1)
+        out[self._labels[u] != self._labels[v]] = np.inf
+        return out
+
+    def resistances(self, pairs):
+        """
+        Returns the approximate resistances between pairs of node labels.
+        """
+        return self._resistances(*_pair_indices(self.compiled, pairs))
+
+    def edge_resistances(self):
+        """
+        Returns the approximate resistances of all edges, in the order of
+        ``compiled.edges()``.
+        """
+        return self._resistances(self.compiled.head, self.compiled.tail)
@@ -0,0 +1,189 @@
+"""
+Sensitivities of the steady state flows by implicit differentiation.
+
+In both models the flow along edge e = (h, t) is ``w_e g(x_h - x_t)``,
+with g the identity for the linear model (x are the pressures) and the
+sine for the Kuramoto model (x are the phases), and a steady state
+balances the flows with the inputs at every node. Differentiating this
+balance around a steady state gives
+
+    L_K dx = dP - S (g * dw),    dflows = g * dw + K (dx_h - dx_t)
+
+where K = w g'(x_h - x_t), L_K is the Laplacian weighted by K and S maps
+edge values to their net outflow at every node. All derivatives thus
+cost solves with a single Laplacian: the weighted Laplacian itself for
+the linear model, whose cached factorization is reused, and the cosine
+weighted one for the Kuramoto model.
+
+An input perturbation that does not sum to zero on a connected component
+is balanced by spreading its excess evenly over the component, as in
+``steady_flows``.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+#: g and g' of every model
+MODELS = {
+    'linear': (lambda x: x, np.ones_like),
+    'kuramoto': (np.sin, np.cos),
+}
+
+
+class Sensitivities(object):
+    """
+    Derivatives of the steady state flows with respect to the inputs and
+    the edge weights.
+
+    Nodes and edges are in the order of ``compiled.nodes`` and
+    ``compiled.edges()``, also available as :attr:`nodes` and :attr:`edges`.
+
+    Args:
+        compiled: a :class:`flownetpy.compiled.CompiledNetwork`
+        state: the pressures or phases of the steady state, by node index
+        model: 'linear' or 'kuramoto'
+    """
+
+    def __init__(self, compiled, state, model='linear'):
+        try:
+            g, dg = MODELS[model]
+        except KeyError:
+            raise ValueError("Unknown model %r, choose one of %s" %
+                             (model, ', '.join(sorted(MODELS))))
+        self.compiled = compiled
+        self.model = model
+        self.state = np.asarray(state, dtype=float)
+        diff = self._diff(self.state)
+        #: g(x_h - x_t), the derivative of the flows with respect to the weights
+        self.values = g(diff)
+        #: w g'(x_h - x_t), the weights of the linearized network
+        self.gains = compiled.weights * dg(diff)
+        self._solver = None
+
+    @property
+    def nodes(self):
+        return self.compiled.nodes
+
+    @property
+    def edges(self):
+        return self.compiled.edges()
+
+    @property
+    def solver(self):
+        """
+        The :class:`flownetpy.laplacian.LaplacianSolver` of the linearized network
+        """
+        if self._solver is None:
+            if self.model == 'linear':
+                self._solver = self.compiled.laplacian_solver()
+            else:
+                from .laplacian import LaplacianSolver
+                ordering = self.compiled.ordering()
+                self._solver = LaplacianSolver(self.compiled.laplacian(weights=self.gains),
+                                               order=None if ordering is None else ordering.nodes)
+        return self._solver
+
+    def _diff(self, x):
+        return x[self.compiled.head] - x[self.compiled.tail]
+
+    def _outflow(self, y):
+        return -self.compiled.incidence().dot(y)
+
+    def _gain(self, y):
+        return self.gains.reshape((-1,) + (1,) * (y.ndim - 1)) * y
+
+    def _value(self, y):
+        return self.values.reshape((-1,) + (1,) * (y.ndim - 1)) * y
+
+    def jvp(self, inputs=None, weights=None):
+        """
+        Returns the change of the flows caused by small changes of the
+        inputs and/or of the weights.
+
+        Args:
+            inputs: array of shape (n_nodes,) or (n_nodes, k)
+            weights: array of shape (n_edges,) or (n_edges, k)
+
+        Returns:
+            array of shape (n_edges,) or (n_edges, k)
+        """
+        if inputs is None and weights is None:
+            raise ValueError("Give a change of the inputs or of the weights")
+        rhs, dflows = 0, 0
+        if inputs is not None:
+            rhs = np.asarray(inputs, dtype=float)
+        if weights is not None:
+            dflows = self._value(np.asarray(weights, dtype=float))
+            rhs = rhs - self._outflow(dflows)
+        dx = self.solver.solve(rhs)
+        return dflows + self._gain(self._diff(dx))
+
+    def vjp(self, flows):
+        """
+        Pulls the gradient of an objective with respect to the flows back
+        to the inputs and the weights, with one solve.
+
+        Args:
+            flows: the gradient dJ/dflows, shape (n_edges,) or (n_edges, k)
+
+        Returns:
+            (dJ/dinputs, dJ/dweights), of shapes (n_nodes, ...) and (n_edges, ...)
+        """
+        flows = np.asarray(flows, dtype=float)
+        u = self.solver.solve(self._outflow(self._gain(flows)))
+        return u, self._value(flows - self._diff(u))
+
+    def ptdf(self, sparse=False, threshold=0., block=256):
+        """
+        Returns the (n_edges x n_nodes) matrix of the derivatives of the
+        flows with respect to the inputs, the power transfer distribution
+        factors.
+
+        Args:
+            sparse: if True, returns a CSR matrix without the entries
+                whose magnitude is at most `threshold`
+            block: number of columns computed per solve
+        """
+        return self._matrix(lambda eye: self.jvp(inputs=eye), self.compiled.n_nodes,
+                            sparse, threshold, block)
+
+    def weight_sensitivities(self, sparse=False, threshold=0., block=256):
+        """
+        Returns the (n_edges x n_edges) matrix of the derivatives of the
+        flows with respect to the edge weights; see :meth:`ptdf` for the
+        arguments.
+        """
+        return self._matrix(lambda eye: self.jvp(weights=eye), self.compiled.n_edges,
+                            sparse, threshold, block)
+
+    def _matrix(self, apply, n_cols, sparse, threshold, block):
+        """
+        Builds a matrix column block by column block, applying `apply`
+        to blocks of the identity.
+        """
+        n_rows = self.compiled.n_edges
+        if not sparse:
+            out = np.empty((n_rows, n_cols))
+        else:
+            empty = np.empty(0, dtype=np.intp)
+            rows, cols, vals = [empty], [empty], [np.empty(0)]
+
+        for start in range(0, n_cols, block):
+            stop = min(start + block, n_cols)
+            eye = np.zeros((n_cols, stop - start))
+            eye[np.arange(start, stop), np.arange(stop - start)] = 1
+            columns = apply(eye)
+            if not sparse:
+                out[:, start:stop] = columns
+            else:
+                r, c = np.nonzero(np.abs(columns) > threshold)
+                rows.append(r)
+                cols.append(c + start)
+                vals.append(columns[r, c])
+
+        if not sparse:
+            return out
+        import scipy.sparse as sp
+        return sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(n_rows, n_cols))
@@ -0,0 +1,403 @@
+"""
+An asyncio service that batches concurrent steady state solves.
+
+Requests for the same topology (nodes, edges, weights and model) that
+arrive within `window` seconds of each other are solved together: one
+multi right hand side solve with the factorized Laplacian for the linear
+model, one integration of the stacked copies of the network for the
+Kuramoto model. Every caller awaits only its own result::
+
+    service = SolveService(window=0.002)
+    flows = await service.solve(network, inputs)
+
+The number of requests queued or being solved is bounded by
+`max_pending`; further callers wait for a slot, or get
+:class:`ServiceBusy` after `queue_timeout` seconds. :attr:`SolveService.metrics`
+records latencies, batch sizes and throughput.
+
+The service can also be run as a TCP server speaking JSON lines, see
+:func:`serve`::
+
+    python -m flownetpy.service --port 8765
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import asyncio
+import json
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .batch import PRECISIONS, solve_batch
+from .cache import _digest
+from .compiled import CompiledNetwork
+
+
+class ServiceBusy(RuntimeError):
+    """
+    A request waited longer than the queue timeout for a slot
+    """
+
+
+class ServiceMetrics(object):
+    """
+    Counters of a :class:`SolveService`.
+
+    Attributes:
+        requests: number of requests received
+        completed: number of requests answered
+        failed: number of requests that raised
+        rejected: number of requests refused with ServiceBusy
+        batches: number of batches solved
+        pending: number of requests queued or being solved
+        latencies: the latencies of the last `window` requests, in seconds
+    """
+
+    def __init__(self, window=4096):
+        self.requests = self.completed = self.failed = self.rejected = 0
+        self.batches = 0
+        self.pending = 0
+        self.latencies = deque(maxlen=window)
+        self.solve_time = 0.
+        self.started = time.perf_counter()
+
+    def latency(self, q=(0.5, 0.9, 0.99)):
+        """
+        Returns the quantiles `q` of the recent latencies, in seconds.
+        """
+        if not self.latencies:
+            return np.full(np.shape(q), np.nan)
+        return np.quantile(np.array(self.latencies), q)
+
+    @property
+    def batch_size(self):
+        """
+        The mean number of requests per batch.
+        """
+        return (self.completed + self.failed) / max(self.batches, 1)
+
+    @property
+    def throughput(self):
+        """
+        Requests answered per second since the service started.
+        """
+        return self.completed / (time.perf_counter() - self.started)
+
+    def as_dict(self):
+        p50, p90, p99 = self.latency().tolist()
+        return {
+            'requests': self.requests, 'completed': self.completed,
+            'failed': self.failed, 'rejected': self.rejected,
+            'batches': self.batches, 'pending': self.pending,
+            'batch_size': self.batch_size, 'throughput': self.throughput,
+            'solve_time': self.solve_time,
+            'latency_p50': p50, 'latency_p90': p90, 'latency_p99': p99,
+        }
+
+    def __repr__(self):
+        return 'ServiceMetrics(%r)' % self.as_dict()
+
+
+class SolveService(object):
+    """
+    Batches concurrent steady state solves by topology.
+
+    Args:
+        window: seconds a batch stays open after its first request
+        max_batch: a batch is solved as soon as it holds this many requests
+        max_pending: maximal number of requests queued or being solved
+        queue_timeout: seconds a request waits for a slot before raising
+            ServiceBusy, None to wait indefinitely
+        workers: number of threads solving batches
+        integrator: integrator backend of the Kuramoto model
+        precision: 'double' or 'single', see :func:`solve_batch`
+        max_topologies: number of registered topologies kept
+    """
+
+    def __init__(self, window=0.002, max_batch=256, max_pending=4096, queue_timeout=None,
+                 workers=2, integrator=None, precision='double', max_topologies=64):
+        if precision not in PRECISIONS:
+            raise ValueError("Unknown precision %r, choose one of %s" %
+                             (precision, ', '.join(sorted(PRECISIONS))))
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.integrator = integrator
+        self.precision = precision
+        self.max_topologies = max_topologies
+        self.metrics = ServiceMetrics()
+        self._pool = ThreadPoolExecutor(workers)
+        self._topologies = OrderedDict()
+        # network object -> topology key, so that a network is compiled and
+        # hashed once and not on every request
+        self._keys = weakref.WeakKeyDictionary()
+        self._queues = {}
+        self._timers = {}
+        self._tasks = set()
+        self._slots = None
+
+    def register(self, network, model=None):
+        """
+        Returns the topology key of `network`, which can be passed to
+        :meth:`solve` instead of the network.
+
+        :meth:`solve` registers a network on its first request and then
+        reuses the key of the same object; a network changed in place must
+        be registered again for the change to be seen.
+
+        Args:
+            network: a LinearFlowNetwork, a KuramotoNetwork or a
+                :class:`flownetpy.compiled.CompiledNetwork`
+            model: 'linear' or 'kuramoto', implied by the network class
+        """
+        if isinstance(network, CompiledNetwork):
+            compiled = network
+            if model is None:
+                raise ValueError("Give the model of a compiled network")
+        else:
+            from .kuramotonetwork import KuramotoNetwork
+
+            compiled = network.compile()
+            if model is None:
+                model = 'kuramoto' if isinstance(network, KuramotoNetwork) else 'linear'
+        if model not in ('linear', 'kuramoto'):
+            raise ValueError("Unknown model %r" % (model,))
+        key = _digest(model, np.array([compiled.n_nodes]), compiled.head,
+                      compiled.tail, compiled.weights)
+        if key not in self._topologies:
+            self._topologies[key] = (compiled, model)
+            while len(self._topologies) > self.max_topologies:
+                self._topologies.popitem(last=False)
+        self._topologies.move_to_end(key)
+        try:
+            self._keys[network] = key
+        except TypeError:
+            pass
+        return key
+
+    def _key(self, network):
+        if isinstance(network, str):
+            return network
+        try:
+            key = self._keys.get(network)
+        except TypeError:
+            key = None
+        if key is None or key not in self._topologies:
+            return self.register(network)
+        self._topologies.move_to_end(key)
+        return key
+
+    def topology(self, key):
+        """
+        Returns the (compiled network, model) registered under `key`.
+        """
+        try:
+            return self._topologies[key]
+        except KeyError:
+            raise KeyError("Unknown topology %r" % (key,))
+
+    async def solve(self, network, inputs=None):
+        """
+        Returns the steady flows of `network` with `inputs`, an array in
+        the order of ``network.compile().edges()``, or None if there is
+        no steady state.
+
+        Args:
+            network: a network or a key returned by :meth:`register`
+            inputs: array in the order of ``network.compile().nodes``,
+                defaults to the inputs of the network
+        """
+        key = self._key(network)
+        compiled, model = self.topology(key)
+        inputs = compiled.inputs if inputs is None else np.asarray(inputs, dtype=float)
+        if inputs.shape != (compiled.n_nodes,):
+            raise ValueError("Expected %d inputs, got %r" % (compiled.n_nodes, inputs.shape))
+
+        metrics = self.metrics
+        metrics.requests += 1
+        start = time.perf_counter()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.rejected += 1
+            raise ServiceBusy("No slot freed within %g s, %d requests pending" %
+                              (self.queue_timeout, metrics.pending))
+
+        metrics.pending += 1
+        try:
+            future = asyncio.get_running_loop().create_future()
+            queue = self._queues.setdefault(key, (compiled, model, []))[2]
+            queue.append((inputs, future))
+            if len(queue) >= self.max_batch:
+                self._flush(key)
+            elif len(queue) == 1:
+                self._timers[key] = asyncio.get_running_loop().call_later(
+                    self.window, self._flush, key)
+            result = await future
+            metrics.latencies.append(time.perf_counter() - start)
+            return result
+        finally:
+            metrics.pending -= 1
+            self._slots.release()
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._queues.pop(key, None)
+        if batch is not None:
+            task = asyncio.get_running_loop().create_task(self._run(*batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, compiled, model, queue):
+        metrics = self.metrics
+        inputs = np.array([request[0] for request in queue])
+        start = time.perf_counter()
+        try:
+            flows, converged = await asyncio.get_running_loop().run_in_executor(
+                self._pool, solve_batch, compiled, model, inputs, self.integrator,
+                self.precision)
+        except Exception as error:
+            metrics.batches += 1
+            for _, future in queue:
+                if not future.done():
+                    metrics.failed += 1
+                    future.set_exception(error)
+            return
+        metrics.batches += 1
+        metrics.solve_time += time.perf_counter() - start
+        for (_, future), row, ok in zip(queue, flows, converged):
+            if not future.done():
+                metrics.completed += 1
+                future.set_result(row if ok else None)
+
+    async def drain(self):
+        """
+        Solves the open batches now and waits for all batches to finish.
+        """
+        for key in list(self._queues):
+            self._flush(key)
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def close(self):
+        await self.drain()
+        self._pool.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+
+async def _handle(service, message):
+    """
+    Answers one JSON request of the TCP protocol, see :func:`serve`.
+    """
+    if 'register' in message:
+        spec = message['register']
+        n_nodes = spec['n_nodes']
+        edges = np.asarray(spec['edges'], dtype=np.intp).reshape(-1, 2)
+        weights = spec.get('weights', 1.)
+        compiled = CompiledNetwork(range(n_nodes), edges[:, 0], edges[:, 1],
+                                   np.broadcast_to(weights, (edges.shape[0],)),
+                                   np.zeros(n_nodes))
+        return {'topology': service.register(compiled, spec.get('model', 'linear'))}
+    if 'topology' in message:
+        flows = await service.solve(message['topology'], message['inputs'])
+        return {'flows': None if flows is None else flows.tolist()}
+    if 'metrics' in message:
+        return {'metrics': {name: (None if value != value else value)
+                            for name, value in service.metrics.as_dict().items()}}
+    raise ValueError("Unknown request %r" % (sorted(message),))
+
+
+async def serve(service, host='127.0.0.1', port=8765):
+    """
+    Starts serving `service` over TCP and returns the asyncio server.
+
+    Every line sent by a client is a JSON object with an optional 'id',
+    echoed in the answer, and one of:
+
+    - ``"register": {"n_nodes": n, "edges": [[u, v], ...], "weights": w,
+      "model": "linear"}``, with nodes numbered from 0, answered with
+      ``{"topology": key}``
+    - ``"topology": key, "inputs": [...]``, answered with ``{"flows": [...]}``,
+      null if there is no steady state
+    - ``"metrics": true``, answered with ``{"metrics": {...}}``
+
+    A failed request is answered with ``{"error": message}``. Requests on
+    one connection are handled concurrently and answered as they finish.
+    """
+    async def answer(line, writer):
+        message = {}
+        try:
+            message = json.loads(line)
+            reply = await _handle(service, message)
+        except Exception as error:
+            reply = {'error': '%s: %s' % (type(error).__name__, error)}
+        if isinstance(message, dict) and 'id' in message:
+            reply['id'] = message['id']
+        writer.write(json.dumps(reply).encode('utf8') + b'\n')
+        await writer.drain()
+
+    async def client(reader, writer):
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*list(tasks), return_exceptions=True)
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(client, host, port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m flownetpy.service',
+                                     description='Serves batched steady flow solves')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--window', type=float, default=0.002,
+                        help='batching window in seconds')
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-pending', type=int, default=4096)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--precision', choices=sorted(PRECISIONS), default='double')
+    args = parser.parse_args(argv)
+
+    async def run():
+        service = SolveService(window=args.window, max_batch=args.max_batch,
+                               max_pending=args.max_pending, workers=args.workers,
+                               precision=args.precision)
+        server = await serve(service, args.host, args.port)
+        print('Serving on %s:%d' % server.sockets[0].getsockname()[:2])
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    main()
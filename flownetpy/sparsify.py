@@ -0,0 +1,233 @@
+"""
+Spectral sparsification of dense networks.
+
+On dense networks, such as aggregated equivalents or all-to-all Kuramoto
+models, the number of edges grows as n_nodes**2 and so does the cost of
+every right hand side evaluation and Laplacian solve. A spectral
+sparsifier H keeps about ``n log n / epsilon**2`` of the edges, with
+reweighted conductances, such that
+
+    (1 - epsilon) L_G <= L_H <= (1 + epsilon) L_G
+
+in the sense of quadratic forms, with high probability. Every edge is kept
+independently with a probability proportional to its weight times its
+effective resistance and then weighted by the inverse of that probability
+(Spielman and Srivastava, 2008); the resistances are estimated with a
+:class:`flownetpy.resistance.ResistanceSketch`.
+
+A :class:`Sparsifier` either solves the linear model on H and bounds the
+error of the resulting flows, or uses H as the preconditioner of conjugate
+gradients on the original network, which then converges in
+O(sqrt((1 + epsilon) / (1 - epsilon))) iterations per digit::
+
+    sparsifier = Sparsifier(network, epsilon=0.3, seed=0)
+    flows, info = sparsifier.steady_flows()
+    flows, info = sparsifier.steady_flows(exact=True)
+"""
+
+from __future__ import division
+
+import numpy as np
+
+from .compiled import CompiledNetwork
+from .resistance import ResistanceSketch, _compiled
+
+#: expected number of kept edges, in units of n_nodes * log(n_nodes) / epsilon**2
+SAMPLING = 1.
+
+
+def sample_edges(compiled, epsilon=0.5, resistances=None, samples=None, seed=None):
+    """
+    Samples the edges of a spectral sparsifier of `compiled`.
+
+    Args:
+        epsilon: the spectral error, in (0, 1)
+        resistances: the effective resistances of the edges, in the order
+            of ``compiled.edges()``. Estimated with a ResistanceSketch if
+            not given; estimates within a constant factor only increase the
+            variance of the sparsifier.
+        samples: the expected number of kept edges, defaults to
+            ``SAMPLING * n_nodes * log(n_nodes) / epsilon**2``
+        seed: seed of the sketch and of the sampling
+
+    Returns:
+        (kept, weights): the indices of the kept edges and their new weights
+    """
+    if not 0 < epsilon < 1:
+        raise ValueError("epsilon must be in (0, 1), got %r" % epsilon)
+    if np.any(compiled.weights < 0):
+        raise ValueError("Spectral sparsification needs nonnegative weights")
+    rng = np.random.RandomState(seed)
+    n = compiled.n_nodes
+    if resistances is None:
+        sketch = ResistanceSketch(compiled, epsilon=0.5, seed=rng.randint(2**31))
+        resistances = sketch.edge_resistances()
+    if samples is None:
+        samples = SAMPLING * n * np.log(max(n, 2)) / epsilon**2
+
+    # the leverages w_e R_e sum to n_nodes minus the number of components;
+    # a bridge has leverage 1 and is always kept
+    leverage = np.minimum(compiled.weights * resistances, 1.)
+    probability = np.minimum(1., samples * leverage / max(n - 1, 1))
+    kept = np.flatnonzero(rng.uniform(size=compiled.n_edges) < probability)
+    return kept, compiled.weights[kept] / probability[kept]
+
+
+def _pcg(laplacian, precondition, b, tol, maxiter):
+    """
+    Preconditioned conjugate gradients on the columns of b, which must sum
+    to zero on every component. Returns (x, iterations).
+    """
+    x = precondition(b)
+    r = b - laplacian.dot(x)
+    z = precondition(r)
+    p = z.copy()
+    rz = np.sum(r * z, axis=0)
+    bound = tol * np.linalg.norm(b, axis=0)
+    for iteration in range(maxiter):
+        if np.all(np.linalg.norm(r, axis=0) <= bound):
+            return x, iteration
+        q = laplacian.dot(p)
+        pq = np.sum(p * q, axis=0)
+        alpha = np.divide(rz, pq, out=np.zeros_like(rz), where=pq > 0)
+        x += alpha * p
+        r -= alpha * q
+        z = precondition(r)
+        rz_new = np.sum(r * z, axis=0)
+        beta = np.divide(rz_new, rz, out=np.zeros_like(rz), where=rz > 0)
+        p = z + beta * p
+        rz = rz_new
+    return x, maxiter
+
+
+class Sparsifier(object):
+    """
+    A spectral sparsifier of a network with nonnegative weights.
+
+    Args:
+        network: a FlowNetwork or CompiledNetwork
+        epsilon, resistances, samples, seed: see :func:`sample_edges`
+
+    Attributes:
+        original: the compiled network
+        compiled: the compiled sparsifier, with the nodes and inputs of
+            the network and a subset of its edges
+        kept: the indices of the edges of the sparsifier in the network
+        epsilon: the spectral error
+
+    Raises:
+        RuntimeError: if the sampled edges do not connect the components of
+            the network, which becomes unlikely for smaller epsilon
+    """
+
+    def __init__(self, network, epsilon=0.5, resistances=None, samples=None, seed=None):
+        original = _compiled(network)
+        kept, weights = sample_edges(original, epsilon, resistances, samples, seed)
+        self.original = original
+        self.epsilon = epsilon
+        self.kept = kept
+        self.compiled = CompiledNetwork(original.nodes, original.head[kept],
+                                        original.tail[kept], weights, original.inputs)
+        self.compiled._node_index = original._node_index
+        if self.solver().n_components != original.laplacian_solver().n_components:
+            raise RuntimeError("The sparsifier with %d of %d edges disconnects the network, "
+                               "use a smaller epsilon" % (kept.size, original.n_edges))
+
+    @property
+    def n_edges(self):
+        return self.kept.size
+
+    def solver(self):
+        """
+        Returns the cached :class:`flownetpy.laplacian.LaplacianSolver` of
+        the sparsifier.
+        """
+        return self.compiled.laplacian_solver()
+
+    def network(self, cls=None):
+        """
+        Returns the sparsifier as a network of class `cls`, by default a
+        LinearFlowNetwork.
+        """
+        if cls is None:
+            from .linearflownetwork import LinearFlowNetwork
+            cls = LinearFlowNetwork
+        return cls._from_compiled(self.compiled)
+
+    def pressures(self, inputs=None, exact=False, tol=1e-10, maxiter=200):
+        """
+        Returns (pressures, info) of the linear model for inputs of shape
+        (n_nodes,) or (n_nodes, k), defaulting to the inputs of the network.
+
+        Args:
+            exact: if False, the pressures are solved on the sparsifier.
+                If True, they are solved on the network by conjugate
+                gradients preconditioned with the sparsifier, to a relative
+                residual `tol`.
+
+        Returns:
+            info is a dictionary with 'energy_bound', a bound on the energy
+            norm ``sqrt(sum_e (f_e - f*_e)**2 / w_e)`` of the error of the
+            flows per column of the inputs, valid if the sparsifier has
+            spectral error epsilon, and with 'iterations' if exact
+        """
+        original, solver = self.original, self.solver()
+        inputs = original.inputs if inputs is None else np.asarray(inputs, dtype=float)
+        b = inputs - solver._component_means(inputs)[solver.labels]
+        eps = self.epsilon
+        if not exact:
+            x = solver.solve(b)
+            # |p - p*|_L <= eps/(1 - eps) |p*|_L and |p*|_L**2 <= (1 + eps) b.p
+            energy = np.sqrt(np.maximum((1 + eps) * np.sum(b * x, axis=0), 0))
+            return x, {'energy_bound': eps / (1 - eps) * energy}
+
+        laplacian = original.laplacian()
+        x, iterations = _pcg(laplacian, solver.solve, b, tol, maxiter)
+        r = b - laplacian.dot(x)
+        # |p - p*|_L**2 = r.L^+ r <= (1 + eps) r.L_H^+ r
+        energy = np.sqrt(np.maximum((1 + eps) * np.sum(r * solver.solve(r), axis=0), 0))
+        return x, {'energy_bound': energy, 'iterations': iterations}
+
+    def steady_flows(self, inputs=None, exact=False, tol=1e-10, maxiter=200):
+        """
+        Returns (flows, info): the flows of the linear model along all
+        edges of the network, in the order of ``original.edges()``, for
+        the pressures of :meth:`pressures`, to which the arguments are
+        passed.
+
+        info additionally holds 'error_bound', a bound on the error of
+        every flow: ``|f_e - f*_e| <= sqrt(w_e) * energy_bound``.
+        """
+        original = self.original
+        x, info = self.pressures(inputs, exact, tol, maxiter)
+        diff = x[original.head] - x[original.tail]
+        weights = original.weights.reshape((-1,) + (1,) * (x.ndim - 1))
+        roots = np.sqrt(weights)
+        info['error_bound'] = roots * info['energy_bound']
+        return weights * diff, info
+
+    def kuramoto_phases(self, integrator=None, refine=True):
+        """
+        Returns phases of the network close to a fixed point of the
+        Kuramoto dynamics, found on the sparsifier and refined by Newton
+        steps on the network if `refine` is True.
+
+        There is no error bound for the nonlinear model: check the returned
+        stability, or pass the phases as initguess to
+        :meth:`flownetpy.KuramotoNetwork.steady_flows`.
+
+        Returns:
+            (thetas, stable), see :func:`flownetpy.multilevel.newton`;
+            thetas is None if the sparsifier has no fixed point
+        """
+        from .kuramotonetwork import KuramotoNetwork, NTRY
+        from .multilevel import newton
+
+        warmstart = self.solver().solve(self.compiled.inputs)
+        thetas, _ = KuramotoNetwork._from_compiled(self.compiled)._try_find_fps(
+            NTRY, integrator=integrator, warmstart=warmstart, compiled=self.compiled)
+        if thetas is None:
+            return None, False
+        if not refine:
+            return thetas, False
+        return newton(self.original, thetas)
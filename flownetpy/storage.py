@@ -0,0 +1,276 @@
+"""
+On-disk formats for flow networks and their solutions.
+
+A network is stored as a directory of flat ``.npy`` arrays (edge
+endpoints, weights, inputs, node labels and, optionally, a cycle basis)
+next to a small ``meta.json``. :func:`load_network` memory-maps the arrays,
+so several processes loading the same network share its pages.
+
+Solutions are stored by :class:`ResultStore` as raw, fixed-width binary
+records that are appended at the end of their files; existing records
+are never rewritten.
+"""
+
+from __future__ import division
+
+import json
+import os
+
+import numpy as np
+
+from .compiled import CompiledNetwork
+
+FORMAT_VERSION = 1
+_META = 'meta.json'
+
+
+def _write_meta(path, meta):
+    # write to a temporary file first, so that readers never see half of it
+    tmp = os.path.join(path, _META + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(path, _META))
+
+
+def _read_meta(path, kind):
+    with open(os.path.join(path, _META)) as f:
+        meta = json.load(f)
+    if meta.get('kind') != kind:
+        raise ValueError("%r does not hold a %s" % (path, kind))
+    if meta.get('version', 0) > FORMAT_VERSION:
+        raise ValueError("%r was written by a newer version of flownetpy" % path)
+    return meta
+
+
+def _encode_nodes(nodes):
+    """
+    Returns (array, encoding) for a list of node labels
+    """
+    if all(isinstance(node, (int, np.integer)) for node in nodes):
+        if list(nodes) == list(range(len(nodes))):
+            return None, 'range'
+        return np.array(nodes, dtype=np.int64), 'int'
+    if all(isinstance(node, str) for node in nodes):
+        return np.array(nodes, dtype=np.str_), 'str'
+    if all(isinstance(node, tuple) for node in nodes):
+        try:
+            arr = np.array(nodes)
+        except ValueError:
+            arr = None
+        if arr is not None and arr.ndim == 2 and arr.dtype.kind in 'iu':
+            return arr.astype(np.int64), 'tuple'
+    raise ValueError("Can only store integer, string or integer tuple node labels")
+
+
+def _decode_nodes(arr, encoding, n_nodes):
+    if encoding == 'range':
+        return range(n_nodes)
+    if encoding == 'tuple':
+        return [tuple(row) for row in arr.tolist()]
+    return arr.tolist()
+
+
+def save_network(network, path, cycle_basis=False):
+    """
+    Saves a :class:`flownetpy.FlowNetwork` to the directory `path`.
+
+    Args:
+        network: a FlowNetwork, or any of its subclasses
+        path: directory, created if needed. Existing files are overwritten.
+        cycle_basis: if True, the cycle basis is computed (unless cached)
+            and stored as well.
+    """
+    compiled = network.compile()
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    node_arr, node_encoding = _encode_nodes(compiled.nodes)
+    arrays = {
+        'head': compiled.head.astype(np.int64),
+        'tail': compiled.tail.astype(np.int64),
+        'weights': compiled.weights,
+        'inputs': compiled.inputs,
+    }
+    if node_arr is not None:
+        arrays['nodes'] = node_arr
+
+    if cycle_basis or compiled._cycle_basis is not None:
+        cycles = compiled.cycle_basis()
+        arrays['cycles_indptr'] = np.cumsum([0] + [len(c) for c in cycles]).astype(np.int64)
+        arrays['cycles_indices'] = (np.concatenate(cycles) if cycles
+                                    else np.zeros(0)).astype(np.int64)
+
+    for name, arr in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(arr))
+
+    _write_meta(path, {
+        'kind': 'network',
+        'version': FORMAT_VERSION,
+        'class': type(network).__name__,
+        'weight_attr': network.weight_attr,
+        'n_nodes': compiled.n_nodes,
+        'n_edges': compiled.n_edges,
+        'nodes': node_encoding,
+        'arrays': sorted(arrays),
+    })
+
+
+def load_network(path, cls=None, mmap_mode='r'):
+    """
+    Loads a network saved with :func:`save_network`.
+
+    Args:
+        path: the directory of the network
+        cls: the FlowNetwork subclass to build. Defaults to the class the
+            network was saved from.
+        mmap_mode: passed to np.load; None reads the arrays into memory
+
+    Returns:
+        A network of class `cls`, in compiled form (see
+        :meth:`flownetpy.FlowNetwork.from_arrays`)
+    """
+    meta = _read_meta(path, 'network')
+    if cls is None:
+        cls = _network_classes()[meta['class']]
+
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+
+    nodes = _decode_nodes(load('nodes') if 'nodes' in meta['arrays'] else None,
+                          meta['nodes'], meta['n_nodes'])
+    compiled = CompiledNetwork(nodes, load('head'), load('tail'),
+                               load('weights'), load('inputs'))
+    if 'cycles_indptr' in meta['arrays']:
+        indptr, indices = load('cycles_indptr'), load('cycles_indices')
+        compiled._cycle_basis = [indices[indptr[i]:indptr[i+1]]
+                                 for i in range(indptr.size - 1)]
+    return cls._from_compiled(compiled, meta['weight_attr'])
+
+
+def _network_classes():
+    import flownetpy
+    from .flownetwork import FlowNetwork
+
+    # the network classes are imported lazily; import them to find them
+    for name in flownetpy.__all__:
+        getattr(flownetpy, name)
+    classes = {}
+    pending = [FlowNetwork]
+    while pending:
+        cls = pending.pop()
+        classes[cls.__name__] = cls
+        pending.extend(cls.__subclasses__())
+    return classes
+
+
+class ResultStore(object):
+    """
+    An append-only store of steady state solutions of one network.
+
+    Every record holds the flows (n_edges values) and, optionally, the
+    inputs and the node phases/pressures (n_nodes values each). Unsolved
+    records are stored as nan. Fields are kept in separate raw files;
+    :meth:`__getitem__` returns them as read-only memory maps.
+
+    Use :meth:`create` for a new store and the constructor to open an
+    existing one. A store must only have one writer at a time.
+    """
+    FIELDS = ('flows', 'inputs', 'thetas')
+
+    def __init__(self, path):
+        self.path = path
+        meta = _read_meta(path, 'results')
+        self.n_nodes = meta['n_nodes']
+        self.n_edges = meta['n_edges']
+        self.fields = tuple(meta['fields'])
+        self.dtype = np.dtype(meta['dtype'])
+        self._count = meta['count']
+        self._meta = meta
+
+    @classmethod
+    def create(cls, path, network, fields=('flows',), dtype=np.float64):
+        """
+        Creates an empty store at `path` for solutions of `network`.
+
+        Args:
+            network: a FlowNetwork or CompiledNetwork
+            fields: the fields every record holds, a subset of
+                ('flows', 'inputs', 'thetas')
+            dtype: the floating point type of the records
+        """
+        compiled = network if isinstance(network, CompiledNetwork) else network.compile()
+        unknown = set(fields) - set(cls.FIELDS)
+        if unknown or 'flows' not in fields:
+            raise ValueError("fields must include 'flows' and be among %r" % (cls.FIELDS,))
+        if os.path.exists(os.path.join(path, _META)):
+            raise ValueError("%r already holds a result store" % path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        for field in fields:
+            open(os.path.join(path, field + '.bin'), 'wb').close()
+        _write_meta(path, {
+            'kind': 'results',
+            'version': FORMAT_VERSION,
+            'n_nodes': compiled.n_nodes,
+            'n_edges': compiled.n_edges,
+            'fields': list(fields),
+            'dtype': np.dtype(dtype).str,
+            'count': 0,
+        })
+        return cls(path)
+
+    def _width(self, field):
+        return self.n_edges if field == 'flows' else self.n_nodes
+
+    def __len__(self):
+        return self._count
+
+    def append(self, flows, **fields):
+        """
+        Appends one record, or a batch of records, to the store.
+
+        Args:
+            flows: array of shape (n_edges,) or (k, n_edges), in the edge
+                order of the compiled network. None stands for an unsolved
+                record.
+            fields: arrays for the other fields of the store, e.g. thetas
+        """
+        fields['flows'] = flows
+        if set(fields) - set(self.fields):
+            raise ValueError("This store only holds %r" % (self.fields,))
+
+        rows = {}
+        for field, value in fields.items():
+            if value is not None:
+                rows[field] = np.asarray(value, dtype=self.dtype).reshape(-1, self._width(field))
+        counts = set(value.shape[0] for value in rows.values())
+        if len(counts) > 1:
+            raise ValueError("All fields must have the same number of records")
+        # the fields that are not given are unsolved for every record
+        k = counts.pop() if counts else 1
+        for field in self.fields:
+            if field not in rows:
+                rows[field] = np.full((k, self._width(field)), np.nan, dtype=self.dtype)
+
+        # records beyond the committed count are a torn write: cut them off
+        for field in self.fields:
+            with open(os.path.join(self.path, field + '.bin'), 'r+b') as f:
+                f.truncate(self._count * self._width(field) * self.dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(rows[field]).tobytes())
+        self._count += k
+        self._meta['count'] = self._count
+        _write_meta(self.path, self._meta)
+
+    def __getitem__(self, field):
+        """
+        Returns field as a read-only memory map of shape (len(self), width)
+        """
+        if field not in self.fields:
+            raise KeyError(field)
+        shape = (self._count, self._width(field))
+        if self._count == 0:
+            return np.zeros(shape, dtype=self.dtype)
+        return np.memmap(os.path.join(self.path, field + '.bin'), dtype=self.dtype,
+                         mode='r', shape=shape)
@@ -0,0 +1,129 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.batch import Stack, solve_batch, solve_stacked
+from flownetpy.ensemble import ensemble
+from flownetpy.kuramotonetwork import KuramotoRHS
+from flownetpy.laplacian import LaplacianSolver
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _inputs(n, k, seed=0, scale=1.):
+    inputs = np.random.RandomState(seed).normal(size=(k, n))
+    return scale * (inputs - inputs.mean(axis=1, keepdims=True))
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=2, max_value=30), integers(min_value=0, max_value=1000))
+def test_single_precision_solver_is_refined(n, seed):
+    rng = np.random.RandomState(seed)
+    graph = nx.gnm_random_graph(n, 3 * n, seed=seed)
+    net = LinearFlowNetwork(graph, np.zeros(n), 1.)
+    compiled = net.compile()
+    laplacian = compiled.laplacian(weights=rng.uniform(0.01, 100, compiled.n_edges))
+    b = rng.normal(size=(n, 3))
+    exact = LaplacianSolver(laplacian).solve(b)
+    single = LaplacianSolver(laplacian, dtype=np.float32)
+    np.testing.assert_allclose(single.solve(b), exact, atol=1e-10 * np.abs(exact).max())
+
+
+def test_single_precision_factors():
+    compiled = LinearFlowNetwork(nx.grid_2d_graph(20, 20), np.zeros(400), 1.).compile()
+    single = compiled.laplacian_solver(np.float32)
+    assert_true(single is compiled.laplacian_solver('float32'))
+    assert_true(single is not compiled.laplacian_solver())
+    assert_equal(single._lu.L.dtype, np.float32)
+    single.solve(_inputs(400, 1).T)
+    assert_true(single.refinements >= 1)
+    assert_raises(ValueError, LaplacianSolver, compiled.laplacian(), dtype=np.float16)
+
+
+def test_rhs_in_single_precision():
+    compiled = KuramotoNetwork(nx.grid_2d_graph(5, 5), _inputs(25, 1)[0], 3.).compile()
+    thetas = np.random.RandomState(1).normal(size=(25, 4))
+    single = KuramotoRHS(compiled, dtype=np.float32)(0, thetas)
+    assert_equal(single.dtype, np.float32)
+    np.testing.assert_allclose(single, KuramotoRHS(compiled)(0, thetas), atol=1e-5)
+
+
+def test_batches_agree():
+    for cls in (LinearFlowNetwork, KuramotoNetwork):
+        compiled = cls(nx.grid_2d_graph(3, 3), np.zeros(9), 3.).compile()
+        model = 'linear' if cls is LinearFlowNetwork else 'kuramoto'
+        inputs = _inputs(9, 6)
+        double, ok = solve_batch(compiled, model, inputs)
+        single, ok_single = solve_batch(compiled, model, inputs, precision='single')
+        assert_true(np.all(ok) and np.all(ok_single))
+        np.testing.assert_allclose(single, double, atol=1e-8)
+    assert_raises(ValueError, solve_batch, compiled, model, inputs, precision='half')
+
+
+def test_ensemble_in_single_precision():
+    net = LinearFlowNetwork(nx.grid_2d_graph(4, 4), np.zeros(16), 3.)
+    inputs = _inputs(16, 100)
+    double = ensemble(net, inputs=inputs, chunk_size=30)
+    single = ensemble(net, inputs=inputs, chunk_size=30, precision='single')
+    np.testing.assert_allclose(single.mean, double.mean, atol=1e-12)
+    np.testing.assert_allclose(single.std, double.std, atol=1e-12)
+    assert_raises(ValueError, ensemble, net, inputs=inputs, precision='half')
+
+
+def _small_networks(count, cls, seed=0):
+    rng = np.random.RandomState(seed)
+    networks = []
+    for i in range(count):
+        n = rng.randint(5, 12)
+        graph = nx.connected_watts_strogatz_graph(n, 4, 0.3, seed=i)
+        inputs = _inputs(n, 1, seed=i)[0]
+        networks.append(cls(graph, inputs, rng.uniform(0.5, 3.)))
+    return networks
+
+
+def test_stack():
+    networks = _small_networks(5, LinearFlowNetwork)
+    stack = Stack(networks)
+    compiled = stack.compiled
+    assert_equal(compiled.n_nodes, sum(net.number_of_nodes() for net in networks))
+    assert_equal(stack.node_offsets.tolist()[-1], compiled.n_nodes)
+    # no edge crosses blocks
+    assert_true(np.all(stack.node_blocks[compiled.head] == stack.edge_blocks))
+    assert_true(np.all(stack.node_blocks[compiled.tail] == stack.edge_blocks))
+    for net, inputs in zip(networks, stack.split_nodes(compiled.inputs)):
+        np.testing.assert_array_equal(inputs, net.compile().inputs)
+    np.testing.assert_array_equal(stack.block_max(stack.edge_blocks, edges=True),
+                                  np.arange(5))
+
+
+@settings(deadline=None, max_examples=5, derandomize=True)
+@given(integers(min_value=0, max_value=1000))
+def test_stacked_linear(seed):
+    networks = _small_networks(20, LinearFlowNetwork, seed)
+    flows, converged = solve_stacked(networks, 'linear', as_dicts=True)
+    assert_true(np.all(converged))
+    for net, stacked in zip(networks, flows):
+        for edge, flow in net.steady_flows().items():
+            assert_almost_equal(stacked[edge], flow)
+
+
+def test_stacked_kuramoto():
+    networks = _small_networks(30, KuramotoNetwork)
+    # a network without fixed point
+    networks.append(KuramotoNetwork(nx.path_graph(3), [2., 0., -2.], 1.))
+    flows, converged = solve_stacked(networks, 'kuramoto', tol=1e-10)
+    assert_false(converged[-1])
+    assert_is_none(flows[-1])
+    assert_greater(converged.sum(), 20)
+    for net, stacked, ok in zip(networks, flows, converged):
+        if not ok:
+            continue
+        compiled = net.compile()
+        # the flows balance the inputs, through stable edges
+        balance = compiled.inputs + compiled.incidence().dot(stacked)
+        assert_less(np.abs(balance).max(), 1e-6)
+        assert_true(np.all(np.abs(stacked) < compiled.weights))
+    assert_raises(ValueError, solve_stacked, networks, 'nonlinear')
@@ -0,0 +1,65 @@
+from nose.tools import *
+
+from flownetpy.bench import run_suite, compare, read_records, BENCHMARKS
+from flownetpy.bench.__main__ import main, _sizes
+from flownetpy.bench.generators import FAMILIES
+
+import argparse
+import os
+import shutil
+import tempfile
+import numpy as np
+import networkx as nx
+
+
+class TestGenerators:
+    def test_connected_simple_graphs(self):
+        for name, generator in FAMILIES.items():
+            edges, n_nodes = generator(200, np.random.RandomState(0))
+            G = nx.Graph()
+            G.add_nodes_from(range(n_nodes))
+            G.add_edges_from(edges.tolist())
+            assert(abs(n_nodes - 200) <= 20)
+            assert_equal(G.number_of_edges(), edges.shape[0])
+            assert(nx.is_connected(G))
+
+
+class TestRunner:
+    def setup_method(self, method=None):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.tmpdir)
+
+    setUp = setup_method
+    tearDown = teardown_method
+
+    def test_records(self):
+        records = list(run_suite(families=['ring', 'tree'], sizes=[10, 30], repeats=1))
+        assert_equal(len(records), 2 * 2 * len(BENCHMARKS))
+        for record in records:
+            assert(record['wall_time'] > 0)
+            assert(record['peak_memory'] > 0)
+            if record['benchmark'] in ('kuramoto.steady_flows', 'kuramoto._evolve'):
+                assert(record['rhs_evals'] > 0)
+
+    def test_cli_and_compare(self):
+        path = os.path.join(self.tmpdir, 'run.jsonl')
+        main(['--families', 'lattice', '--sizes', '16', '--repeats', '1',
+              '--benchmarks', 'linear.steady_flows', '--no-memory', '-o', path])
+        records = read_records(path)
+        assert_equal(len(records), 1)
+        assert_is_none(records[0]['peak_memory'])
+
+        slower = [dict(record, wall_time=10 * record['wall_time']) for record in records]
+        rows = compare(records, slower)
+        assert(rows[0][-1])
+        assert_equal(main(['compare', path, path]), 0)
+
+    def test_large_sizes(self):
+        args = argparse.Namespace(sizes=None, min_nodes=10, max_nodes=None, large=False)
+        assert_equal(_sizes(args), [10, 100, 1000, 10**4])
+        args.large = True
+        assert_equal(_sizes(args)[-2:], [10**5, 10**6])
+        # small world graphs are not factorized at a million nodes
+        assert_equal(list(run_suite(families=['small_world'], sizes=[10**6], repeats=1)), [])
@@ -0,0 +1,115 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.cache import SolutionCache
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+def _ring(size, inputs, cls=KuramotoNetwork, weight=10.):
+    edges = np.column_stack([np.arange(size), (np.arange(size) + 1) % size])
+    return cls.from_arrays(edges, weight, inputs)
+
+
+def _share(directory, seed):
+    # one of several processes putting and getting on the same directory
+    cache = SolutionCache(maxsize=1, directory=directory, max_bytes=20000)
+    rng = np.random.RandomState(seed)
+    for i in range(300):
+        inputs = np.full(8, float(rng.randint(20)))
+        cache.put('shared', inputs, flows=np.full(50, float(i)))
+        cache.get('shared', np.full(8, float(rng.randint(20))))
+        if i % 20 == 0:
+            cache.nearest('shared', inputs)
+
+
+class TestSolutionCache:
+    def setup_method(self, method=None):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.tmpdir)
+
+    setUp = setup_method
+    tearDown = teardown_method
+
+    def test_linear_hit(self):
+        cache = SolutionCache()
+        inputs = np.tile([1., -1.], 4)
+        first = _ring(8, inputs, LinearFlowNetwork).steady_flows(cache=cache)
+        second = _ring(8, inputs, LinearFlowNetwork).steady_flows(cache=cache)
+        assert_equal((cache.hits, cache.misses), (1, 1))
+        assert_equal(first, second)
+
+    def test_key_depends_on_weights(self):
+        cache = SolutionCache()
+        inputs = np.tile([1., -1.], 4)
+        _ring(8, inputs, LinearFlowNetwork, weight=1.).steady_flows(cache=cache)
+        _ring(8, inputs, LinearFlowNetwork, weight=2.).steady_flows(cache=cache)
+        assert_equal(cache.hits, 0)
+
+    def test_kuramoto_extra_output(self):
+        cache = SolutionCache()
+        net = _ring(8, np.tile([1., -1.], 4))
+        flows, data = net.steady_flows(extra_output=True, cache=cache)
+        cached_flows, cached_data = net.steady_flows(extra_output=True, cache=cache)
+        assert_equal(cache.hits, 1)
+        assert(np.allclose(cached_data['thetas'], data['thetas']))
+        assert(np.allclose(cached_data['omega'], data['omega']))
+        entry = cache.get(cache.key(net.compile(), 'kuramoto', None), net.compile().inputs)
+        assert(np.allclose(entry['winding'], data['omega']))
+        assert(np.allclose([flows[e] - cached_flows[e] for e in flows], 0))
+
+    def test_nearest_warm_start(self):
+        cache = SolutionCache()
+        inputs = np.tile([1., -1.], 4)
+        # some random initial phases end in a twisted state of the ring
+        np.random.seed(0)
+        _ring(8, inputs).steady_flows(cache=cache)
+        net = _ring(8, 1.01 * inputs)
+        key = cache.key(net.compile(), 'kuramoto', None)
+        nearest = cache.nearest(key, 1.01 * inputs)
+        assert(np.allclose(nearest['inputs'], inputs))
+        flows, data = net.steady_flows(extra_output=True, cache=cache)
+        # the cached phases were tried, and worked, as the first initial condition
+        assert(np.allclose(data['initguess'], nearest['thetas']))
+        assert(np.allclose(np.abs(list(flows.values())), 0.505, atol=1e-6))
+
+    def test_lru(self):
+        cache = SolutionCache(maxsize=2)
+        for scale in (1., 2., 3.):
+            _ring(4, scale * np.array([1., -1., 1., -1.]), LinearFlowNetwork).steady_flows(cache=cache)
+        _ring(4, np.array([1., -1., 1., -1.]), LinearFlowNetwork).steady_flows(cache=cache)
+        assert_equal(cache.hits, 0)
+
+    def test_disk_tier(self):
+        inputs = np.tile([1., -1.], 4)
+        _ring(8, inputs, LinearFlowNetwork).steady_flows(cache=SolutionCache(directory=self.tmpdir))
+        cache = SolutionCache(directory=self.tmpdir)
+        _ring(8, inputs, LinearFlowNetwork).steady_flows(cache=cache)
+        assert_equal(cache.hits, 1)
+
+    def test_disk_eviction(self):
+        cache = SolutionCache(maxsize=1, directory=self.tmpdir, max_bytes=3000)
+        for scale in range(1, 20):
+            _ring(8, scale * np.tile([1., -1.], 4), LinearFlowNetwork).steady_flows(cache=cache)
+        total = sum(os.path.getsize(os.path.join(d, f))
+                    for d, _, names in os.walk(self.tmpdir) for f in names)
+        assert(0 < total <= 3000)
+
+    def test_shared_directory(self):
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=_share, args=(self.tmpdir, seed))
+                     for seed in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(120)
+        assert_equal([process.exitcode for process in processes], [0] * 4)
+        size = sum(os.path.getsize(os.path.join(dirpath, name))
+                   for dirpath, _, names in os.walk(self.tmpdir) for name in names)
+        assert_less(size, 20000 + 4 * 20000 // 16)
@@ -0,0 +1,98 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork
+from flownetpy.checkpoint import Checkpoint, read_header
+from flownetpy.ensemble import ensemble
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import networkx as nx
+
+
+class _Sampler(object):
+    """
+    Draws balanced inputs and fails on a chosen call
+    """
+
+    def __init__(self, fail_at=None):
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def __call__(self, rng, size):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError("preempted")
+        inputs = rng.normal(size=(size, 16))
+        return inputs - inputs.mean(axis=1, keepdims=True)
+
+
+class TestCheckpoint:
+    def setup_method(self, method=None):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'run.ckpt')
+        self.net = LinearFlowNetwork(nx.grid_2d_graph(4, 4), np.zeros(16), 1.)
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.tmpdir)
+
+    setUp = setup_method
+    tearDown = teardown_method
+
+    def _run(self, sampler, **kwargs):
+        return ensemble(self.net, sampler=sampler, n_samples=100, chunk_size=10,
+                        reservoir=20, capacities=1., **kwargs)
+
+    def test_resume_is_exact(self):
+        expected = self._run(_Sampler(), seed=5)
+
+        sampler = _Sampler(fail_at=4)
+        assert_raises(RuntimeError, self._run, sampler, seed=5, checkpoint=self.path,
+                      checkpoint_interval=0)
+        assert_equal(int(Checkpoint(self.path, read_header(self.path)).last()['next_chunk']), 3)
+
+        # seed=None reuses the entropy of the checkpoint
+        sampler = _Sampler()
+        resumed = self._run(sampler, checkpoint=self.path)
+        assert_equal(sampler.calls, 7)
+        assert_equal(resumed.count, 100)
+        np.testing.assert_array_equal(resumed.mean, expected.mean)
+        np.testing.assert_array_equal(resumed.reservoir, expected.reservoir)
+        np.testing.assert_array_equal(resumed.exceedances, expected.exceedances)
+
+        # a finished run is not solved again
+        sampler = _Sampler()
+        again = self._run(sampler, checkpoint=self.path)
+        assert_equal(sampler.calls, 0)
+        np.testing.assert_array_equal(again.mean, expected.mean)
+
+    def test_torn_record(self):
+        assert_raises(RuntimeError, self._run, _Sampler(fail_at=6), seed=1,
+                      checkpoint=self.path, checkpoint_interval=0)
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b'FNCK\x00\x01')
+        resumed = self._run(_Sampler(), seed=1, checkpoint=self.path)
+        np.testing.assert_array_equal(resumed.mean, self._run(_Sampler(), seed=1).mean)
+        assert_true(os.path.getsize(self.path) > size)
+
+    def test_other_run(self):
+        self._run(_Sampler(), seed=1, checkpoint=self.path)
+        assert_raises(ValueError, ensemble, self.net, sampler=_Sampler(), n_samples=100,
+                      chunk_size=20, seed=1, checkpoint=self.path)
+
+    def test_compaction(self):
+        ckpt = Checkpoint(self.path, {'run': 1}, max_states=3)
+        for i in range(10):
+            ckpt.append({'i': np.array(i)})
+        assert_equal(int(Checkpoint(self.path, {'run': 1}).last()['i']), 9)
+        assert_true(os.path.getsize(self.path) < 4 * 400)
+        assert_is_none(read_header(os.path.join(self.tmpdir, 'missing')))
+        # without compaction every state is kept
+        path = os.path.join(self.tmpdir, 'all.ckpt')
+        ckpt = Checkpoint(path, {'run': 2}, max_states=None)
+        for i in range(10):
+            ckpt.append({'i': np.array(i)})
+        assert_equal([int(state['i']) for state in Checkpoint(path, {'run': 2}).states()],
+                     list(range(10)))
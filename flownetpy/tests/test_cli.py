@@ -0,0 +1,91 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.batch import solve_batch
+from flownetpy.cli import main, read_scenarios, open_writer
+
+import csv
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import networkx as nx
+
+
+class TestSolve(object):
+    def setup_method(self, method=None):
+        self.tmpdir = tempfile.mkdtemp()
+        self.network = os.path.join(self.tmpdir, 'network')
+        self.net = LinearFlowNetwork(nx.grid_2d_graph(4, 5), np.zeros(20), 1.)
+        self.net.save(self.network)
+        self.compiled = self.net.compile()
+        inputs = np.random.RandomState(0).normal(size=(23, 20))
+        self.inputs = inputs - inputs.mean(axis=1, keepdims=True)
+        self.expected = solve_batch(self.compiled, 'linear', self.inputs)[0]
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.tmpdir)
+
+    setUp = setup_method
+    tearDown = teardown_method
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_npy(self):
+        np.save(self._path('in.npy'), self.inputs)
+        assert_equal(main(['solve', self.network, self._path('in.npy'), self._path('out.npy'),
+                           '--chunk-size', '5', '--quiet']), 0)
+        np.testing.assert_allclose(np.load(self._path('out.npy')), self.expected, atol=1e-12)
+
+    def test_csv_with_header(self):
+        # columns in reverse node order, named like the nodes
+        nodes = self.compiled.nodes
+        with open(self._path('in.csv'), 'w') as f:
+            f.write(','.join('"%s"' % (node,) for node in nodes[::-1]) + '\n')
+            np.savetxt(f, self.inputs[:, ::-1], delimiter=',', fmt='%.17g')
+        main(['solve', self.network, self._path('in.csv'), self._path('out.csv'),
+              '--chunk-size', '4', '--quiet'])
+        with open(self._path('out.csv')) as f:
+            header = next(csv.reader(f))
+        assert_equal(len(header), self.compiled.n_edges)
+        flows = np.loadtxt(self._path('out.csv'), delimiter=',', skiprows=1)
+        np.testing.assert_allclose(flows, self.expected, atol=1e-12)
+
+    def test_csv_without_header(self):
+        np.savetxt(self._path('in.csv'), self.inputs, delimiter=',', fmt='%.17g')
+        chunks = list(read_scenarios(self._path('in.csv'), self.compiled.nodes, 10))
+        assert_equal([chunk.shape[0] for chunk in chunks], [10, 10, 3])
+        np.testing.assert_allclose(np.vstack(chunks), self.inputs)
+
+    def test_workers_keep_order(self):
+        np.save(self._path('in.npy'), self.inputs)
+        main(['solve', self.network, self._path('in.npy'), self._path('out.npy'),
+              '--chunk-size', '3', '--workers', '2', '--quiet'])
+        np.testing.assert_allclose(np.load(self._path('out.npy')), self.expected, atol=1e-12)
+
+    def test_kuramoto_failures_are_nan(self):
+        KuramotoNetwork(nx.path_graph(2), np.zeros(2), 1.).save(self.network + '2')
+        np.save(self._path('in.npy'), np.array([[0.5, -0.5], [2., -2.]]))
+        main(['solve', self.network + '2', self._path('in.npy'), self._path('out.npy'),
+              '--quiet'])
+        flows = np.load(self._path('out.npy'))
+        np.testing.assert_allclose(np.abs(flows[0]), 0.5, atol=1e-6)
+        assert_true(np.all(np.isnan(flows[1])))
+
+    def test_command(self):
+        # a fresh interpreter has not imported the network classes yet
+        np.save(self._path('in.npy'), self.inputs)
+        out = subprocess.check_output(
+            [sys.executable, '-m', 'flownetpy.cli', 'solve', self.network,
+             self._path('in.npy'), self._path('out.npy')], stderr=subprocess.STDOUT)
+        assert_in(b'23 scenarios solved', out)
+        np.testing.assert_allclose(np.load(self._path('out.npy')), self.expected, atol=1e-12)
+
+    def test_bad_inputs(self):
+        np.save(self._path('in.npy'), self.inputs[:, :3])
+        assert_raises(ValueError, main, ['solve', self.network, self._path('in.npy'),
+                                         self._path('out.npy'), '--quiet'])
+        assert_raises(ValueError, open_writer, self._path('out.txt'), self.compiled)
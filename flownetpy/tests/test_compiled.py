@@ -0,0 +1,153 @@
+from hypothesis import given, settings
+import hypothesis.strategies as st
+
+from nose.tools import *
+
+from flownetpy.compiled import CompiledNetwork
+from flownetpy.flowmodel import kuramoto
+from flownetpy.kuramotonetwork import (KuramotoRHS, KuramotoJacobian,
+                                       _kuramoto_ode)
+
+import numpy as np
+import networkx as nx
+
+
+def _random_network(size, seed):
+    rng = np.random.RandomState(seed)
+    G = nx.connected_watts_strogatz_graph(size, 4, 0.3, seed=seed)
+    for u, v in G.edges():
+        G[u][v]['weight'] = rng.uniform(0.5, 2)
+    inputs = rng.normal(size=size)
+    for node, inpt in zip(G.nodes(), inputs - inputs.mean()):
+        G.add_node(node, input=inpt)
+    return G
+
+
+class TestCompiledNetwork:
+    @settings(max_examples=10, deadline=None)
+    @given(size=st.integers(min_value=5, max_value=40), seed=st.integers(0, 1000))
+    def test_incidence(self, size, seed):
+        G = _random_network(size, seed)
+        compiled = CompiledNetwork.from_graph(G)
+        assert(np.allclose(compiled.incidence().toarray(),
+                           nx.incidence_matrix(G, oriented=True).toarray()))
+        assert(np.allclose(compiled.incidence(weighted=True).toarray(),
+                           nx.incidence_matrix(G, oriented=True, weight='weight').toarray()))
+        assert_equal(compiled.edges(), list(G.edges()))
+
+    def test_flow_dict(self):
+        G = _random_network(10, 0)
+        compiled = CompiledNetwork.from_graph(G)
+        flows = compiled.flow_dict(np.arange(compiled.n_edges))
+        u, v = compiled.edges()[3]
+        assert_equal(flows[(u, v)], 3)
+        assert_equal(flows[(v, u)], -3)
+
+    @raises(ValueError)
+    def test_input_size(self):
+        CompiledNetwork([0, 1], [0], [1], [1.], [1., -1., 0.])
+
+
+class TestKuramotoRHS:
+    def setup_network(self, size=20, seed=0):
+        G = _random_network(size, seed)
+        compiled = CompiledNetwork.from_graph(G)
+        M = nx.incidence_matrix(G, oriented=True).toarray()
+        Mw = nx.incidence_matrix(G, oriented=True, weight='weight').toarray()
+        return compiled, M, Mw
+
+    @settings(max_examples=20, deadline=None)
+    # dense products below KuramotoRHS.DENSE_NODES, sparse kernels above
+    @given(seed=st.integers(0, 1000), size=st.sampled_from([20, 60]))
+    def test_single_state(self, seed, size):
+        compiled, M, Mw = self.setup_network(size=size, seed=seed)
+        th = np.random.RandomState(seed).uniform(-np.pi, np.pi, compiled.n_nodes)
+        rhs = KuramotoRHS(compiled)
+        expected = _kuramoto_ode(0, th, M, Mw, compiled.inputs)
+        assert(np.allclose(rhs(0, th), expected))
+        # the work buffers are reused on the next call
+        assert(np.allclose(rhs(0, th), expected))
+        assert_equal(rhs.nfev, 2)
+        # an output that the kernels cannot write into
+        out = np.zeros((compiled.n_nodes, 2))
+        rhs(0, th, out=out[:, 1])
+        assert(np.allclose(out[:, 1], expected))
+
+    def test_batch(self):
+        for size in (20, 60):
+            compiled, M, Mw = self.setup_network(size=size)
+            ths = np.random.RandomState(1).uniform(-np.pi, np.pi, (compiled.n_nodes, 5))
+            res = KuramotoRHS(compiled)(0, ths)
+            for k in range(5):
+                assert(np.allclose(res[:, k],
+                                   _kuramoto_ode(0, ths[:, k], M, Mw, compiled.inputs)))
+
+    def test_kernel_fallback(self):
+        # the products of the public API if the private kernels are broken
+        class Raising(object):
+            def csr_matvec(self, *args):
+                raise TypeError('csr_matvec() takes 8 arguments')
+            csr_matvecs = csr_matvec
+
+        class Ignoring(object):
+            def csr_matvec(self, *args):
+                pass
+            csr_matvecs = csr_matvec
+
+        compiled, M, Mw = self.setup_network(size=60)
+        ths = np.random.RandomState(4).uniform(-np.pi, np.pi, (compiled.n_nodes, 3))
+        original = kuramoto._csr_kernels
+        try:
+            for kernels in (Raising(), Ignoring(), None):
+                kuramoto._csr_kernels = lambda: kernels
+                rhs = KuramotoRHS(compiled)
+                res = rhs(0, ths)
+                assert_is(rhs._scatter, None)
+                for k in range(3):
+                    expected = _kuramoto_ode(0, ths[:, k], M, Mw, compiled.inputs)
+                    assert(np.allclose(res[:, k], expected))
+                    assert(np.allclose(rhs(0, ths[:, k]), expected))
+        finally:
+            kuramoto._csr_kernels = original
+        assert_is_not(KuramotoRHS(compiled)._csr_scatter(), None)
+
+    def test_reuse_output(self):
+        compiled, M, Mw = self.setup_network()
+        rhs = KuramotoRHS(compiled, reuse_output=True)
+        th = np.zeros(compiled.n_nodes)
+        assert_is(rhs(0, th), rhs(0, th + 1))
+
+    def test_jacobian(self):
+        compiled, M, Mw = self.setup_network()
+        th = np.random.RandomState(2).uniform(-np.pi, np.pi, compiled.n_nodes)
+        expected = -np.dot(Mw, np.dot(np.diag(np.cos(np.dot(M.T, th))), M.T))
+        assert(np.allclose(KuramotoJacobian(compiled)(0, th).toarray(), expected))
+        assert(np.allclose(KuramotoJacobian(compiled, dense=True)(0, th), expected))
+
+    def test_batch_jacobian(self):
+        compiled, M, Mw = self.setup_network()
+        n, k = compiled.n_nodes, 3
+        ths = np.random.RandomState(3).uniform(-np.pi, np.pi, (n, k))
+        jac = KuramotoJacobian(compiled)(0, ths.ravel()).toarray()
+        for c in range(k):
+            expected = -np.dot(Mw, np.dot(np.diag(np.cos(np.dot(M.T, ths[:, c]))), M.T))
+            assert(np.allclose(jac[c::k, c::k], expected))
+        assert(np.allclose(jac[0::k, 1::k], 0))
+
+
+class TestCycleBasis:
+    @settings(max_examples=10, deadline=None)
+    @given(size=st.integers(min_value=5, max_value=40), seed=st.integers(0, 1000))
+    def test_cycles_are_closed_paths(self, size, seed):
+        G = _random_network(size, seed)
+        G.add_edge(size, size + 1)  # a second component
+        G.add_node(size, input=0)
+        G.add_node(size + 1, input=0)
+        compiled = CompiledNetwork.from_graph(G)
+        cycles = compiled.cycle_basis()
+        assert_equal(len(cycles), len(nx.cycle_basis(G)))
+        for cycle in cycles:
+            labels = [compiled.nodes[idx] for idx in cycle]
+            assert_equal(len(set(labels)), len(labels))
+            for u, v in zip(labels, labels[1:] + labels[:1]):
+                assert(G.has_edge(u, v))
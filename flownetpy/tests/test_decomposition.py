@@ -0,0 +1,91 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.decomposition import DomainDecomposition, partition
+from flownetpy.kuramotonetwork import KuramotoRHS
+from flownetpy.laplacian import LaplacianSolver
+from flownetpy.multilevel import newton
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _grid_network(n, seed, cls=LinearFlowNetwork, low=0.5, high=2.):
+    rng = np.random.RandomState(seed)
+    graph = nx.grid_2d_graph(n, n)
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = rng.uniform(low, high)
+    inputs = rng.normal(size=n * n)
+    return cls(graph, inputs - inputs.mean(), 'weight')
+
+
+def test_partition():
+    compiled = _grid_network(20, 0).compile()
+    parts = partition(compiled, 4)
+    assert_equal(np.bincount(parts).tolist(), [100] * 4)
+    # a mesh is cut along fronts, a random split cuts half of the edges
+    cut = np.count_nonzero(parts[compiled.head] != parts[compiled.tail])
+    assert_less(cut, 0.15 * compiled.n_edges)
+    assert_equal(sorted(np.bincount(partition(compiled, 3))), [133, 133, 134])
+    assert_true(np.all(partition(compiled, 1) == 0))
+    assert_raises(ValueError, partition, compiled, 0)
+
+
+@settings(deadline=None, max_examples=10, derandomize=True)
+@given(integers(min_value=0, max_value=1000), integers(min_value=1, max_value=6))
+def test_linear(seed, n_parts):
+    compiled = _grid_network(12, seed).compile()
+    b = np.random.RandomState(seed).normal(size=(compiled.n_nodes, 2))
+    expected = LaplacianSolver(compiled.laplacian()).solve(b)
+    with DomainDecomposition(compiled, n_parts=n_parts, workers=1) as dd:
+        np.testing.assert_allclose(dd.solve(b), expected, atol=1e-10)
+
+
+def test_workers():
+    net = _grid_network(16, 1)
+    expected = net.steady_flows()
+    with DomainDecomposition(net, n_parts=3, workers=2) as dd:
+        flows, data = net.steady_flows(extra_output=True, decomposition=dd)
+        assert_less(data['stats'].residual, 1e-10)
+        for edge, flow in expected.items():
+            assert_almost_equal(flows[edge], flow)
+        # the Kuramoto Newton steps refactorize the subdomains
+        thetas, stable = dd.kuramoto_phases(np.zeros(dd.n))
+        assert_true(stable)
+        np.testing.assert_allclose(thetas, 0, atol=1e-12)
+        np.testing.assert_allclose(dd.pressures(), data['pressures'], atol=1e-10)
+    other = _grid_network(15, 1)
+    with DomainDecomposition(other, n_parts=2, workers=1) as dd:
+        assert_raises(ValueError, net.steady_flows, decomposition=dd)
+
+
+def test_disconnected():
+    graph = nx.disjoint_union(nx.grid_2d_graph(5, 5), nx.cycle_graph(7))
+    graph.add_node('alone')
+    inputs = np.random.RandomState(3).normal(size=graph.number_of_nodes())
+    compiled = LinearFlowNetwork(graph, inputs, 1.).compile()
+    with DomainDecomposition(compiled, n_parts=4, workers=1) as dd:
+        assert_equal(dd.n_components, 3)
+        np.testing.assert_allclose(dd.pressures(),
+                                   LaplacianSolver(compiled.laplacian()).solve(inputs),
+                                   atol=1e-10)
+
+
+@settings(deadline=None, max_examples=5, derandomize=True)
+@given(integers(min_value=0, max_value=1000), integers(min_value=1, max_value=6))
+def test_kuramoto(seed, n_parts):
+    net = _grid_network(12, seed, KuramotoNetwork, 3., 6.)
+    compiled = net.compile()
+    with DomainDecomposition(compiled, n_parts=n_parts, workers=1) as dd:
+        thetas, stable = dd.kuramoto_phases()
+        assert_true(stable)
+        assert_less(np.abs(KuramotoRHS(compiled)(0, thetas)).max(), 1e-9)
+        flows, data = net.steady_flows(extra_output=True, decomposition=dd)
+    assert_equal(data['stats'].nfev, 0)
+    # Newton's method on the whole network reaches the same fixed point
+    expected, _ = newton(compiled, LaplacianSolver(compiled.laplacian()).solve(compiled.inputs))
+    np.testing.assert_allclose(thetas - thetas.mean(), expected - expected.mean(), atol=1e-8)
+    np.testing.assert_allclose(data['thetas'], thetas)
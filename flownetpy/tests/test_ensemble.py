@@ -0,0 +1,93 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.ensemble import ensemble, FlowStatistics
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _sampler(rng, size):
+    inputs = rng.normal(size=(size, 16))
+    return inputs - inputs.mean(axis=1, keepdims=True)
+
+
+def _grid(cls):
+    return cls(nx.grid_2d_graph(4, 4), np.zeros(16), 3.)
+
+
+def _brute_force(net, inputs):
+    compiled = net.compile()
+    return np.array([compiled.flow_array(type(net)(nx.grid_2d_graph(4, 4), p, 3.).steady_flows())
+                     for p in inputs])
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=1, max_value=50), integers(min_value=1, max_value=50),
+       integers(min_value=1, max_value=30))
+def test_merge_matches_single_pass(n, m, reservoir):
+    rng = np.random.RandomState(n * 100 + m)
+    flows = rng.normal(size=(n + m, 3))
+    merged = FlowStatistics(3, capacities=1., reservoir=reservoir).update(flows[:n])
+    merged.merge(FlowStatistics(3, capacities=1., reservoir=reservoir).update(flows[n:]))
+    assert_equal(merged.count, n + m)
+    np.testing.assert_allclose(merged.mean, flows.mean(axis=0))
+    np.testing.assert_allclose(merged.variance, flows.var(axis=0, ddof=1) if n + m > 1 else 0,
+                               atol=1e-12)
+    np.testing.assert_allclose(merged.max, flows.max(axis=0))
+    np.testing.assert_allclose(merged.exceedance_probability(),
+                               (np.abs(flows) > 1).mean(axis=0))
+    assert_equal(len(merged.reservoir), min(reservoir, n + m))
+    # the reservoir holds distinct samples of the data
+    rows = set(map(tuple, flows))
+    assert_true(all(tuple(row) in rows for row in merged.reservoir))
+    assert_equal(len(set(map(tuple, merged.reservoir))), len(merged.reservoir))
+
+
+def test_linear_matches_brute_force():
+    net = _grid(LinearFlowNetwork)
+    inputs = _sampler(np.random.default_rng(0), 200)
+    stats = ensemble(net, inputs=inputs, chunk_size=30, capacities=1., reservoir=500)
+    flows = _brute_force(net, inputs)
+    np.testing.assert_allclose(stats.mean, flows.mean(axis=0), atol=1e-12)
+    np.testing.assert_allclose(stats.std, flows.std(axis=0, ddof=1), atol=1e-12)
+    np.testing.assert_allclose(stats.min, flows.min(axis=0), atol=1e-12)
+    # the reservoir is larger than the ensemble: the quantiles are exact
+    np.testing.assert_allclose(stats.quantiles([0.1, 0.9]),
+                               np.quantile(flows, [0.1, 0.9], axis=0), atol=1e-12)
+    np.testing.assert_allclose(stats.exceedance_probability(), (np.abs(flows) > 1).mean(axis=0))
+
+
+def test_workers_do_not_change_the_result():
+    net = _grid(LinearFlowNetwork)
+    serial = ensemble(net, sampler=_sampler, n_samples=500, seed=3, chunk_size=50,
+                      reservoir=100)
+    parallel = ensemble(net, sampler=_sampler, n_samples=500, seed=3, chunk_size=50,
+                        reservoir=100, workers=3)
+    np.testing.assert_array_equal(serial.mean, parallel.mean)
+    np.testing.assert_array_equal(serial.reservoir, parallel.reservoir)
+
+    inputs = _sampler(np.random.default_rng(1), 100)
+    shared = ensemble(net, inputs=inputs, chunk_size=10, workers=2)
+    np.testing.assert_allclose(shared.mean, _brute_force(net, inputs).mean(axis=0), atol=1e-12)
+
+
+def test_kuramoto():
+    net = _grid(KuramotoNetwork)
+    inputs = 0.3 * _sampler(np.random.default_rng(2), 6)
+    stats = ensemble(net, inputs=inputs, chunk_size=3)
+    assert_equal((stats.count, stats.failures), (6, 0))
+    np.testing.assert_allclose(stats.mean, _brute_force(net, inputs).mean(axis=0), atol=1e-5)
+
+
+def test_arguments():
+    net = _grid(LinearFlowNetwork)
+    assert_raises(ValueError, ensemble, net)
+    assert_raises(ValueError, ensemble, net, sampler=_sampler)
+    assert_raises(ValueError, ensemble, net, inputs=np.zeros((3, 5)))
+    assert_raises(ValueError, ensemble, net, sampler=lambda rng, size: np.zeros((size, 3)),
+                  n_samples=4)
+    assert_raises(ValueError, ensemble(net, inputs=np.zeros((2, 16))).exceedance_probability)
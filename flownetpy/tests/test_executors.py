@@ -0,0 +1,170 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.executors import (SerialExecutor, LocalExecutor, DistributedExecutor,
+                                 ShardError, sweep, outages, read_authkey, AUTHKEY_ENV)
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import networkx as nx
+
+
+def _square(context, shard):
+    return context * shard ** 2
+
+
+def _fails_once(directory, shard):
+    marker = os.path.join(directory, str(shard))
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        raise RuntimeError("first attempt of %d" % shard)
+    return shard
+
+
+def _always_fails(context, shard):
+    raise RuntimeError("shard %d" % shard)
+
+
+def _straggler(directory, shard):
+    # the first run of shard 0 hangs; a copy run elsewhere finishes it
+    if shard == 0:
+        try:
+            os.mkdir(os.path.join(directory, 'hung'))
+            time.sleep(60)
+        except OSError:
+            pass
+    time.sleep(0.05)
+    return shard
+
+
+class _Preempted(SerialExecutor):
+    """
+    A SerialExecutor that records the shards it is given and stops after
+    `fail_at` results
+    """
+
+    def __init__(self, fail_at=None):
+        self.shards = []
+        self.fail_at = fail_at
+
+    def imap(self, func, shards, **kwargs):
+        self.shards.extend(shards)
+        for index, result in enumerate(SerialExecutor.imap(self, func, shards, **kwargs)):
+            if index == self.fail_at:
+                raise RuntimeError("preempted")
+            yield result
+
+
+class TestExecutors:
+    def setup_method(self, method=None):
+        self.directory = tempfile.mkdtemp()
+        self.executor = LocalExecutor(2)
+
+    def teardown_method(self, method=None):
+        self.executor.close()
+        shutil.rmtree(self.directory)
+
+    setUp = setup_method
+    tearDown = teardown_method
+
+    def test_map(self):
+        shards = list(range(20))
+        assert_equal(self.executor.map(_square, shards, context=3),
+                     SerialExecutor().map(_square, shards, context=3))
+        # the executor serves several batches
+        assert_equal(self.executor.map(_square, [], context=3), [])
+        assert_equal(self.executor.map(_square, [4], context=2), [32])
+
+    def test_retries(self):
+        # without speculation no stolen copy overtakes a failed shard
+        with LocalExecutor(2, speculative=False) as executor:
+            assert_equal(executor.map(_fails_once, range(5), context=self.directory),
+                         list(range(5)))
+            assert_true(executor.scheduler.retried >= 5)
+        assert_raises(ShardError, self.executor.map, _always_fails, range(3), retries=1)
+        assert_raises(ShardError, SerialExecutor().map, _always_fails, range(3))
+
+    def test_stragglers_are_stolen(self):
+        start = time.time()
+        results = self.executor.map(_straggler, range(10), context=self.directory)
+        assert_equal(results, list(range(10)))
+        assert_true(time.time() - start < 30)
+        assert_true(self.executor.scheduler.stolen >= 1)
+
+    def test_sweep(self):
+        net = LinearFlowNetwork(nx.grid_2d_graph(3, 3), np.arange(9.) - 4, 2.)
+        scenarios = outages(net)
+        compiled = net.compile()
+        flows = sweep(net, scenarios, executor=self.executor, shard_size=4)
+        assert_equal(len(flows), compiled.n_edges)
+        for edge, (scenario, flow) in enumerate(zip(scenarios, flows)):
+            graph = nx.grid_2d_graph(3, 3)
+            graph.remove_edge(*compiled.edges()[edge])
+            expected = LinearFlowNetwork(graph, np.arange(9.) - 4, 2.).steady_flows()
+            assert_equal(flow[edge], 0)
+            for other, (u, v) in enumerate(compiled.edges()):
+                if other != edge:
+                    expected_flow = expected[(u, v)] if (u, v) in expected else -expected[(v, u)]
+                    assert_almost_equal(flow[other], expected_flow)
+
+
+def test_listens_on_localhost():
+    executor = DistributedExecutor()
+    try:
+        assert_equal(executor.address[0], '127.0.0.1')
+    finally:
+        executor.close()
+
+
+def test_read_authkey():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'key')
+        with open(path, 'w') as f:
+            f.write('secret\n')
+        assert_equal(read_authkey(path, environ={AUTHKEY_ENV: 'other'}), b'secret')
+        assert_equal(read_authkey(environ={AUTHKEY_ENV: 'other'}), b'other')
+        assert_is_none(read_authkey(environ={}))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_kuramoto_sweep():
+    net = KuramotoNetwork(nx.cycle_graph(5), np.array([1., -1, 0.5, -0.5, 0]), 3.)
+    inputs = [{'inputs': s * net.compile().inputs} for s in (1., 10.)]
+    flows = sweep(net, inputs)
+    np.testing.assert_allclose(flows[0], net.compile().flow_array(net.steady_flows()),
+                               atol=1e-6)
+    assert_true(flows[1] is None)
+
+
+def test_sweep_resumes_from_checkpoint():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'sweep.ckpt')
+        net = KuramotoNetwork(nx.cycle_graph(5), np.array([1., -1, 0.5, -0.5, 0]), 3.)
+        scenarios = [{'inputs': s * net.compile().inputs} for s in (1., 10., 0.5, 2., 0.1)]
+        expected = sweep(net, scenarios, shard_size=2)
+
+        assert_raises(RuntimeError, sweep, net, scenarios, executor=_Preempted(fail_at=2),
+                      shard_size=2, checkpoint=path)
+        executor = _Preempted()
+        resumed = sweep(net, scenarios, executor=executor, shard_size=2, checkpoint=path)
+        # only the last shard is solved again
+        assert_equal(len(executor.shards), 1)
+        for flows, expected_flows in zip(resumed, expected):
+            if expected_flows is None:
+                assert_is_none(flows)
+            else:
+                np.testing.assert_allclose(flows, expected_flows, atol=1e-6)
+
+        executor = _Preempted()
+        sweep(net, scenarios, executor=executor, shard_size=2, checkpoint=path)
+        assert_equal(executor.shards, [])
+        assert_raises(ValueError, sweep, net, scenarios[:4], shard_size=2, checkpoint=path)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,113 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.flowmodel import incidence_matrix, endpoints, cycle_basis
+from flownetpy.flowmodel import kuramoto, linear
+from flownetpy.kuramotonetwork import KuramotoRHS
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _random_arrays(n, m, seed):
+    rng = np.random.RandomState(seed)
+    edges = np.array(nx.gnm_random_graph(n, m, seed=seed).edges(), dtype=np.intp).reshape(-1, 2)
+    weights = rng.uniform(0.5, 2, edges.shape[0])
+    inputs = rng.normal(size=n)
+    return edges[:, 0], edges[:, 1], weights, inputs - inputs.mean()
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=2, max_value=20), integers(min_value=0, max_value=1000))
+def test_endpoints(n, seed):
+    head, tail, weights, _ = _random_arrays(n, 2 * n, seed)
+    found_head, found_tail = endpoints(incidence_matrix(head, tail, n))
+    assert_true(np.array_equal(found_head, head))
+    assert_true(np.array_equal(found_tail, tail))
+
+
+def test_endpoints_need_oriented_incidence():
+    import scipy.sparse as sp
+
+    assert_raises(ValueError, endpoints, sp.csr_matrix(np.array([[1.], [1.]])))
+    # a self-loop has no entries in the incidence matrix
+    assert_raises(ValueError, endpoints, incidence_matrix(np.array([0]), np.array([0]), 2))
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=2, max_value=20), integers(min_value=0, max_value=1000))
+def test_linear_steady_state(n, seed):
+    head, tail, weights, inputs = _random_arrays(n, 2 * n, seed)
+    B = incidence_matrix(head, tail, n)
+    out = np.empty(head.size)
+    flows, pressures = linear.steady_state(B, weights, inputs, out=out)
+    assert_true(flows is out)
+
+    net = LinearFlowNetwork.from_arrays(np.column_stack([head, tail]), weights, inputs)
+    expected = net.compile().flow_array(net.steady_flows())
+    np.testing.assert_allclose(flows, expected, atol=1e-10)
+    # every connected component is balanced
+    labels = nx.connected_components(nx.Graph(list(zip(head, tail))))
+    residual = linear.residual(B, inputs, flows)
+    for component in labels:
+        component = list(component)
+        np.testing.assert_allclose(residual[component], residual[component].mean(), atol=1e-10)
+
+
+def test_batched_linear_flows():
+    head, tail, weights, _ = _random_arrays(30, 60, 3)
+    B = incidence_matrix(head, tail, 30)
+    inputs = np.random.RandomState(1).normal(size=(30, 4))
+    solver = linear.laplacian_solver(B, weights)
+    flows, pressures = linear.steady_state(B, weights, inputs - inputs.mean(axis=0), solver)
+    for k in range(4):
+        single = linear.steady_state(B, weights, inputs[:, k] - inputs[:, k].mean(), solver)[0]
+        np.testing.assert_allclose(flows[:, k], single, atol=1e-10)
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=2, max_value=20), integers(min_value=0, max_value=1000))
+def test_kuramoto_rhs(n, seed):
+    head, tail, weights, inputs = _random_arrays(n, 2 * n, seed)
+    net = KuramotoNetwork.from_arrays(np.column_stack([head, tail]), weights, inputs)
+    compiled = net.compile()
+    B = compiled.incidence()
+    thetas = np.random.RandomState(seed).uniform(-np.pi, np.pi, size=(n, 3))
+    expected = KuramotoRHS(compiled)(0, thetas)
+    np.testing.assert_allclose(kuramoto.rhs(thetas, B, compiled.weights, compiled.inputs),
+                               expected, atol=1e-12)
+    out = np.empty(n)
+    assert_true(kuramoto.rhs(thetas[:, 0], B, compiled.weights, compiled.inputs,
+                             out=out) is out)
+    np.testing.assert_allclose(out, expected[:, 0], atol=1e-12)
+
+
+def test_kuramoto_steady_state():
+    graph = nx.cycle_graph(6)
+    inputs = np.array([1., -1., 1., -1., 1., -1.]) * 0.5
+    net = KuramotoNetwork(graph, inputs, 2.)
+    compiled = net.compile()
+    initguess = np.zeros(6)
+    expected, data = net.steady_flows(initguess=initguess, extra_output=True)
+
+    flows, thetas = kuramoto.steady_state(compiled.incidence(), compiled.weights,
+                                          compiled.inputs, initguess=initguess)
+    np.testing.assert_allclose(flows, compiled.flow_array(expected), atol=1e-10)
+    np.testing.assert_allclose(thetas, data['thetas'], atol=1e-10)
+    np.testing.assert_allclose(kuramoto.rhs(thetas, compiled.incidence(), compiled.weights,
+                                            compiled.inputs), 0, atol=1e-5)
+    cycles = cycle_basis(compiled.incidence())
+    assert_equal(len(cycles), 1)
+    np.testing.assert_allclose(kuramoto.winding_numbers(cycles, thetas), data['omega'],
+                               atol=1e-10)
+
+
+def test_kuramoto_without_steady_state():
+    B = incidence_matrix(np.array([0]), np.array([1]), 2)
+    flows, thetas = kuramoto.steady_state(B, np.ones(1), np.array([2., -2.]),
+                                          initguess=np.zeros(2))
+    assert_is_none(flows)
+    assert_is_none(thetas)
@@ -0,0 +1,94 @@
+from hypothesis import given, settings
+import hypothesis.strategies as st
+
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+
+import pickle
+import numpy as np
+import networkx as nx
+
+
+def _weighted_grid(rows, cols, seed=0):
+    rng = np.random.RandomState(seed)
+    G = nx.grid_2d_graph(rows, cols)
+    for u, v in G.edges():
+        G[u][v]['weight'] = rng.uniform(0.5, 2)
+    inputs = rng.normal(size=G.number_of_nodes())
+    return G, inputs - inputs.mean()
+
+
+def _as_arrays(G):
+    nodes = list(G.nodes())
+    index = {node: idx for idx, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges()])
+    weights = np.array([dat['weight'] for u, v, dat in G.edges(data=True)])
+    return nodes, edges, weights
+
+
+class TestArrayConstructors:
+    @settings(max_examples=10, deadline=None)
+    @given(rows=st.integers(2, 6), cols=st.integers(2, 6), seed=st.integers(0, 1000))
+    def test_from_arrays_matches_graph(self, rows, cols, seed):
+        G, inputs = _weighted_grid(rows, cols, seed)
+        nodes, edges, weights = _as_arrays(G)
+        from_graph = LinearFlowNetwork(G, inputs, weight='weight').steady_flows()
+        from_arrays = LinearFlowNetwork.from_arrays(edges, weights, inputs,
+                                                    nodes=nodes).steady_flows()
+        assert(np.allclose([from_graph[e] - from_arrays[e] for e in G.edges()], 0))
+
+    def test_from_scipy_sparse(self):
+        G, inputs = _weighted_grid(4, 5)
+        nodes = list(G.nodes())
+        adjacency = nx.to_scipy_sparse_array(G, nodelist=nodes)
+        net = LinearFlowNetwork.from_scipy_sparse(adjacency, inputs, nodes=nodes)
+        expected = LinearFlowNetwork(G, inputs, weight='weight').steady_flows()
+        flows = net.steady_flows()
+        assert(np.allclose([expected[e] - flows[e] for e in G.edges()], 0))
+
+    def test_lazy_view(self):
+        G, inputs = _weighted_grid(3, 3)
+        nodes, edges, weights = _as_arrays(G)
+        net = LinearFlowNetwork.from_arrays(edges, weights, inputs, nodes=nodes)
+        net.steady_flows()
+        assert_equal(net.number_of_nodes(), 9)
+        assert_equal(net.number_of_edges(), 12)
+        assert_is_not_none(net._compiled)
+
+        # touching the graph builds it and makes it authoritative
+        assert_almost_equal(net[(0, 0)][(0, 1)]['weight'], G[(0, 0)][(0, 1)]['weight'])
+        assert_is_none(net._compiled)
+        assert_equal(sorted(net.nodes()), sorted(G.nodes()))
+        assert_almost_equal(net.nodes[(1, 1)]['input'], inputs[nodes.index((1, 1))])
+
+    def test_pickle_keeps_compiled_form(self):
+        ring = np.column_stack([np.arange(10), (np.arange(10) + 1) % 10])
+        net = KuramotoNetwork.from_arrays(ring, 5., np.tile([1., -1.], 5))
+        net.compile().laplacian_solver()
+        clone = pickle.loads(pickle.dumps(net))
+        assert_is_not_none(clone._compiled)
+        flows = clone.steady_flows(initguess=np.zeros(10))
+        assert(np.allclose(np.abs(list(flows.values())), 0.5, atol=1e-6))
+
+    @raises(ValueError)
+    def test_bad_endpoints(self):
+        LinearFlowNetwork.from_arrays([[0, 3]], 1., [1., -1.])
+
+
+class TestLinearSolver:
+    def test_unbalanced_inputs_match_pinv(self):
+        G, inputs = _weighted_grid(4, 4)
+        inputs = inputs + 0.3
+        nodes, edges, weights = _as_arrays(G)
+        L = nx.laplacian_matrix(G, nodelist=nodes).toarray()
+        pressures = np.dot(np.linalg.pinv(L), inputs)
+        expected = (pressures[edges[:, 0]] - pressures[edges[:, 1]]) * weights
+        flows = LinearFlowNetwork.from_arrays(edges, weights, inputs, nodes=nodes).steady_flows()
+        assert(np.allclose([flows[(nodes[u], nodes[v])] for u, v in edges], expected))
+
+    def test_disconnected(self):
+        edges = [[0, 1], [2, 3]]
+        flows = LinearFlowNetwork.from_arrays(edges, 2., [1., -1., 2., -2.]).steady_flows()
+        assert_almost_equal(flows[(0, 1)], 1)
+        assert_almost_equal(flows[(2, 3)], 2)
@@ -0,0 +1,68 @@
+from nose.tools import *
+
+import json
+import subprocess
+import sys
+
+import flownetpy
+
+
+def _imported_after(statement, setup='pass'):
+    """
+    Runs `setup` and then `statement` in a fresh interpreter and returns the
+    modules that `statement` imported
+    """
+    code = ('import sys; %s; before = set(sys.modules); %s; '
+            'import json; print(json.dumps(sorted(set(sys.modules) - before)))' %
+            (setup, statement))
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return set(json.loads(out.decode('utf8').strip().splitlines()[-1]))
+
+
+def _top_level(modules):
+    return set(name.split('.')[0] for name in modules)
+
+
+def test_import_package_is_light():
+    imported = _top_level(_imported_after('import flownetpy'))
+    for heavy in ('networkx', 'scipy', 'numpy'):
+        assert_not_in(heavy, imported)
+
+
+def test_network_classes_defer_scipy():
+    for name in ('LinearFlowNetwork', 'FlowNetwork'):
+        imported = _imported_after('from flownetpy import %s' % name)
+        assert_in('networkx', imported)
+        assert_not_in('scipy', _top_level(imported))
+
+
+def test_kuramoto_imports_scipy_up_front():
+    # the first solve must not pay for importing scipy
+    imported = _imported_after(
+        'KuramotoNetwork.from_arrays(np.array([[0, 1]]), 2., [1., -1.]).steady_flows()',
+        setup='from flownetpy import KuramotoNetwork; import numpy as np')
+    assert_equal([name for name in imported if name.startswith('scipy.')
+                  and name.count('.') == 1], [])
+
+
+def test_solving_imports_scipy():
+    imported = _imported_after(
+        'from flownetpy import LinearFlowNetwork; import numpy as np; '
+        'LinearFlowNetwork.from_arrays(np.array([[0, 1]]), 1., [1., -1.]).steady_flows()')
+    assert_in('scipy.sparse.linalg', imported)
+    assert_not_in('scipy.integrate', imported)
+
+
+def test_lazy_attributes():
+    from flownetpy.kuramotonetwork import KuramotoNetwork
+    assert_is(flownetpy.KuramotoNetwork, KuramotoNetwork)
+    assert_in('LinearFlowNetwork', dir(flownetpy))
+    assert_raises(AttributeError, getattr, flownetpy, 'NoSuchNetwork')
+
+
+def test_flowmodel_is_networkx_free():
+    imported = _top_level(_imported_after(
+        'import flownetpy.flowmodel.linear, flownetpy.flowmodel.kuramoto'))
+    assert_in('numpy', imported)
+    assert_not_in('networkx', imported)
+    assert_not_in('scipy', imported)
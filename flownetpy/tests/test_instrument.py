@@ -0,0 +1,78 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.cache import SolutionCache
+from flownetpy.instrument import Hook, add_hook, remove_hook, start_stats
+
+import numpy as np
+
+
+def _ring(size, inputs, cls=KuramotoNetwork, weight=10.):
+    edges = np.column_stack([np.arange(size), (np.arange(size) + 1) % size])
+    return cls.from_arrays(edges, weight, inputs)
+
+
+class _Recorder(Hook):
+    def __init__(self):
+        self.phases = []
+        self.solves = []
+
+    def on_phase(self, stats, phase, seconds):
+        self.phases.append((phase, seconds))
+
+    def on_solve(self, stats):
+        self.solves.append(stats)
+
+
+class TestInstrumentation:
+    def setup_method(self, method=None):
+        self.hook = add_hook(_Recorder())
+
+    def teardown_method(self, method=None):
+        remove_hook(self.hook)
+
+    setUp = setup_method
+    tearDown = teardown_method
+
+    def test_kuramoto_stats(self):
+        inputs = np.tile([1., -1.], 4)
+        flows, data = _ring(8, inputs).steady_flows(extra_output=True,
+                                                    initguess=np.zeros(8))
+        stats = data['stats']
+        assert_true(stats.converged)
+        assert_false(stats.cached)
+        assert_equal((stats.n_nodes, stats.n_edges, stats.attempts), (8, 8, 1))
+        assert_true(stats.nfev > 0)
+        assert_true(stats.residual < 1e-4)
+        for name in ('compile', 'integrate', 'flows', 'cycle_basis', 'winding'):
+            assert_in(name, stats.timings)
+        assert_equal(self.hook.solves, [stats])
+        assert_equal(set(name for name, _ in self.hook.phases), set(stats.timings))
+
+    def test_linear_stats(self):
+        inputs = np.tile([1., -1.], 4)
+        flows, data = _ring(8, inputs, LinearFlowNetwork).steady_flows(extra_output=True)
+        stats = data['stats']
+        assert_equal(stats.model, 'linear')
+        assert_true(stats.residual < 1e-10)
+        assert_in('time_solve', stats.as_dict())
+        np.testing.assert_allclose(flows[(0, 1)],
+                                   10 * (data['pressures'][0] - data['pressures'][1]))
+
+    def test_cached(self):
+        cache = SolutionCache()
+        inputs = np.tile([1., -1.], 4)
+        _ring(8, inputs, LinearFlowNetwork).steady_flows(cache=cache)
+        _, data = _ring(8, inputs, LinearFlowNetwork).steady_flows(cache=cache,
+                                                                   extra_output=True)
+        assert_true(data['stats'].cached)
+        assert_equal(data['stats'].attempts, 0)
+        assert_equal(len(self.hook.solves), 2)
+
+    def test_disabled(self):
+        remove_hook(self.hook)
+        try:
+            assert_is_none(start_stats('linear'))
+            assert_is_not_none(start_stats('linear', wanted=True))
+        finally:
+            add_hook(self.hook)
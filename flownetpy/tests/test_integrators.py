@@ -0,0 +1,79 @@
+from hypothesis import given, settings
+import hypothesis.strategies as st
+
+from nose.tools import *
+
+from flownetpy.integrators import get_integrator, INTEGRATORS, Integrator
+from flownetpy.kuramotonetwork import _kuramoto_ode, odeint
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def _decay(t, x, rate):
+    return -rate * x
+
+
+# two nodes coupled with strength 2, inputs +1 and -1
+_M = np.array([[-1.], [1.]])
+_MW = 2 * _M
+_P = np.array([1., -1.])
+
+
+class TestBackends:
+    @settings(max_examples=10, deadline=None)
+    @given(rate=st.floats(min_value=0.1, max_value=2))
+    def test_exponential_decay(self, rate):
+        t = np.linspace(0, 3, 31)
+        for name in INTEGRATORS:
+            sol = get_integrator(name).integrate(_decay, np.ones(2), t, args=(rate,))
+            assert_equal(sol.shape, (t.size, 2))
+            assert(np.allclose(sol[:, 0], np.exp(-rate * t), rtol=1e-4, atol=1e-6))
+
+    def test_final_only(self):
+        t = np.linspace(0, 1, 1000)
+        for name in INTEGRATORS:
+            final = get_integrator(name).integrate(_decay, np.ones(3), t,
+                                                   args=(1.,), final_only=True)
+            assert_equal(final.shape, (3,))
+            assert(np.allclose(final, np.exp(-1), rtol=1e-4))
+
+    def test_reuse_and_reset(self):
+        integrator = get_integrator('vode')
+        t = np.linspace(0, 1, 11)
+        first = integrator.integrate(_decay, np.ones(2), t, args=(1.,))
+        second = integrator.integrate(_decay, np.ones(2), t, args=(1.,))
+        integrator.reset()
+        third = integrator.integrate(_decay, np.ones(2), t, args=(1.,))
+        assert(np.allclose(first, second) and np.allclose(first, third))
+
+    def test_instance_passthrough(self):
+        integrator = get_integrator('radau', rtol=1e-8)
+        assert_is(get_integrator(integrator), integrator)
+        assert_equal(integrator.rtol, 1e-8)
+        assert(isinstance(integrator, Integrator))
+
+    @raises(ValueError)
+    def test_unknown_backend(self):
+        get_integrator('euler')
+
+    def test_kuramoto_fixed_point(self):
+        t = np.linspace(0, 50, 100)
+        for name in ('vode', 'bdf', 'radau', 'rk45'):
+            th = odeint(_kuramoto_ode, np.zeros(2), t=t, args=(_M, _MW, _P),
+                        integrator=name, final_only=True)
+            assert_almost_equal(2 * np.sin(th[0] - th[1]), 1, places=4)
+
+    def test_concurrent_threads(self):
+        """Each backend gives the same results when solving from a thread pool"""
+        t = np.linspace(0, 50, 100)
+        x0s = [np.array([0., x]) for x in np.linspace(-1, 1, 16)]
+        for name in ('bdf', 'vode'):
+            integrator = get_integrator(name)
+            serial = [integrator.integrate(_kuramoto_ode, x0, t, args=(_M, _MW, _P),
+                                           final_only=True) for x0 in x0s]
+            with ThreadPoolExecutor(4) as pool:
+                threaded = list(pool.map(
+                    lambda x0: integrator.integrate(_kuramoto_ode, x0, t, args=(_M, _MW, _P),
+                                                    final_only=True), x0s))
+            assert(np.allclose(serial, threaded))
@@ -0,0 +1,79 @@
+from nose.tools import *
+
+from flownetpy import KuramotoNetwork, LinearFlowNetwork
+from flownetpy.kuramotonetwork import KuramotoRHS
+from flownetpy.multilevel import coarsen, hierarchy, multilevel_solve
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _grid(n, seed=0, weight=4.):
+    inputs = np.random.RandomState(seed).normal(size=n * n)
+    return KuramotoNetwork(nx.grid_2d_graph(n, n), inputs - inputs.mean(), weight)
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=2, max_value=12), integers(min_value=0, max_value=1000))
+def test_coarsen_conserves_inputs_and_cut_weights(n, seed):
+    rng = np.random.RandomState(seed)
+    graph = nx.gnm_random_graph(n * 3, n * 5, seed=seed)
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = rng.uniform(0.5, 2)
+    net = KuramotoNetwork(graph, rng.normal(size=n * 3), 'weight')
+    compiled = net.compile()
+    coarse, aggregates = coarsen(compiled)
+
+    assert_true(np.all(np.bincount(aggregates) <= 2))
+    assert_almost_equal(coarse.inputs.sum(), compiled.inputs.sum())
+    between = aggregates[compiled.head] != aggregates[compiled.tail]
+    assert_almost_equal(coarse.weights.sum(), compiled.weights[between].sum())
+    # no parallel edges or loops are left
+    pairs = set(zip(coarse.head.tolist(), coarse.tail.tolist()))
+    assert_equal(len(pairs), coarse.n_edges)
+    assert_true(np.all(coarse.head < coarse.tail))
+
+
+def test_hierarchy():
+    levels = hierarchy(_grid(20).compile(), coarsest=50)
+    assert_true(levels[-1][0].n_nodes <= 50)
+    for (fine, aggregates), (coarse, _) in zip(levels, levels[1:]):
+        assert_equal(aggregates.size, fine.n_nodes)
+        assert_equal(aggregates.max() + 1, coarse.n_nodes)
+
+
+def test_multilevel_fixed_point():
+    net = _grid(20)
+    compiled = net.compile()
+    thetas, stable = multilevel_solve(compiled)
+    assert_true(stable)
+    assert_true(np.abs(KuramotoRHS(compiled)(0, thetas)).max() < 1e-9)
+    assert_true(np.all(np.abs(thetas[compiled.head] - thetas[compiled.tail]) < np.pi / 2))
+
+    flows, data = net.steady_flows(initguess='multilevel', extra_output=True)
+    assert_equal(data['stats'].attempts, 0)
+    # integrating from the multilevel solution does not move it
+    reference = net.steady_flows(initguess=data['thetas'])
+    for edge, flow in flows.items():
+        assert_almost_equal(flow, reference[edge], places=5)
+
+
+def test_tree_matches_conservation():
+    # the flows of a tree follow from the inputs alone, whatever the model
+    graph = nx.random_labeled_tree(30, seed=1)
+    inputs = np.random.RandomState(1).normal(size=30)
+    inputs = 0.3 * (inputs - inputs.mean())
+    net = KuramotoNetwork(graph, inputs, 5.)
+    compiled = net.compile()
+    thetas, stable = multilevel_solve(compiled, coarsest=4)
+    assert_true(stable)
+    flows = compiled.weights * np.sin(thetas[compiled.head] - thetas[compiled.tail])
+    expected = LinearFlowNetwork(graph, inputs, 5.).steady_flows()
+    np.testing.assert_allclose(flows, compiled.flow_array(expected), atol=1e-8)
+
+
+def test_unknown_initguess():
+    assert_raises(ValueError, _grid(3).steady_flows, initguess='coarse')
@@ -0,0 +1,112 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork, NonlinearFlowNetwork
+from flownetpy.cache import SolutionCache
+from flownetpy.flowmodel import newton
+from flownetpy.flowmodel.laws import Linear, Sine, Power, QUADRATIC, HAZEN_WILLIAMS
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import assume, given, settings
+from hypothesis.strategies import integers, floats, sampled_from
+
+
+@settings(deadline=None, max_examples=50)
+@given(sampled_from([Linear(), Sine(), Power(0.5), Power(0.54, smoothing=1e-3), Power(2.)]),
+       floats(min_value=-1.2, max_value=1.2))
+def test_derivatives(law, dx):
+    # the smoothed power laws are steep around zero
+    assume(abs(dx) > 1e-2)
+    h = 1e-6
+    numeric = (law.flow(dx + h) - law.flow(dx - h)) / (2 * h)
+    np.testing.assert_allclose(law.derivative(dx), numeric, rtol=1e-4, atol=1e-6)
+    assert_greater(law.derivative(dx), 0)
+
+
+@settings(deadline=None, max_examples=50)
+@given(sampled_from([QUADRATIC, Power(0.54, smoothing=1e-3), Power(1.85)]),
+       floats(min_value=-10, max_value=10))
+def test_inverse(law, flow):
+    assert_almost_equal(law.flow(law.inverse(flow)), flow, places=12)
+
+
+def test_power_law_limit():
+    dx = np.array([-4., -0.25, 0., 0.25, 4.])
+    np.testing.assert_allclose(QUADRATIC.flow(dx), np.sign(dx) * np.sqrt(np.abs(dx)),
+                               atol=1e-6)
+    assert_equal(QUADRATIC, Power(0.5))
+    assert_not_equal(QUADRATIC, HAZEN_WILLIAMS)
+    assert_raises(ValueError, Power, 0)
+    assert_true(QUADRATIC.concave)
+    assert_false(Power(1.85).concave)
+
+
+def _network(graph, seed, scale=1., law=None):
+    rng = np.random.RandomState(seed)
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = rng.uniform(0.5, 2.)
+    inputs = rng.normal(size=graph.number_of_nodes())
+    return NonlinearFlowNetwork(graph, scale * (inputs - inputs.mean()), 'weight', law=law)
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=0, max_value=1000))
+def test_linear_law_matches_linear_network(seed):
+    net = _network(nx.connected_watts_strogatz_graph(30, 4, 0.3, seed=seed), seed)
+    flows = net.steady_flows()
+    expected = LinearFlowNetwork(net, nx.get_node_attributes(net, 'input'),
+                                 'weight').steady_flows()
+    for edge, flow in expected.items():
+        assert_almost_equal(flows[edge], flow, places=8)
+
+
+def test_sine_law_matches_kuramoto():
+    net = _network(nx.grid_2d_graph(5, 5), 0, scale=0.5, law=Sine())
+    flows, data = net.steady_flows(extra_output=True)
+    kuramoto = KuramotoNetwork(net, nx.get_node_attributes(net, 'input'), 'weight')
+    expected = kuramoto.steady_flows(initguess=data['potentials'])
+    for edge, flow in expected.items():
+        assert_almost_equal(flows[edge], flow, places=5)
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=0, max_value=1000), sampled_from([QUADRATIC, HAZEN_WILLIAMS,
+                                                            Power(1.85)]))
+def test_power_law_steady_state(seed, law):
+    net = _network(nx.connected_watts_strogatz_graph(40, 4, 0.3, seed=seed), seed, law=law)
+    flows, data = net.steady_flows(extra_output=True)
+    assert_is_not_none(flows)
+    compiled = net.compile()
+    # flows balance the inputs and follow the law
+    F = newton.residual(data['potentials'], compiled.incidence(), compiled.weights,
+                        compiled.inputs, law)
+    assert_less(np.abs(F).max(), 1e-9)
+    x = data['potentials']
+    for (u, v), flow in flows.items():
+        i, j = compiled.node_index[u], compiled.node_index[v]
+        assert_almost_equal(flow, net[u][v]['weight'] * law.flow(x[i] - x[j]), places=10)
+    assert_less(data['stats'].njev, 20)
+
+
+def test_warm_start():
+    net = _network(nx.grid_2d_graph(8, 8), 1, law=QUADRATIC)
+    cache = SolutionCache()
+    cold, data = net.steady_flows(extra_output=True, cache=cache)
+    # slightly different inputs start from the cached solution
+    compiled = net.compile()
+    shifted = NonlinearFlowNetwork._from_compiled(compiled.with_inputs(compiled.inputs * 1.01))
+    shifted.law = QUADRATIC
+    warm, warm_data = shifted.steady_flows(extra_output=True, cache=cache)
+    assert_less(warm_data['stats'].njev, data['stats'].njev)
+    again, again_data = net.steady_flows(extra_output=True, cache=cache)
+    assert_true(again_data['stats'].cached)
+    assert_equal(again, cold)
+
+
+def test_unstable_sine_law():
+    # more input than the line can carry
+    net = NonlinearFlowNetwork(nx.path_graph(2), [2., -2.], 1., law=Sine())
+    flows, data = net.steady_flows(extra_output=True)
+    assert_is_none(flows)
+    assert_false(data['stats'].converged)
@@ -0,0 +1,105 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork, NonlinearFlowNetwork
+from flownetpy.flowmodel import kuramoto, newton
+from flownetpy.flowmodel.laws import QUADRATIC
+from flownetpy.laplacian import LaplacianSolver
+from flownetpy.ordering import MIN_NODES, locality_order
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _shuffled_grid(n, cls=LinearFlowNetwork, seed=0, integer_labels=True, weight=None,
+                   **kwargs):
+    rng = np.random.RandomState(seed)
+    graph = nx.grid_2d_graph(n, n)
+    nodes, edges = list(graph.nodes()), list(graph.edges())
+    rng.shuffle(nodes)
+    rng.shuffle(edges)
+    shuffled = nx.Graph()
+    shuffled.add_nodes_from(nodes)
+    shuffled.add_edges_from((u, v, {'weight': rng.uniform(1, 2)}) for u, v in edges)
+    if integer_labels:
+        shuffled = nx.convert_node_labels_to_integers(shuffled)
+    inputs = rng.normal(size=n * n)
+    return cls(shuffled, inputs - inputs.mean(), 'weight' if weight is None else weight,
+               **kwargs)
+
+
+def _span(head, tail):
+    return np.abs(head - tail).mean()
+
+
+def test_locality_order():
+    compiled = _shuffled_grid(40, integer_labels=False).compile()
+    for method in ('rcm', 'curve'):
+        ordering = locality_order(compiled, method)
+        assert_equal(ordering.method, method)
+        assert_equal(sorted(ordering.nodes), list(range(compiled.n_nodes)))
+        assert_equal(sorted(ordering.edges), list(range(compiled.n_edges)))
+        head, tail = ordering.rank[compiled.head], ordering.rank[compiled.tail]
+        assert_less(_span(head, tail), _span(compiled.head, compiled.tail) / 10)
+        np.testing.assert_array_equal(ordering.from_local(ordering.to_local(compiled.inputs)),
+                                      compiled.inputs)
+    assert_true(compiled.ordering() is compiled.with_inputs(compiled.inputs).ordering())
+    assert_raises(ValueError, locality_order, compiled, 'metis')
+    assert_raises(ValueError, locality_order, _shuffled_grid(40).compile(), 'curve')
+    # small networks, and networks in a good order already, are kept
+    assert_is_none(_shuffled_grid(10).compile().ordering())
+    assert_is_none(LinearFlowNetwork(nx.path_graph(MIN_NODES), np.zeros(MIN_NODES),
+                                     1.).compile().ordering())
+
+
+def test_local():
+    compiled = _shuffled_grid(35).compile()
+    local = compiled.local()
+    ordering = compiled.ordering()
+    assert_is_none(local.ordering())
+    np.testing.assert_array_equal(local.inputs, ordering.to_local(compiled.inputs))
+    assert_equal(set(map(frozenset, local.edges())), set(map(frozenset, compiled.edges())))
+    # the edges follow the nodes
+    assert_true(np.all(np.diff(np.minimum(local.head, local.tail)) >= 0))
+
+
+@settings(deadline=None, max_examples=10)
+@given(integers(min_value=2, max_value=40), integers(min_value=0, max_value=1000))
+def test_solver_order(n, seed):
+    rng = np.random.RandomState(seed)
+    graph = nx.gnm_random_graph(n, 2 * n, seed=seed)
+    compiled = LinearFlowNetwork(graph, np.zeros(n), 1.).compile()
+    laplacian = compiled.laplacian(weights=rng.uniform(0.5, 2, compiled.n_edges))
+    b = rng.normal(size=(n, 2))
+    plain = LaplacianSolver(laplacian)
+    ordered = LaplacianSolver(laplacian, order=rng.permutation(n))
+    np.testing.assert_allclose(ordered.solve(b), plain.solve(b), atol=1e-10)
+    # the labels are in the order of the Laplacian
+    assert_equal(len(set(zip(plain.labels, ordered.labels))), plain.n_components)
+
+
+def test_solvers_map_back():
+    net = _shuffled_grid(35)
+    compiled = net.compile()
+    assert_is_not_none(compiled.ordering())
+    expected = LaplacianSolver(compiled.laplacian()).solve(compiled.inputs)
+    np.testing.assert_allclose(net.steady_flows(extra_output=True)[1]['pressures'], expected,
+                               atol=1e-10)
+
+    net = _shuffled_grid(35, NonlinearFlowNetwork, law=QUADRATIC)
+    compiled = net.compile()
+    flows, data = net.steady_flows(extra_output=True)
+    x, converged = newton.solve(compiled.incidence(), compiled.weights, compiled.inputs,
+                                QUADRATIC)
+    assert_true(converged)
+    np.testing.assert_allclose(data['potentials'], x, atol=1e-8)
+
+    net = _shuffled_grid(35, KuramotoNetwork, weight=4.)
+    compiled = net.compile()
+    x0 = np.random.RandomState(1).uniform(-0.1, 0.1, compiled.n_nodes)
+    tarr = np.linspace(0, 1, 5)
+    expected = kuramoto.evolve(compiled.incidence(), compiled.weights, compiled.inputs, tarr,
+                               initguess=x0)
+    np.testing.assert_allclose(net._evolve(tarr, initguess=x0), expected, atol=1e-5)
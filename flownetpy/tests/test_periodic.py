@@ -0,0 +1,134 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.flowmodel.kuramoto import winding_numbers
+from flownetpy.kuramotonetwork import KuramotoRHS
+from flownetpy.laplacian import LaplacianSolver
+from flownetpy.periodic import LatticeSolver, detect, ring_fixed_points
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers, lists, booleans
+
+
+def _compiled(graph, weight=2., cls=LinearFlowNetwork, seed=0):
+    inputs = np.random.RandomState(seed).normal(size=graph.number_of_nodes())
+    return cls(graph, inputs - inputs.mean(), weight).compile()
+
+
+def test_detect():
+    lattice = detect(_compiled(nx.cycle_graph(7)))
+    assert_equal(lattice.periodic, (True,))
+    assert_true(lattice.is_ring)
+    # the walk follows the ring, whatever the labels
+    graph = nx.relabel_nodes(nx.cycle_graph(9), {i: 'n%d' % (4 * i % 9) for i in range(9)})
+    compiled = _compiled(graph)
+    sites = [compiled.nodes[i] for i in compiled.lattice().sites]
+    for u, v in zip(sites, sites[1:] + sites[:1]):
+        assert_true(graph.has_edge(u, v))
+
+    lattice = detect(_compiled(nx.path_graph(6)))
+    assert_equal((lattice.shape, lattice.periodic), ((6,), (False,)))
+    lattice = detect(_compiled(nx.grid_graph([3, 4, 5], periodic=[True, False, True])))
+    assert_equal(lattice.shape, (5, 4, 3))
+    assert_equal(lattice.periodic, (True, False, True))
+    assert_equal(lattice.weights, (2., 2., 2.))
+    # a 2 x 2 grid is also a ring, with weights alternating along it
+    graph = nx.grid_2d_graph(2, 2)
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = 1. + (u[0] != v[0])
+    lattice = detect(_compiled(graph, 'weight'))
+    assert_equal((lattice.shape, lattice.weights), ((2, 2), (2., 1.)))
+
+    for graph in [nx.gnm_random_graph(20, 40, seed=1), nx.star_graph(5), nx.complete_graph(4),
+                  nx.convert_node_labels_to_integers(nx.grid_2d_graph(3, 3))]:
+        assert_is_none(detect(_compiled(graph)))
+    # a missing edge
+    graph = nx.grid_2d_graph(3, 4)
+    graph.remove_edge((0, 0), (0, 1))
+    assert_is_none(detect(_compiled(graph)))
+
+
+@settings(deadline=None, max_examples=30)
+@given(lists(integers(min_value=1, max_value=7), min_size=1, max_size=3),
+       lists(booleans(), min_size=3, max_size=3), integers(min_value=0, max_value=1000))
+def test_lattice_solver(shape, periodic, seed):
+    # networkx wraps dimensions shorter than 3 with self loops
+    graph = nx.grid_graph(shape, periodic=[p and k >= 3 for p, k in zip(periodic, shape)])
+    if len(shape) == 1:
+        graph = nx.relabel_nodes(graph, {i: (i, 0) for i in graph})
+    if graph.number_of_nodes() < 2:
+        return
+    rng = np.random.RandomState(seed)
+    for u, v in graph.edges():
+        # uniform weights along every dimension
+        graph[u][v]['weight'] = 1. + np.argmax(np.array(u) != np.array(v))
+    compiled = _compiled(graph, 'weight')
+    solver = LatticeSolver(compiled.lattice())
+    b = rng.normal(size=(compiled.n_nodes, 3))
+    np.testing.assert_allclose(solver.solve(b), LaplacianSolver(compiled.laplacian()).solve(b),
+                               atol=1e-10)
+
+
+def test_uniform_weights_only():
+    graph = nx.grid_2d_graph(4, 4, periodic=True)
+    graph[(0, 0)][(0, 1)]['weight'] = 3.
+    compiled = _compiled(graph, 'weight')
+    assert_is_none(compiled.lattice().weights)
+    assert_is_instance(compiled.laplacian_solver(), LaplacianSolver)
+    assert_raises(ValueError, LatticeSolver, compiled.lattice())
+    # single precision factors are kept, and small lattices factorized
+    compiled = _compiled(nx.grid_2d_graph(10, 10))
+    assert_is_instance(compiled.laplacian_solver(np.float32), LaplacianSolver)
+    assert_is_instance(compiled.laplacian_solver(), LatticeSolver)
+    assert_is_instance(_compiled(nx.grid_2d_graph(4, 4)).laplacian_solver(), LaplacianSolver)
+
+
+def test_torus_flows():
+    net = LinearFlowNetwork(nx.grid_2d_graph(8, 10, periodic=True),
+                            np.random.RandomState(2).normal(size=80), 1.5)
+    flows, data = net.steady_flows(extra_output=True)
+    compiled = net.compile()
+    assert_is_instance(compiled.laplacian_solver(), LatticeSolver)
+    assert_less(data['stats'].residual, 1e-12)
+    expected = LaplacianSolver(compiled.laplacian()).solve(compiled.inputs)
+    np.testing.assert_allclose(data['pressures'], expected, atol=1e-12)
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=3, max_value=60), integers(min_value=0, max_value=1000))
+def test_ring_fixed_points(n, seed):
+    rng = np.random.RandomState(seed)
+    graph = nx.cycle_graph(n)
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = rng.uniform(1, 3)
+    compiled = _compiled(graph, 'weight', KuramotoNetwork, seed)
+    fixed_points = ring_fixed_points(compiled)
+    rhs = KuramotoRHS(compiled)
+    for m, thetas in fixed_points.items():
+        assert_less(np.abs(rhs(0, thetas)).max(), 1e-10)
+        differences = thetas[compiled.head] - thetas[compiled.tail]
+        assert_true(np.all(np.cos(differences) > 0))
+        omega = winding_numbers([compiled.lattice().sites], thetas)[0]
+        assert_almost_equal(omega, m)
+    # the winding numbers are consecutive
+    if fixed_points:
+        assert_equal(sorted(fixed_points), list(range(min(fixed_points), max(fixed_points) + 1)))
+
+
+def test_ring_initguess():
+    net = KuramotoNetwork(nx.cycle_graph(12), np.tile([1., -1.], 6), 4.)
+    flows, data = net.steady_flows(initguess='ring', extra_output=True)
+    assert_almost_equal(data['omega'][0], 0)
+    assert_equal(data['stats'].nfev, 0)
+    # |m| <= 6 (pi/2 + arcsin(3/4)) / 2 pi
+    assert_equal(sorted(net.ring_fixed_points()), [-2, -1, 0, 1, 2])
+    expected = net.steady_flows(initguess=data['thetas'])
+    for edge, flow in expected.items():
+        assert_almost_equal(flows[edge], flow)
+    assert_raises(ValueError, KuramotoNetwork(nx.path_graph(3), np.zeros(3), 1.).steady_flows,
+                  initguess='ring')
+    unbalanced = KuramotoNetwork(nx.cycle_graph(4), np.ones(4), 1.)
+    assert_raises(ValueError, unbalanced.ring_fixed_points)
@@ -0,0 +1,94 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.redispatch import redispatch, _hildreth
+
+import numpy as np
+import networkx as nx
+from scipy.optimize import minimize
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _grid(cls, seed=0, weight=3.):
+    rng = np.random.RandomState(seed)
+    inputs = rng.normal(size=25)
+    return cls(nx.grid_2d_graph(5, 5), inputs - inputs.mean(), weight)
+
+
+def _max_load(net):
+    return np.abs(net.compile().flow_array(net.steady_flows())).max()
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=1, max_value=6), integers(min_value=2, max_value=6),
+       integers(min_value=0, max_value=1000))
+def test_hildreth_matches_slsqp(m, n, seed):
+    rng = np.random.RandomState(seed)
+    G = rng.normal(size=(m, n))
+    b = rng.normal(size=m) + 0.5
+    x, lam, converged = _hildreth(G, b)
+    reference = minimize(lambda y: y.dot(y) / 2, np.zeros(n), jac=lambda y: y,
+                         constraints={'type': 'ineq', 'fun': lambda y: b - G.dot(y),
+                                      'jac': lambda y: -G},
+                         method='SLSQP', options={'ftol': 1e-12})
+    if reference.success and converged:
+        np.testing.assert_allclose(x.dot(x), reference.x.dot(reference.x),
+                                   rtol=1e-5, atol=1e-8)
+        assert_true(np.all(G.dot(x) <= b + 1e-8))
+
+
+def test_linear_redispatch():
+    net = _grid(LinearFlowNetwork)
+    capacity = 0.6 * _max_load(net)
+    changes, data = redispatch(net, capacity)
+    assert_true(data['feasible'])
+    assert_equal(data['iterations'], 1)
+    assert_almost_equal(sum(changes.values()), 0)
+
+    moved = LinearFlowNetwork(nx.grid_2d_graph(5, 5), data['inputs'], 3.)
+    assert_true(_max_load(moved) <= capacity + 1e-8)
+    # the constraints are active: a shorter step toward it would overload
+    inputs = net.compile().inputs
+    halfway = LinearFlowNetwork(nx.grid_2d_graph(5, 5),
+                                (inputs + 0.9 * (data['inputs'] - inputs)), 3.)
+    assert_true(_max_load(halfway) > capacity)
+
+
+def test_kuramoto_redispatch():
+    net = _grid(KuramotoNetwork)
+    capacity = 0.6 * _max_load(net)
+    changes, data = redispatch(net, capacity, margin=0.01, tol=1e-5)
+    assert_true(data['feasible'])
+    assert_true(data['iterations'] <= 5)
+    moved = KuramotoNetwork(nx.grid_2d_graph(5, 5), data['inputs'], 3.)
+    assert_true(_max_load(moved) <= capacity)
+
+
+def test_controllable_nodes():
+    net = _grid(LinearFlowNetwork)
+    nodes = [(i, j) for i in range(5) for j in range(5) if (i + j) % 2 == 0]
+    capacity = 0.9 * _max_load(net)
+    changes, data = redispatch(net, capacity, nodes=nodes)
+    assert_true(data['feasible'])
+    for node, change in changes.items():
+        if node not in nodes:
+            assert_equal(change, 0)
+
+    # with only a corner to act on, the limits cannot be met
+    changes, data = redispatch(net, 0.3 * _max_load(net), nodes=[(0, 0), (0, 1)])
+    assert_false(data['feasible'])
+
+
+def test_capacities_by_edge():
+    net = _grid(LinearFlowNetwork)
+    flows = net.steady_flows()
+    capacities = {(v, u): 10. for u, v in net.edges()}
+    edge = max(flows, key=lambda e: abs(flows[e]))
+    capacities[edge] = abs(flows[edge]) / 2
+    changes, data = redispatch(net, capacities)
+    assert_true(data['feasible'])
+    assert_almost_equal(abs(data['flows'][edge]), abs(flows[edge]) / 2, places=6)
+    del capacities[edge], capacities[edge[::-1]]
+    assert_raises(ValueError, redispatch, net, capacities)
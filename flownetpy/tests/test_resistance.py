@@ -0,0 +1,77 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork
+from flownetpy.resistance import (effective_resistance, edge_resistances, ptdf,
+                                  ResistanceSketch, sketch_size)
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _network(graph, rng):
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = rng.uniform(0.5, 2.)
+    return LinearFlowNetwork(graph, {node: 0. for node in graph.nodes()}, 'weight')
+
+
+def _pinv_resistance(net, u, v):
+    nodes = list(net.nodes())
+    lap = nx.laplacian_matrix(net, nodelist=nodes, weight='weight').toarray()
+    pinv = np.linalg.pinv(lap)
+    i, j = nodes.index(u), nodes.index(v)
+    return pinv[i, i] + pinv[j, j] - 2 * pinv[i, j]
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=3, max_value=25), integers(min_value=0, max_value=1000))
+def test_exact_matches_pinv(n, seed):
+    rng = np.random.RandomState(seed)
+    net = _network(nx.connected_watts_strogatz_graph(n, 2 if n < 5 else 4, 0.3, seed=seed), rng)
+    pairs = [tuple(rng.choice(n, 2, replace=False)) for _ in range(5)]
+    expected = [_pinv_resistance(net, u, v) for u, v in pairs]
+    np.testing.assert_allclose(effective_resistance(net, pairs, block=2), expected)
+
+
+def test_series_and_parallel():
+    net = LinearFlowNetwork(nx.cycle_graph(10), np.zeros(10), 1.)
+    # 1 in parallel with 9 in series
+    np.testing.assert_allclose(edge_resistances(net), 0.9)
+    np.testing.assert_allclose(effective_resistance(net, [(0, 5), (3, 3)]), [2.5, 0.])
+
+
+def test_disconnected():
+    graph = nx.Graph([(0, 1), (2, 3)])
+    net = _network(graph, np.random.RandomState(0))
+    assert_equal(effective_resistance(net, [(0, 2)])[0], np.inf)
+    assert_equal(ResistanceSketch(net, k=10, seed=0).resistances([(1, 3)])[0], np.inf)
+
+
+def test_ptdf_rows():
+    rng = np.random.RandomState(3)
+    net = _network(nx.grid_2d_graph(5, 5), rng)
+    compiled = net.compile()
+    full = net.sensitivities().ptdf()
+    np.testing.assert_allclose(ptdf(net, block=7), full, atol=1e-12)
+
+    edges = compiled.edges()[3:6]
+    nodes = compiled.nodes[::4]
+    cols = [compiled.node_index[node] for node in nodes]
+    np.testing.assert_allclose(ptdf(net, edges=edges, nodes=nodes), full[3:6][:, cols], atol=1e-12)
+    reversed_edges = [(v, u) for u, v in edges]
+    np.testing.assert_allclose(ptdf(net, edges=reversed_edges, nodes=nodes),
+                               -full[3:6][:, cols], atol=1e-12)
+    assert_raises(ValueError, ptdf, net, edges=[((0, 0), (4, 4))])
+
+
+def test_sketch_error_bound():
+    rng = np.random.RandomState(1)
+    net = _network(nx.connected_watts_strogatz_graph(200, 4, 0.2, seed=1), rng)
+    exact = edge_resistances(net)
+    sketch = ResistanceSketch(net, epsilon=0.5, seed=0)
+    assert_equal(sketch.k, sketch_size(200, 0.5))
+    ratio = sketch.edge_resistances() / exact
+    assert_true(np.all(np.abs(ratio - 1) < 0.5))
+    assert_raises(ValueError, sketch_size, 100, 1.5)
@@ -0,0 +1,118 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.laplacian import LaplacianSolver
+from flownetpy.sensitivity import Sensitivities
+
+import numpy as np
+import networkx as nx
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+
+def _network(cls, edges, weights, inputs):
+    return cls.from_arrays(np.asarray(edges), weights, inputs)
+
+
+def _balanced(rng, n):
+    inputs = rng.normal(size=n)
+    return inputs - inputs.mean()
+
+
+def _flows(cls, edges, weights, inputs, **kwargs):
+    net = _network(cls, edges, weights, inputs)
+    return net.compile().flow_array(net.steady_flows(**kwargs))
+
+
+@settings(deadline=None, max_examples=20)
+@given(integers(min_value=3, max_value=30), integers(min_value=0, max_value=1000))
+def test_linear_ptdf_matches_finite_differences(n, seed):
+    rng = np.random.RandomState(seed)
+    graph = nx.connected_watts_strogatz_graph(n, 2 if n < 5 else 4, 0.3, seed=seed)
+    edges = list(graph.edges())
+    weights = rng.uniform(0.5, 2., size=len(edges))
+    inputs = _balanced(rng, n)
+    sens = _network(LinearFlowNetwork, edges, weights, inputs).sensitivities()
+
+    # the linear model is linear: finite differences are exact
+    delta = _balanced(rng, n)
+    expected = _flows(LinearFlowNetwork, edges, weights, inputs + delta) - \
+        _flows(LinearFlowNetwork, edges, weights, inputs)
+    np.testing.assert_allclose(sens.ptdf().dot(delta), expected, atol=1e-8)
+
+    dw = 1e-6 * rng.normal(size=len(edges))
+    expected = (_flows(LinearFlowNetwork, edges, weights + dw, inputs) -
+                _flows(LinearFlowNetwork, edges, weights, inputs))
+    np.testing.assert_allclose(sens.jvp(weights=dw), expected, atol=1e-10)
+
+
+def test_vjp_is_transpose_of_jvp():
+    rng = np.random.RandomState(0)
+    graph = nx.grid_2d_graph(4, 4)
+    edges = [(4*u[0] + u[1], 4*v[0] + v[1]) for u, v in graph.edges()]
+    inputs = 0.3 * _balanced(rng, 16)
+    for cls in (LinearFlowNetwork, KuramotoNetwork):
+        net = _network(cls, edges, 2., inputs)
+        sens = net.sensitivities()
+        v = rng.normal(size=len(edges))
+        dinputs, dweights = sens.vjp(v)
+        np.testing.assert_allclose(dinputs, v.dot(sens.ptdf()), atol=1e-10)
+        np.testing.assert_allclose(dweights, v.dot(sens.weight_sensitivities()), atol=1e-10)
+
+
+def test_kuramoto_tree_matches_linear():
+    # on a tree the flows are fixed by the inputs alone, whatever the model
+    n = 15
+    edges = [((i - 1) // 2, i) for i in range(1, n)]
+    inputs = 0.2 * _balanced(np.random.RandomState(1), n)
+    linear = _network(LinearFlowNetwork, edges, 3., inputs).sensitivities()
+    kuramoto = _network(KuramotoNetwork, edges, 3., inputs).sensitivities()
+    np.testing.assert_allclose(kuramoto.ptdf(), linear.ptdf(), atol=1e-6)
+    assert_true(np.all(np.abs(kuramoto.gains) < 3.))
+
+
+def test_kuramoto_ring_finite_differences():
+    n = 8
+    edges = [(i, (i + 1) % n) for i in range(n)]
+    inputs = np.tile([0.5, -0.5], n // 2)
+    net = _network(KuramotoNetwork, edges, 2., inputs)
+    flows, data = net.steady_flows(extra_output=True, initguess=np.zeros(n))
+    sens = net.sensitivities(thetas=data['thetas'])
+
+    delta = 1e-3 * np.tile([1., 0., -1., 0.], n // 4)
+    perturbed = _network(KuramotoNetwork, edges, 2., inputs + delta)
+    expected = perturbed.compile().flow_array(
+        perturbed.steady_flows(initguess=data['thetas'])) - net.compile().flow_array(flows)
+    np.testing.assert_allclose(sens.jvp(inputs=delta), expected, atol=1e-5)
+
+
+def test_sparse_threshold():
+    n = 50
+    edges = [(i, i + 1) for i in range(n - 1)]
+    sens = _network(LinearFlowNetwork, edges, 1., np.zeros(n)).sensitivities()
+    dense = sens.ptdf()
+    sparse = sens.ptdf(sparse=True, threshold=0.1, block=7)
+    np.testing.assert_allclose(sparse.toarray(), np.where(np.abs(dense) > 0.1, dense, 0))
+    assert_true(sparse.nnz < dense.size)
+    assert_raises(ValueError, Sensitivities, sens.compiled, np.zeros(n), 'power')
+
+
+def test_factorization_is_shared():
+    # a network built from a graph is compiled anew by every compile()
+    net = LinearFlowNetwork(nx.grid_2d_graph(4, 5), _balanced(np.random.RandomState(0), 20), 2.)
+    factorizations = []
+    init = LaplacianSolver.__init__
+
+    def counting_init(self, *args, **kwargs):
+        factorizations.append(self)
+        init(self, *args, **kwargs)
+
+    LaplacianSolver.__init__ = counting_init
+    try:
+        sens = net.sensitivities()
+        sens.ptdf()
+    finally:
+        LaplacianSolver.__init__ = init
+    assert_equal(len(factorizations), 1)
+    assert_true(sens.solver is factorizations[0])
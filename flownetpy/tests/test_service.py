@@ -0,0 +1,137 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.service import SolveService, ServiceBusy, serve
+
+import asyncio
+import json
+
+import numpy as np
+import networkx as nx
+
+
+def _inputs(n, k, seed=0):
+    inputs = np.random.RandomState(seed).normal(size=(k, n))
+    return inputs - inputs.mean(axis=1, keepdims=True)
+
+
+def _direct(cls, graph, inputs):
+    net = cls(graph, inputs, 3.)
+    if cls is KuramotoNetwork:
+        # the batch starts from the linear response, as the multilevel guess
+        # does on a small network, rather than from random phases
+        flows = net.steady_flows(initguess='multilevel')
+    else:
+        flows = net.steady_flows()
+    return None if flows is None else net.compile().flow_array(flows)
+
+
+def test_linear_requests_are_batched():
+    graph = nx.grid_2d_graph(4, 4)
+    net = LinearFlowNetwork(graph, np.zeros(16), 3.)
+    inputs = _inputs(16, 50)
+
+    async def run():
+        async with SolveService(window=0.05) as service:
+            key = service.register(net)
+            results = await asyncio.gather(*[service.solve(key, p) for p in inputs])
+            return results, service.metrics
+
+    results, metrics = asyncio.run(run())
+    for p, flows in zip(inputs, results):
+        np.testing.assert_allclose(flows, _direct(LinearFlowNetwork, graph, p), atol=1e-12)
+    assert_equal((metrics.completed, metrics.batches, metrics.pending), (50, 1, 0))
+    assert_equal(metrics.batch_size, 50)
+    assert_true(metrics.latency()[0] > 0)
+
+
+def test_network_is_registered_once():
+    net = LinearFlowNetwork(nx.grid_2d_graph(3, 3), np.zeros(9), 3.)
+    compiles = []
+    compile = net.compile
+    net.compile = lambda: compiles.append(1) or compile()
+    inputs = _inputs(9, 3)
+
+    async def run():
+        async with SolveService(window=0.01) as service:
+            for p in inputs:
+                await service.solve(net, p)
+            first = len(compiles)
+            # a network changed in place is registered again
+            net[(0, 0)][(0, 1)]['weight'] = 1.
+            service.register(net)
+            await service.solve(net, inputs[0])
+            return first, len(service._topologies)
+
+    first, n_topologies = asyncio.run(run())
+    assert_equal(first, 1)
+    assert_equal(len(compiles), 2)
+    assert_equal(n_topologies, 2)
+
+
+def test_kuramoto_batch():
+    graph = nx.cycle_graph(6)
+    net = KuramotoNetwork(graph, np.zeros(6), 3.)
+    inputs = np.vstack([_inputs(6, 3), 20 * _inputs(6, 1, seed=1)])
+
+    async def run():
+        async with SolveService(window=0.05, max_batch=4) as service:
+            return await asyncio.gather(*[service.solve(net, p) for p in inputs]), service.metrics
+
+    results, metrics = asyncio.run(run())
+    assert_equal(metrics.batches, 1)
+    for p, flows in zip(inputs[:3], results):
+        np.testing.assert_allclose(flows, _direct(KuramotoNetwork, graph, p), atol=1e-5)
+    assert_true(results[3] is None)
+
+
+def test_backpressure():
+    net = LinearFlowNetwork(nx.path_graph(3), np.array([1., 0, -1]), 1.)
+
+    async def run():
+        service = SolveService(window=0.2, max_pending=2, queue_timeout=0.01)
+        results = await asyncio.gather(*[service.solve(net) for _ in range(3)],
+                                       return_exceptions=True)
+        await service.close()
+        return results, service.metrics
+
+    results, metrics = asyncio.run(run())
+    assert_equal(sum(isinstance(r, ServiceBusy) for r in results), 1)
+    assert_equal((metrics.completed, metrics.rejected), (2, 1))
+    assert_raises(ValueError, asyncio.run,
+                  SolveService().solve(net, np.zeros(4)))
+
+
+def test_tcp_server():
+    async def run():
+        service = SolveService(window=0.01)
+        server = await serve(service, port=0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+        async def call(message):
+            writer.write(json.dumps(message).encode('utf8') + b'\n')
+            return json.loads(await reader.readline())
+
+        key = (await call({'register': {'n_nodes': 3, 'edges': [[0, 1], [1, 2]],
+                                        'weights': 2.}}))['topology']
+        for i in range(3):
+            writer.write(json.dumps({'id': i, 'topology': key,
+                                     'inputs': [i, 0, -i]}).encode('utf8') + b'\n')
+        replies = sorted([json.loads(await reader.readline()) for _ in range(3)],
+                         key=lambda reply: reply['id'])
+        error = await call({'topology': 'nope', 'inputs': [0]})
+        metrics = await call({'metrics': True})
+        writer.close()
+        await writer.wait_closed()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return replies, error, metrics
+
+    replies, error, metrics = asyncio.run(run())
+    # node 0 feeds node 2 through node 1
+    for i, reply in enumerate(replies):
+        np.testing.assert_allclose(reply['flows'], [i, i], atol=1e-12)
+    assert_true('KeyError' in error['error'])
+    assert_equal(metrics['metrics']['batches'], 1)
@@ -0,0 +1,98 @@
+from nose.tools import *
+
+from flownetpy import LinearFlowNetwork, KuramotoNetwork
+from flownetpy.sparsify import Sparsifier, sample_edges
+from flownetpy.resistance import edge_resistances
+
+import numpy as np
+import networkx as nx
+import scipy.linalg
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers, sampled_from
+
+
+def _dense_network(n, seed, cls=LinearFlowNetwork, scale=1.):
+    rng = np.random.RandomState(seed)
+    graph = nx.complete_graph(n)
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = rng.uniform(0.5, 2.)
+    inputs = rng.normal(size=n)
+    return cls(graph, scale * (inputs - inputs.mean()), 'weight')
+
+
+def _exact_flows(compiled, inputs=None):
+    inputs = compiled.inputs if inputs is None else inputs
+    x = compiled.laplacian_solver().solve(inputs)
+    return compiled.weights.reshape((-1,) + (1,) * (x.ndim - 1)) * (
+        x[compiled.head] - x[compiled.tail])
+
+
+@settings(deadline=None, max_examples=10, derandomize=True)
+@given(integers(min_value=0, max_value=1000), sampled_from([0.3, 0.5]))
+def test_spectral_error(seed, epsilon):
+    compiled = _dense_network(120, seed).compile()
+    sparsifier = Sparsifier(compiled, epsilon, seed=seed)
+    assert_less(sparsifier.n_edges, compiled.n_edges)
+    full = compiled.laplacian().toarray()[1:, 1:]
+    sparse = sparsifier.compiled.laplacian().toarray()[1:, 1:]
+    eigenvalues = scipy.linalg.eigh(sparse, full, eigvals_only=True)
+    assert_greater(eigenvalues.min(), 1 - epsilon)
+    assert_less(eigenvalues.max(), 1 + epsilon)
+
+
+@settings(deadline=None, max_examples=10, derandomize=True)
+@given(integers(min_value=0, max_value=1000))
+def test_flow_error_bound(seed):
+    compiled = _dense_network(80, seed).compile()
+    sparsifier = Sparsifier(compiled, 0.4, seed=seed)
+    inputs = np.random.RandomState(seed).normal(size=(80, 3))
+    inputs -= inputs.mean(axis=0)
+    exact = _exact_flows(compiled, inputs)
+
+    flows, info = sparsifier.steady_flows(inputs)
+    energy = np.sqrt(np.sum((flows - exact)**2 / compiled.weights[:, np.newaxis], axis=0))
+    assert_true(np.all(energy <= info['energy_bound']))
+    assert_true(np.all(np.abs(flows - exact) <= info['error_bound']))
+
+
+def test_preconditioned_exact_solve():
+    compiled = _dense_network(150, 0).compile()
+    sparsifier = Sparsifier(compiled, 0.5, seed=0)
+    flows, info = sparsifier.steady_flows(exact=True, tol=1e-12)
+    np.testing.assert_allclose(flows, _exact_flows(compiled), atol=1e-9)
+    assert_less(info['iterations'], 30)
+    assert_less(info['error_bound'].max(), 1e-8)
+
+
+def test_given_resistances_and_bridges():
+    # two cliques joined by a bridge, which must be kept
+    graph = nx.barbell_graph(30, 0)
+    net = LinearFlowNetwork(graph, np.zeros(60), 1.)
+    compiled = net.compile()
+    bridge = compiled.edges().index((29, 30))
+    kept, weights = sample_edges(compiled, 0.5, resistances=edge_resistances(compiled), seed=0)
+    assert_in(bridge, kept)
+    assert_equal(weights[list(kept).index(bridge)], 1.)
+    assert_raises(ValueError, sample_edges, compiled, 1.5)
+
+
+def test_linear_network_mode():
+    net = _dense_network(60, 1)
+    sparsifier = Sparsifier(net, 0.5, seed=1)
+    flows, data = net.steady_flows(sparsifier=sparsifier, extra_output=True)
+    exact = net.steady_flows()
+    for edge, flow in exact.items():
+        assert_less_equal(abs(flows[edge] - flow), data['error_bound'][edge])
+    other = _dense_network(61, 1)
+    assert_raises(ValueError, other.steady_flows, sparsifier=sparsifier)
+
+
+def test_kuramoto_phases():
+    net = _dense_network(60, 2, KuramotoNetwork, scale=2.)
+    sparsifier = Sparsifier(net, 0.5, seed=2)
+    thetas, stable = sparsifier.kuramoto_phases()
+    assert_true(stable)
+    flows, data = net.steady_flows(initguess=thetas, extra_output=True)
+    np.testing.assert_allclose(data['thetas'] - data['thetas'].mean(),
+                               thetas - thetas.mean(), atol=1e-4)
@@ -0,0 +1,96 @@
+from nose.tools import *
+
+from flownetpy import FlowNetwork, LinearFlowNetwork, KuramotoNetwork
+from flownetpy.storage import ResultStore
+
+import shutil
+import tempfile
+import numpy as np
+import networkx as nx
+
+
+class TestNetworkFormat:
+    def setup_method(self, method=None):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.tmpdir)
+
+    setUp = setup_method
+    tearDown = teardown_method
+
+    def test_roundtrip_grid(self):
+        G = nx.grid_2d_graph(4, 5)
+        inputs = np.random.RandomState(0).normal(size=20)
+        net = LinearFlowNetwork(G, inputs - inputs.mean(), weight=2.)
+        net.save(self.tmpdir)
+
+        loaded = FlowNetwork.load(self.tmpdir)
+        assert_is_instance(loaded, LinearFlowNetwork)
+        assert_is_instance(loaded.compile().weights.base, np.memmap)
+        expected = net.steady_flows()
+        flows = loaded.steady_flows()
+        assert(np.allclose([expected[e] - flows[e] for e in G.edges()], 0))
+
+    def test_cycle_basis(self):
+        ring = np.column_stack([np.arange(8), (np.arange(8) + 1) % 8])
+        net = KuramotoNetwork.from_arrays(ring, 10., np.tile([1., -1.], 4))
+        net.save(self.tmpdir, cycle_basis=True)
+
+        loaded = KuramotoNetwork.load(self.tmpdir)
+        assert_equal(len(loaded.compile()._cycle_basis), 1)
+        flows, data = loaded.steady_flows(initguess=np.zeros(8), extra_output=True)
+        assert_almost_equal(data['omega'][0], 0)
+
+    def test_string_labels(self):
+        G = nx.path_graph(['a', 'b', 'c'])
+        LinearFlowNetwork(G, {'a': 1, 'b': 0, 'c': -1}, weight=1.).save(self.tmpdir)
+        loaded = LinearFlowNetwork.load(self.tmpdir, mmap_mode=None)
+        assert_almost_equal(loaded.steady_flows()[('a', 'b')], 1)
+
+
+class TestResultStore:
+    def setup_method(self, method=None):
+        self.tmpdir = tempfile.mkdtemp()
+        ring = np.column_stack([np.arange(6), (np.arange(6) + 1) % 6])
+        self.net = LinearFlowNetwork.from_arrays(ring, 1., np.zeros(6))
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.tmpdir)
+
+    setUp = setup_method
+    tearDown = teardown_method
+
+    def test_append_and_reopen(self):
+        store = ResultStore.create(self.tmpdir, self.net, fields=('flows', 'inputs'))
+        store.append(np.arange(6.), inputs=np.ones(6))
+        store.append(np.ones((3, 6)), inputs=np.zeros((3, 6)))
+        store.append(None)
+
+        reopened = ResultStore(self.tmpdir)
+        assert_equal(len(reopened), 5)
+        assert(np.allclose(reopened['flows'][0], np.arange(6)))
+        assert(np.allclose(reopened['inputs'][1:4], 0))
+        assert(np.isnan(reopened['flows'][4]).all())
+
+    def test_append_batch_with_missing_fields(self):
+        store = ResultStore.create(self.tmpdir, self.net, fields=('flows', 'thetas', 'inputs'))
+        store.append(np.ones((3, 6)), inputs=np.zeros((3, 6)))
+        store.append(None, thetas=np.ones((2, 6)))
+        assert_equal(len(store), 5)
+        assert(np.isnan(store['thetas'][:3]).all())
+        assert(np.isnan(store['flows'][3:]).all() and np.isnan(store['inputs'][3:]).all())
+        assert(np.allclose(store['thetas'][3:], 1))
+        assert_raises(ValueError, store.append, np.ones((2, 6)), inputs=np.ones((3, 6)))
+
+    def test_torn_write_is_dropped(self):
+        store = ResultStore.create(self.tmpdir, self.net)
+        store.append(np.ones(6))
+        with open(self.tmpdir + '/flows.bin', 'ab') as f:
+            f.write(b'garbage')
+        store.append(2 * np.ones(6))
+        assert(np.allclose(ResultStore(self.tmpdir)['flows'], [[1] * 6, [2] * 6]))
+
+    @raises(ValueError)
+    def test_unknown_field(self):
+        ResultStore.create(self.tmpdir, self.net).append(np.ones(6), thetas=np.ones(6))
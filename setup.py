@@ -84,14 +84,19 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.2',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
 
+    # the lazy imports use a module __getattr__ (3.7), the ensemble runner
+    # multiprocessing.shared_memory (3.8)
+    python_requires='>=3.8',
+
     # What does your project relate to?
     keywords=['network science', 'graph theory', 'flow networks'], 
 
@@ -111,6 +116,7 @@ setup(
     # $ pip install -e .[dev,test]
     extras_require={
         'test': ['nose', 'hypothesis'],
+        'parquet': ['pyarrow'],
     },
     
     setup_requires=['setuptools_scm'],
@@ -128,4 +134,9 @@ setup(
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
+    entry_points={
+        'console_scripts': [
+            'flownetpy = flownetpy.cli:main',
+        ],
+    },
 )